@@ -1,5 +1,7 @@
 """MetaGenScope API constants."""
 
 PAGE_SIZE = 20
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000  # rows fetched and serialized at a time by streamed listings
 
 URL_PREFIX = '/api/v1'
@@ -1,5 +1,9 @@
 """MetaGenScope custom renderers that wraps responses in envelope."""
 
+import gzip
+import json
+
+from flask import current_app
 from flask_api.renderers import JSONRenderer
 
 
@@ -19,3 +23,27 @@ class EnvelopeJSONRenderer(JSONRenderer):  # pylint: disable=too-few-public-meth
             response['status'] = 'success'
             response['data'] = data
         return super(EnvelopeJSONRenderer, self).render(response, media_type, **options)
+
+
+def stream_envelope(data, stream_key, fragments, content_encoding='identity'):
+    """Yield a success envelope around pre-serialized JSON fragments.
+
+    `data` is rendered as usual while the already-encoded `fragments` are
+    written through untouched as the value of `data[stream_key]`. With a
+    gzip `content_encoding` the fragments must form a gzip stream of their
+    own; the rest of the envelope is written as separate gzip members,
+    which decoders concatenate.
+    """
+    def dumps(value):
+        """Encode a value the same way the envelope renderer would."""
+        return json.dumps(value, cls=current_app.json_encoder, ensure_ascii=False)
+
+    head = ''.join(f'{dumps(key)}: {dumps(value)}, ' for key, value in data.items())
+    head = f'{{"status": "success", "data": {{{head}{dumps(stream_key)}: '.encode('utf-8')
+    tail = '}}'.encode('utf-8')
+    if content_encoding == 'gzip':
+        head, tail = gzip.compress(head), gzip.compress(tail)
+    yield head
+    for fragment in fragments:
+        yield fragment
+    yield tail
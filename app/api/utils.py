@@ -0,0 +1,186 @@
+"""Utilities shared by the API endpoints."""
+
+import json
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+from uuid import UUID
+
+from flask import current_app, request, stream_with_context
+from flask_api.exceptions import ParseError
+from sqlalchemy import or_, tuple_
+
+from app.api.constants import MAX_PAGE_SIZE, PAGE_SIZE, STREAM_BATCH_SIZE
+from app.authentication import OrganizationMembership
+from app.db_models import Sample, SampleGroup
+from app.db_models.sample_models import METADATA_OPERATORS
+from app.extensions import db
+
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(created_at, uuid):
+    """Return an opaque cursor pointing after the row with created_at and uuid."""
+    position = [created_at.strftime(CURSOR_TIME_FORMAT), str(uuid)]
+    return urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the created_at and uuid encoded in cursor."""
+    try:
+        created_at, uuid = json.loads(urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.strptime(created_at, CURSOR_TIME_FORMAT), UUID(uuid)
+    except (BinasciiError, UnicodeError, TypeError, ValueError):
+        raise ParseError('Invalid cursor.')
+
+
+def get_page_args():
+    """Return the page size and decoded cursor, or None, from the query string.
+
+    `?limit=` defaults to PAGE_SIZE and may not exceed MAX_PAGE_SIZE,
+    `?cursor=` is the `next_cursor` of the previous page.
+    """
+    try:
+        limit = int(request.args.get('limit', PAGE_SIZE))
+    except ValueError:
+        raise ParseError('Invalid limit.')
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ParseError(f'Limit must be between 1 and {MAX_PAGE_SIZE}.')
+    cursor = request.args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+
+def visible_group_criterion(authn):
+    """Return a criterion matching sample groups that are public or belong to the user's organizations."""
+    visible = SampleGroup.is_public
+    if authn is not None:
+        organization_uuids = db.session.query(OrganizationMembership.organization_uuid) \
+            .filter(OrganizationMembership.user_uuid == authn.sub)
+        visible = or_(visible, SampleGroup.organization_uuid.in_(organization_uuids.subquery()))
+    return visible
+
+
+def visible_samples(authn):
+    """Return a query of the samples in libraries that are public or belong to the user's organizations."""
+    return Sample.query \
+        .join(SampleGroup, Sample.library_uuid == SampleGroup.uuid) \
+        .filter(SampleGroup.is_library, visible_group_criterion(authn))
+
+
+def metadata_criteria(filters):
+    """Return criteria for metadata filters given as pairs of `<key>[__<op>]` and value.
+
+    See `Sample.metadata_criterion` for the operators. JSON values other
+    than strings are compared by their JSON text, and lists may be given
+    for `in`.
+    """
+
+    def as_text(value):
+        """Return value as the text of a query argument."""
+        return value if isinstance(value, str) else json.dumps(value)
+
+    criteria = []
+    for name, value in filters:
+        key, separator, op = name.rpartition('__')
+        if not separator or op not in METADATA_OPERATORS:
+            key, op = name, 'eq'
+        if not key:
+            raise ParseError(f'Invalid metadata filter \'{name}\'.')
+        if isinstance(value, list):
+            value = ','.join(as_text(each) for each in value)
+        criteria.append(Sample.metadata_criterion(key, op, as_text(value)))
+    return criteria
+
+
+def get_sample_fields():
+    """Return the sample fields named by the `fields` query argument, all by default."""
+    fields = request.args.get('fields')
+    if fields is None:
+        return Sample.serializable_fields
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    invalid = [field for field in fields if field not in Sample.serializable_fields]
+    if invalid:
+        raise ParseError(f'Invalid sample fields: {", ".join(invalid)}.')
+    return fields
+
+
+def _sample_keyset_query(query, fields, cursor):
+    """Return query selecting fields of its samples in keyset order, after cursor."""
+    query = query \
+        .with_entities(*Sample.serializable_columns(fields)) \
+        .order_by(Sample.created_at, Sample.uuid)
+    if cursor:
+        query = query.filter(tuple_(Sample.created_at, Sample.uuid) > cursor)
+    return query
+
+
+def get_sample_page(query):
+    """Return a page of the samples matched by query, keeping only the requested fields.
+
+    Samples are ordered by creation time. Pass the `next_cursor` of a page
+    as `cursor` to get the next one.
+    """
+    limit, cursor = get_page_args()
+    fields = get_sample_fields()
+    query = _sample_keyset_query(query, fields, cursor)
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].uuid)
+    return {
+        'samples': Sample.serializable_rows(rows, fields),
+        'next_cursor': next_cursor,
+    }
+
+
+def sample_ndjson_response(query):
+    """Return a response streaming the samples matched by query as lines of JSON.
+
+    Accepts the query arguments of `get_sample_page`, but every sample after
+    the cursor, or the first `limit`, is written. Rows are read from a
+    server side cursor and serialized STREAM_BATCH_SIZE at a time.
+    """
+    limit, cursor = get_page_args()
+    fields = get_sample_fields()
+    query = _sample_keyset_query(query, fields, cursor)
+    if 'limit' in request.args:
+        query = query.limit(limit)
+
+    def lines():
+        """Yield each sample encoded the same way the envelope renderer would."""
+        batch = []
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            batch.append(row)
+            if len(batch) == STREAM_BATCH_SIZE:
+                for sample in Sample.serializable_rows(batch, fields):
+                    yield json.dumps(sample, cls=current_app.json_encoder) + '\n'
+                batch = []
+        for sample in Sample.serializable_rows(batch, fields):
+            yield json.dumps(sample, cls=current_app.json_encoder) + '\n'
+
+    return current_app.response_class(
+        stream_with_context(lines()),
+        status=200,
+        mimetype='application/x-ndjson',
+    )
+
+
+def ndjson_response(stmt):
+    """Return a response streaming each row of stmt as a line of JSON.
+
+    Rows are read from a server side cursor as the response is written.
+    """
+    def lines():
+        """Yield each row encoded the same way the envelope renderer would."""
+        rows = db.session.execute(stmt.execution_options(stream_results=True))
+        for row in rows:
+            yield json.dumps(dict(row), cls=current_app.json_encoder) + '\n'
+
+    return current_app.response_class(
+        stream_with_context(lines()),
+        status=200,
+        mimetype='application/x-ndjson',
+    )
@@ -1,42 +1,95 @@
 """Analysis Result API endpoint definitions."""
 
+import json
+
 from uuid import UUID
 from os import environ
 
-from flask import Blueprint, request
+from flask import Blueprint, current_app, request, stream_with_context
 from flask_api.exceptions import NotFound, ParseError
+from sqlalchemy import and_, select, tuple_, union_all
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm.exc import NoResultFound
 
+from app.api.renderers import stream_envelope
+from app.api.utils import encode_cursor, get_page_args, ndjson_response
+from app.extensions import db
 from app.db_models import (
+    AnalysisResult,
     SampleAnalysisResult,
+    SampleAnalysisResultField,
     SampleGroupAnalysisResult,
+    SampleGroupAnalysisResultField,
     SampleGroup,
     Sample,
 )
+from app.db_models.constants import ANALYSIS_RESULT_STATUSES
 
 
 analysis_results_blueprint = Blueprint('analysis_results', __name__)  # pylint: disable=invalid-name
 
 
 def get_analysis_result(uuid):
-    uuid = UUID(uuid)
-    analysis_result = SampleAnalysisResult.query.filter_by(uuid=uuid).first()
-    if not analysis_result:
-        analysis_result = SampleGroupAnalysisResult.query.filter_by(uuid=uuid).first()
-    return analysis_result
+    """Return the sample or sample group analysis result with uuid, or None."""
+    return AnalysisResult.from_any_uuid(UUID(uuid))
+
+
+def get_slice_args():
+    """Return the field data path and keys requested in the query string.
+
+    `?path=` is a dot separated path into the data, `?keys=` a comma separated
+    list of members to pick from the value found there.
+    """
+    path = request.args.get('path', '').split('.')
+    keys = request.args.get('keys', '').split(',')
+    return tuple(step for step in path if step), tuple(key for key in keys if key)
 
 
 @analysis_results_blueprint.route('/analysis_results/<result_uuid>/<field_name>', methods=['GET'])
 def get_single_result_field(result_uuid, field_name):
-    """Get a single field analysis result."""
+    """Get a single field analysis result.
+
+    The field data is streamed from storage rather than decoded and re-encoded,
+    unless only a slice of it was requested. Compressed data is sent without
+    being decompressed to clients whose Accept-Encoding allows it.
+    """
     try:
-        analysis_result = get_analysis_result(result_uuid)
-        result = analysis_result.field(field_name).serializable()
-        return result, 200
+        field = AnalysisResult.field_from_any_uuid(UUID(result_uuid), field_name)
     except ValueError:
         raise ParseError('Invalid UUID provided.')
-    except DoesNotExist:
-        raise NotFound('Analysis Result does not exist.')
+    if field is None:
+        analysis_result = get_analysis_result(result_uuid)
+        if not analysis_result:
+            raise NotFound('Analysis Result does not exist.')
+        field = analysis_result.field(field_name)
+    path, keys = get_slice_args()
+    if path or keys:
+        field_type = type(field)
+        data = field_type.sliced_data(field_type.uuid == field.uuid, path=path, keys=keys)
+        result = {
+            'analysis_result_field': field.serializable_field(),
+            'data': data[field_name],
+        }
+        return result, 200
+    # Hand compressed payloads to clients that accept them exactly as stored
+    content_encoding = 'identity'
+    if field.content_encoding != 'identity' and request.accept_encodings[field.content_encoding]:
+        content_encoding = field.content_encoding
+    body = stream_envelope(
+        {'analysis_result_field': field.serializable_field()},
+        'data',
+        field.stream_data(decompress=content_encoding == 'identity'),
+        content_encoding=content_encoding,
+    )
+    response = current_app.response_class(
+        stream_with_context(body),
+        status=200,
+        mimetype='application/json',
+    )
+    response.vary.add('Accept-Encoding')
+    if content_encoding != 'identity':
+        response.headers['Content-Encoding'] = content_encoding
+    return response
 
 
 @analysis_results_blueprint.route('/analysis_results/<result_uuid>', methods=['GET'])
@@ -44,23 +97,102 @@ def get_single_result(result_uuid):
     """Get single analysis result."""
     try:
         analysis_result = get_analysis_result(result_uuid)
-        result = analysis_result.serializable()
-        return result, 200
     except ValueError:
         raise ParseError('Invalid UUID provided.')
-    except DoesNotExist:
+    if not analysis_result:
         raise NotFound('Analysis Result does not exist.')
+    result = analysis_result.serializable()
+    return result, 200
 
 
 @analysis_results_blueprint.route('/analysis_results', methods=['GET'])
 def get_all_analysis_results():
-    """Get all analysis result models."""
+    """Get a page of analysis results, without their field data.
+
+    Results are ordered by creation time and may be filtered by the
+    `module_name`, `status` and `kind` query arguments. Pass the `next_cursor`
+    of a page as `cursor` to get the next one. With `format=ndjson` every
+    matching result, or the first `limit`, is streamed one per line instead.
+    """
+    kind = request.args.get('kind')
+    result_types = [
+        result_type for result_type in (SampleAnalysisResult, SampleGroupAnalysisResult)
+        if kind in (None, result_type.kind)
+    ]
+    if not result_types:
+        raise ParseError('Invalid kind.')
+    status = request.args.get('status')
+    if status is not None and status not in ANALYSIS_RESULT_STATUSES:
+        raise ParseError('Invalid status.')
+    module_name = request.args.get('module_name')
+    limit, cursor = get_page_args()
+
+    summaries = union_all(*[
+        result_type.summary_select(module_name=module_name, status=status)
+        for result_type in result_types
+    ]).alias('analysis_results')
+    stmt = select([summaries]).order_by(summaries.c.created_at, summaries.c.uuid)
+    if cursor:
+        stmt = stmt.where(tuple_(summaries.c.created_at, summaries.c.uuid) > cursor)
+    if request.args.get('format') == 'ndjson':
+        if 'limit' in request.args:
+            stmt = stmt.limit(limit)
+        return ndjson_response(stmt)
+
+    rows = db.session.execute(stmt.limit(limit + 1)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].uuid)
+    result = {
+        'analysis_results': [dict(row) for row in rows],
+        'next_cursor': next_cursor,
+    }
+    return result, 200
+
+
+def upsert_fields_or_fail(result_type, fields_by_result):
+    """Upsert fields, rolling back and raising ParseError for data that cannot be stored."""
     try:
-        result = [ar.serializable() for ar in SampleAnalysisResult.all()]
-        result += [ar.serializable() for ar in SampleGroupAnalysisResult.all()]
-        return result, 200
-    except DoesNotExist:
-        raise NotFound('Analysis Result does not exist.')
+        return result_type.upsert_fields(fields_by_result)
+    except ValueError as value_error:
+        db.session.rollback()
+        raise ParseError(str(value_error))
+
+
+def upsert_result_field(result_type, parent_uuid, module_name, field_name):
+    """Store the payload in one field, creating the analysis result if needed."""
+    try:
+        data = request.get_json()[field_name]
+    except TypeError:
+        raise ParseError('Missing registration payload.')
+    except KeyError:
+        raise ParseError('Invalid registration payload.')
+    key = (parent_uuid, module_name)
+    _, field_uuids = upsert_fields_or_fail(result_type, {key: {field_name: data}})[key]
+    db.session.commit()
+    field = result_type._field_type().query.get(field_uuids[field_name])  # pylint: disable=protected-access
+    result = field.serializable()
+    return result, 201
+
+
+def upsert_result_fields(result_type, parent_uuid, module_name):
+    """Store every field in the request payload in one transaction."""
+    post_data = request.get_json()
+    if not isinstance(post_data, dict) or not post_data:
+        raise ParseError('Missing registration payload.')
+    key = (parent_uuid, module_name)
+    analysis_result_uuid, field_uuids = upsert_fields_or_fail(result_type, {key: post_data})[key]
+    db.session.commit()
+    result = {
+        'analysis_result': {
+            'uuid': analysis_result_uuid,
+            'module_name': module_name,
+            'kind': result_type.kind,
+            'fields': field_uuids,
+        },
+    }
+    return result, 201
 
 
 BY_NAME_URL = '/analysis_results/byname/<lib_name>/<sample_name>/<module_name>'
@@ -69,17 +201,26 @@ BY_NAME_URL = '/analysis_results/byname/<lib_name>/<sample_name>/<module_name>'
 @analysis_results_blueprint.route(BY_NAME_URL, methods=['GET'])
 def get_analysis_result_fields_by_name(lib_name, sample_name, module_name):
     """Get all fields of the specified analysis result."""
-    try:
-        library = SampleGroup.from_name(lib_name)
-        sample = Sample.from_name_library(sample_name, library.uuid)
-        analysis_result = SampleAnalysisResult.from_name_sample(module_name, sample.uuid)
-        result = {
-            field.field_name: field.data
-            for field in analysis_result.module_fields
-        }
-        return result, 200
-    except NoResultFound:
-        raise NotFound('Analysis Result does not exist.')
+    path, keys = get_slice_args()
+    field_type = SampleAnalysisResultField
+    criterion = and_(
+        SampleGroup.name == lib_name,
+        Sample.library_uuid == SampleGroup.uuid,
+        Sample.name == sample_name,
+        SampleAnalysisResult.sample_uuid == Sample.uuid,
+        SampleAnalysisResult.module_name == module_name,
+        field_type.sample_analysis_result_uuid == SampleAnalysisResult.uuid,
+    )
+    result = field_type.sliced_data(criterion, path=path, keys=keys)
+    if not result:
+        # Tell a result without fields from one that does not exist
+        try:
+            library_uuid = SampleGroup.uuid_from_name(lib_name)
+            sample_uuid = Sample.uuid_from_name_library(sample_name, library_uuid)
+            SampleAnalysisResult.uuid_from_name_sample(module_name, sample_uuid)
+        except NoResultFound:
+            raise NotFound('Analysis Result does not exist.')
+    return result, 200
 
 
 def _build_s3_uri(library_name, sample_name, module_name, field_name, ext=''):
@@ -121,21 +262,125 @@ def post_analysis_result_field_by_name(lib_name, sample_name, module_name, field
     the sample or library.
     """
     try:
-        library = SampleGroup.from_name(lib_name)
-        sample = Sample.from_name_library(sample_name, library.uuid)
+        library_uuid = SampleGroup.uuid_from_name(lib_name)
+        sample_uuid = Sample.uuid_from_name_library(sample_name, library_uuid)
     except NoResultFound:
         raise NotFound('Analysis Result does not exist.')
+    return upsert_result_field(SampleAnalysisResult, sample_uuid, module_name, field_name)
+
+
+@analysis_results_blueprint.route(BY_NAME_URL, methods=['POST'])
+def post_analysis_result_fields_by_name(lib_name, sample_name, module_name):
+    """Store every field in the payload in the specified analysis result at once.
+
+    Create the analysis result if it does not exist but do not create
+    the sample or library.
+    """
     try:
-        analysis_result = sample.analysis_result(module_name)
-        post_data = request.get_json()
-        field = analysis_result.field(field_name)
-        field.set_data(post_data[field_name])
-        result = field.serializable()
-        return result, 201
-    except TypeError:
-        raise ParseError('Missing registration payload.')
-    except KeyError:
-        raise ParseError('Invalid registration payload.')
+        library_uuid = SampleGroup.uuid_from_name(lib_name)
+        sample_uuid = Sample.uuid_from_name_library(sample_name, library_uuid)
+    except NoResultFound:
+        raise NotFound('Analysis Result does not exist.')
+    return upsert_result_fields(SampleAnalysisResult, sample_uuid, module_name)
+
+
+def read_bulk_records(stream):
+    """Yield the line number and record, or error message, of each NDJSON line."""
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not all(isinstance(record[key], str) for key in ('sample', 'module', 'field')):
+                raise TypeError
+            record['data']  # pylint: disable=pointless-statement
+        except ValueError:
+            yield line_number, None, 'Invalid JSON.'
+        except (KeyError, TypeError):
+            yield line_number, None, 'Records need sample, module, field and data.'
+        else:
+            yield line_number, record, None
+
+
+def bulk_error(exc):
+    """Return the message of a database or data error for a bulk ingestion report."""
+    return str(getattr(exc, 'orig', None) or exc).strip()
+
+
+def ingest_bulk_batch(library_uuid, batch, sample_uuids, errors):
+    """Upsert a batch of records, recording the lines that could not be stored.
+
+    `sample_uuids` caches resolved sample names across batches. If upserting
+    the batch whole fails it is retried one analysis result at a time, and
+    the records of a failing result are retried one at a time.
+    """
+    missing_names = {record['sample'] for _, record in batch} - set(sample_uuids)
+    if missing_names:
+        query = db.session.query(Sample.name, Sample.uuid) \
+            .filter(Sample.library_uuid == library_uuid, Sample.name.in_(missing_names))
+        sample_uuids.update(query)
+    fields_by_result, records_by_result = {}, {}
+    for line_number, record in batch:
+        if record['sample'] not in sample_uuids:
+            errors.append({'line': line_number, 'error': 'Sample does not exist.'})
+            continue
+        key = (sample_uuids[record['sample']], record['module'])
+        fields_by_result.setdefault(key, {})[record['field']] = record['data']
+        records_by_result.setdefault(key, []).append((line_number, record['field'], record['data']))
+    try:
+        with db.session.begin_nested():
+            SampleAnalysisResult.upsert_fields(fields_by_result)
+        return sum(len(records) for records in records_by_result.values())
+    except (SQLAlchemyError, ValueError):
+        pass
+    stored = 0
+    for key, fields in fields_by_result.items():
+        try:
+            with db.session.begin_nested():
+                SampleAnalysisResult.upsert_fields({key: fields})
+            stored += len(records_by_result[key])
+            continue
+        except (SQLAlchemyError, ValueError):
+            pass
+        for line_number, field_name, data in records_by_result[key]:
+            try:
+                with db.session.begin_nested():
+                    SampleAnalysisResult.upsert_fields({key: {field_name: data}})
+                stored += 1
+            except (SQLAlchemyError, ValueError) as exc:
+                errors.append({'line': line_number, 'error': bulk_error(exc)})
+    return stored
+
+
+@analysis_results_blueprint.route('/analysis_results/byname/<lib_name>/bulk', methods=['POST'])
+def post_bulk_analysis_results_by_name(lib_name):
+    """Store analysis result fields for many samples of a library at once.
+
+    The body is an NDJSON stream of `{"sample", "module", "field", "data"}`
+    records, upserted in batches of BULK_INGEST_BATCH_SIZE. Records that
+    cannot be stored are reported by line number without aborting the rest.
+    """
+    try:
+        library_uuid = SampleGroup.uuid_from_name(lib_name)
+    except NoResultFound:
+        raise NotFound('Sample Group does not exist.')
+    batch_size = current_app.config['BULK_INGEST_BATCH_SIZE']
+    stored, errors, batch, sample_uuids = 0, [], [], {}
+    for line_number, record, error in read_bulk_records(request.stream):
+        if error:
+            errors.append({'line': line_number, 'error': error})
+            continue
+        batch.append((line_number, record))
+        if len(batch) >= batch_size:
+            stored += ingest_bulk_batch(library_uuid, batch, sample_uuids, errors)
+            db.session.commit()
+            batch = []
+    if batch:
+        stored += ingest_bulk_batch(library_uuid, batch, sample_uuids, errors)
+        db.session.commit()
+    errors.sort(key=lambda error: error['line'])
+    result = {'stored': stored, 'errors': errors}
+    return result, 200
 
 
 BY_GROUP_NAME_URL = '/analysis_results/byname/group/<group_name>/<module_name>'
@@ -144,16 +389,23 @@ BY_GROUP_NAME_URL = '/analysis_results/byname/group/<group_name>/<module_name>'
 @analysis_results_blueprint.route(BY_GROUP_NAME_URL, methods=['GET'])
 def get_group_analysis_result_fields_by_name(group_name, module_name):
     """Get all fields of the specified analysis result."""
-    try:
-        group = SampleGroup.from_name(group_name)
-        analysis_result = SampleGroupAnalysisResult.from_name_group(module_name, group.uuid)
-        result = {
-            field.field_name: field.data
-            for field in analysis_result.module_fields
-        }
-        return result, 200
-    except NoResultFound:
-        raise NotFound('Analysis Result does not exist.')
+    path, keys = get_slice_args()
+    field_type = SampleGroupAnalysisResultField
+    criterion = and_(
+        SampleGroup.name == group_name,
+        SampleGroupAnalysisResult.sample_group_uuid == SampleGroup.uuid,
+        SampleGroupAnalysisResult.module_name == module_name,
+        field_type.sample_group_analysis_result_uuid == SampleGroupAnalysisResult.uuid,
+    )
+    result = field_type.sliced_data(criterion, path=path, keys=keys)
+    if not result:
+        # Tell a result without fields from one that does not exist
+        try:
+            group_uuid = SampleGroup.uuid_from_name(group_name)
+            SampleGroupAnalysisResult.uuid_from_name_group(module_name, group_uuid)
+        except NoResultFound:
+            raise NotFound('Analysis Result does not exist.')
+    return result, 200
 
 
 def _build_group_s3_uri(library_name, module_name, field_name, ext=''):
@@ -184,6 +436,20 @@ def get_group_s3_uri_for_specified_analyis_result_field(group_name, module_name,
     return result, 200
 
 
+@analysis_results_blueprint.route(BY_GROUP_NAME_URL, methods=['POST'])
+def post_group_analysis_result_fields_by_name(group_name, module_name):
+    """Store every field in the payload in the specified analysis result at once.
+
+    Create the analysis result if it does not exist but do not create
+    the sample group.
+    """
+    try:
+        group_uuid = SampleGroup.uuid_from_name(group_name)
+    except NoResultFound:
+        raise NotFound('Analysis Result does not exist.')
+    return upsert_result_fields(SampleGroupAnalysisResult, group_uuid, module_name)
+
+
 @analysis_results_blueprint.route(BY_GROUP_NAME_URL + '/<field_name>', methods=['POST'])
 def post_group_analysis_result_field_by_name(group_name, module_name, field_name):
     """Store the payload in the specified analysis result field.
@@ -192,17 +458,7 @@ def post_group_analysis_result_field_by_name(group_name, module_name, field_name
     the sample or library.
     """
     try:
-        group = SampleGroup.from_name(group_name)
+        group_uuid = SampleGroup.uuid_from_name(group_name)
     except NoResultFound:
         raise NotFound('Analysis Result does not exist.')
-    try:
-        analysis_result = group.analysis_result(module_name)
-        post_data = request.get_json()
-        field = analysis_result.field(field_name)
-        field.set_data(post_data[field_name])
-        result = field.serializable()
-        return result, 201
-    except TypeError:
-        raise ParseError('Missing registration payload.')
-    except KeyError:
-        raise ParseError('Invalid registration payload.')
+    return upsert_result_field(SampleGroupAnalysisResult, group_uuid, module_name, field_name)
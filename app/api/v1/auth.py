@@ -10,7 +10,7 @@ from sqlalchemy.orm.exc import NoResultFound
 
 from app.api.constants import PAGE_SIZE
 from app.api.exceptions import InvalidRequest, InternalError
-from app.extensions import db, bcrypt
+from app.extensions import db
 from app.authentication import (
     User,
     Organization,
@@ -20,7 +20,9 @@ from app.authentication.helpers import (
     encode_auth_token,
     authenticate,
     fetch_organization,
+    has_role,
 )
+from app.authentication.passwords import check_password
 
 
 auth_blueprint = Blueprint('auth', __name__)  # pylint: disable=invalid-name
@@ -81,7 +83,7 @@ def login_user():
     user = User.query.filter_by(email=email).first()
     password_authentication = getattr(user, 'password_authentication', None)
     password_hash = getattr(password_authentication, 'password', None)
-    if password_hash and bcrypt.check_password_hash(password_hash, password):
+    if password_hash and check_password(password_hash, password):
         auth_token = encode_auth_token(user)
         if auth_token:
             result = {'auth_token': auth_token.decode()}
@@ -141,9 +143,12 @@ def get_organizations():
 
     limit = request.args.get('limit', PAGE_SIZE)
     offset = request.args.get('offset', 0)
-    organizations = Organization.query.all()
-    organizations = sorted(organizations, key=lambda el: str(User.created_at))
-    organizations = organizations[offset:(offset + limit)]
+    organizations = Organization.query \
+        .options(*Organization.serializable_options()) \
+        .order_by(asc(Organization.created_at), asc(Organization.uuid)) \
+        .offset(offset) \
+        .limit(limit) \
+        .all()
     result = {'organizations': [org.serializable() for org in organizations]}
     return result, 200
 
@@ -181,8 +186,8 @@ def add_organization_user(authn, organization_uuid):     # pylint: disable=too-m
     except NoResultFound:
         raise NotFound('User does not exist')
 
-    if admin.uuid in organization.admin_uuids():
-        if user.uuid in organization.reader_uuids():
+    if has_role(organization.uuid, admin.uuid, 'admin', authn=authn):
+        if has_role(organization.uuid, user.uuid, 'read'):
             raise InvalidRequest('User is already part of organization.')
         role = post_data.get('role', 'read')
         try:
@@ -200,10 +205,12 @@ def add_organization_user(authn, organization_uuid):     # pylint: disable=too-m
 def get_organization_users(authn, organization_uuid):
     """Get single organization's users."""
     org = Organization.from_uuid(organization_uuid)
-    authn_user = User.from_uuid(authn.sub) if authn else None
-    if (authn_user and authn_user.uuid in org.reader_uuids()) or org.is_public:
+    if org.is_public or (authn and has_role(org.uuid, authn.sub, 'read', authn=authn)):
+        users = User.query \
+            .filter(User.memberships.any(organization_uuid=org.uuid)) \
+            .options(*User.serializable_options())
         result = {
-            'users': [user.serializable() for user in org.users],
+            'users': [user.serializable() for user in users],
         }
         return result, 200
     raise PermissionDenied('You do not have permission to see that group.')
@@ -3,6 +3,10 @@
 
 from flask import Blueprint, jsonify
 
+from app.authentication.user_cache import ACTIVE_USER_CACHE
+from app.db_models.analysis_result_models import FIELD_DATA_CACHE, RESULT_KIND_CACHE
+from app.db_models.name_cache import NAME_CACHE
+
 
 # pylint: disable=invalid-name
 ping_blueprint = Blueprint('ping', __name__)
@@ -10,8 +14,18 @@ ping_blueprint = Blueprint('ping', __name__)
 
 @ping_blueprint.route('/ping', methods=['GET'])
 def ping_pong():
-    """Respond to ping."""
+    """Respond to ping.
+
+    Also report the hit and miss counts and sizes of the in-process caches
+    of the worker that answered.
+    """
     return jsonify({
         'status': 'success',
-        'message': 'pong!'
+        'message': 'pong!',
+        'caches': {
+            'active_users': ACTIVE_USER_CACHE.info(),
+            'field_data': FIELD_DATA_CACHE.info(),
+            'names': NAME_CACHE.info(),
+            'result_kinds': RESULT_KIND_CACHE.info(),
+        },
     })
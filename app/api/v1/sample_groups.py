@@ -1,24 +1,41 @@
 """Sample Group API endpoint definitions."""
 
-from io import StringIO
+import json
+import tempfile
+import time
+
 from uuid import UUID
-from csv import DictReader
 
-from flask import Blueprint, current_app, request
+import numpy
+from flask import Blueprint, current_app, request, stream_with_context
 from flask_api.exceptions import ParseError, NotFound, PermissionDenied
 from mongoengine.errors import ValidationError, DoesNotExist
-from sqlalchemy import func, and_, or_, asc
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, and_, or_, asc, except_, intersect, select, union
+from sqlalchemy.exc import DataError, IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
-from app.db_models import SampleGroup, Sample
+from app.db_models import MetadataUploadJob, SampleGroup, Sample
+from app.db_models.sample_group_models import FieldMatrixTooLarge, sample_group_samples
 
 from app.api.constants import PAGE_SIZE
 from app.api.exceptions import InvalidRequest, InternalError
+from app.api.renderers import stream_envelope
+from app.api.utils import (
+    get_sample_page,
+    metadata_criteria,
+    visible_group_criterion,
+    visible_samples,
+)
 from app.extensions import db
-from app.authentication import User, Organization
-from app.authentication.helpers import authenticate, fetch_organization
-from app.utils import XLSDictReader
+from app.authentication import Organization
+from app.authentication.helpers import authenticate, fetch_organization, has_role
+from app.tasks import ingest_metadata
+from app.utils import (
+    METADATA_SHEET_ERRORS,
+    metadata_sample_name,
+    metadata_sheet_format,
+    read_metadata_sheet,
+)
 
 
 sample_groups_blueprint = Blueprint('sample_groups', __name__)  # pylint: disable=invalid-name
@@ -38,8 +55,7 @@ def add_sample_group(authn):  # pylint: disable=too-many-locals
         raise ParseError(f'Missing Sample Group creation payload.\n{exc}')
     except KeyError:
         raise ParseError('Invalid Sample Group creation payload.')
-    authn_user = User.query.filter_by(uuid=authn.sub).first()
-    if authn_user.uuid not in organization.writer_uuids():
+    if not has_role(organization.uuid, authn.sub, 'write', authn=authn):
         raise PermissionDenied('You do not have permission to write to that organization.')
 
     # Create Sample Group
@@ -100,6 +116,98 @@ def get_sample_groups():
 '''
 
 
+SAMPLE_SET_OPERATIONS = {
+    'union': union,
+    'intersection': intersect,
+    'difference': except_,
+}
+
+
+def sample_set_select(expression, authn):
+    """Return a select of the uuids of the samples a sample set expression describes.
+
+    An expression is an object with a single key: `sample_group`, the uuid
+    of a group the user may see, `metadata`, filters on the metadata of
+    visible samples as taken by `GET /samples/query` without the `meta.`
+    prefix, or `union`, `intersection` or `difference` of a list of
+    expressions. A difference removes every later set from the first.
+    """
+    if not isinstance(expression, dict) or len(expression) != 1:
+        raise ParseError('Each sample set must have exactly one of '
+                         'sample_group, metadata, union, intersection or difference.')
+    (kind, value), = expression.items()
+    if kind in SAMPLE_SET_OPERATIONS:
+        if not isinstance(value, list) or not value:
+            raise ParseError(f'The {kind} of sample sets must list at least one set.')
+        operands = [sample_set_select(operand, authn) for operand in value]
+        combined = SAMPLE_SET_OPERATIONS[kind](*operands).alias()
+        return select([list(combined.c)[0]])
+    if kind == 'sample_group':
+        try:
+            group_uuid = UUID(value)
+        except (AttributeError, TypeError, ValueError):
+            raise ParseError('Invalid Sample Group UUID.')
+        visible = db.session.query(SampleGroup.query.filter(
+            SampleGroup.uuid == group_uuid,
+            visible_group_criterion(authn),
+        ).exists()).scalar()
+        if not visible:
+            raise NotFound(f'Sample Group {group_uuid} does not exist')
+        return select([sample_group_samples.c.sample_uuid]) \
+            .where(sample_group_samples.c.sample_group_uuid == group_uuid)
+    if kind == 'metadata':
+        if not isinstance(value, dict) or not value:
+            raise ParseError('Metadata sample sets must have at least one filter.')
+        return visible_samples(authn) \
+            .filter(*metadata_criteria(value.items())) \
+            .with_entities(Sample.uuid) \
+            .statement
+    raise ParseError(f'Unknown sample set \'{kind}\'.')
+
+
+@sample_groups_blueprint.route('/sample_groups/derived', methods=['POST'])
+@authenticate()
+def add_derived_sample_group(authn):
+    """Add a sample group holding the samples described by a sample set expression.
+
+    The payload takes the fields of `POST /sample_groups` and the expression
+    as `samples`; see `sample_set_select`. The members are written by a
+    single `INSERT ... SELECT` and only counted in the response.
+    """
+    try:
+        data = request.get_json()
+        name = data['name']
+        expression = data['samples']
+        organization = Organization.query.filter_by(name=data['organization_name']).one()
+    except TypeError:
+        raise ParseError('Missing Sample Group creation payload.')
+    except KeyError:
+        raise ParseError('Invalid Sample Group creation payload.')
+    except NoResultFound:
+        raise NotFound('Organization does not exist')
+    if not has_role(organization.uuid, authn.sub, 'write', authn=authn):
+        raise PermissionDenied('You do not have permission to write to that organization.')
+    samples = sample_set_select(expression, authn)
+
+    try:
+        sample_group = SampleGroup(
+            name=name,
+            organization_uuid=organization.uuid,
+            description=data.get('description', ''),
+            is_public=data.get('is_public', False),
+        )
+        db.session.add(sample_group)
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        raise ParseError('Duplicate group name.')
+    sample_count = sample_group.add_selected_samples(samples)
+    db.session.commit()
+    result = sample_group.serializable(list_samples=False)
+    result['sample_group']['sample_count'] = sample_count
+    return result, 201
+
+
 @sample_groups_blueprint.route('/sample_groups/<group_uuid>', methods=['GET'])
 def get_single_sample_group(group_uuid):
     """Get single sample group model."""
@@ -154,15 +262,11 @@ def get_samples_for_group(group_uuid):
     """Get single sample group's list of samples."""
     try:
         sample_group = SampleGroup.query.filter_by(uuid=UUID(group_uuid)).one()
-        result = {
-            'samples': [sample.serializable() for sample in sample_group.samples],
-        }
-        return result, 200
     except ValueError:
         raise ParseError('Invalid Sample Group UUID.')
     except NoResultFound:
         raise NotFound('Sample Group does not exist')
-
+    return get_sample_page(Sample.query.with_parent(sample_group, 'samples')), 200
 
 
 @sample_groups_blueprint.route('/sample_groups/byname/<group_name>/samples', methods=['GET'])
@@ -170,20 +274,20 @@ def get_samples_for_group_by_name(group_name):
     """Get single sample group's list of samples."""
     try:
         sample_group = SampleGroup.from_name(group_name)
-        result = {
-            'samples': [sample.serializable() for sample in sample_group.samples],
-        }
-        return result, 200
-    except ValueError:
-        raise ParseError('Invalid Sample Group UUID.')
     except NoResultFound:
         raise NotFound('Sample Group does not exist')
+    return get_sample_page(Sample.query.with_parent(sample_group, 'samples')), 200
 
 
 @sample_groups_blueprint.route('/sample_groups/<group_uuid>/samples', methods=['POST'])
 @authenticate()
 def add_samples_to_group(authn, group_uuid):
-    """Add samples to a sample group."""
+    """Add samples to a sample group.
+
+    Report how many samples were added and the uuids matching no sample.
+    Unless the payload sets `allow_partial`, nothing is added when any uuid
+    matches no sample.
+    """
     try:
         post_data = request.get_json()
         sample_group = SampleGroup.query.filter_by(uuid=UUID(group_uuid)).one()
@@ -191,24 +295,171 @@ def add_samples_to_group(authn, group_uuid):
         raise ParseError('Invalid Sample Group UUID.')
     except NoResultFound:
         raise NotFound('Sample Group does not exist')
-    authn_user = User.query.filter_by(uuid=authn.sub).first()
-    organization = Organization.query.filter_by(uuid=sample_group.organization_uuid).first()
-    if authn_user.uuid not in organization.writer_uuids():
+    if not has_role(sample_group.organization_uuid, authn.sub, 'write', authn=authn):
         raise PermissionDenied('You do not have permission to write to that organization.')
-    for sample_uuid in [UUID(uuid) for uuid in post_data.get('sample_uuids')]:
-        try:
-            sample = Sample.query.filter_by(uuid=sample_uuid).first()
-            sample_group.samples.append(sample)
-        except NoResultFound:
-            raise InvalidRequest(f'Sample UUID \'{sample_uuid}\' does not exist')
-        except IntegrityError as integrity_error:
-            current_app.logger.exception(f'Sample \'{sample_uuid}\' could not be added to Sample Group.')
-            raise InternalError(str(integrity_error))
-    sample_group.save()
-    result = sample_group.serializable()
+    try:
+        sample_uuids = post_data['sample_uuids']
+        allow_partial = post_data.get('allow_partial', False)
+    except TypeError:
+        raise ParseError('Missing Sample UUIDs payload.')
+    except KeyError:
+        raise ParseError('Invalid Sample UUIDs payload.')
+    if not isinstance(sample_uuids, list) or not isinstance(allow_partial, bool):
+        raise ParseError('Invalid Sample UUIDs payload.')
+    if not all(isinstance(uuid, str) for uuid in sample_uuids):
+        raise ParseError('Invalid Sample UUID.')
+    try:
+        sample_uuids = [UUID(uuid) for uuid in sample_uuids]
+    except ValueError:
+        raise ParseError('Invalid Sample UUID.')
+    added, missing_uuids = sample_group.add_samples(sample_uuids)
+    if missing_uuids and not allow_partial:
+        db.session.rollback()
+        missing = ', '.join(str(uuid) for uuid in missing_uuids)
+        raise InvalidRequest(f'Sample UUIDs do not exist: {missing}')
+    db.session.commit()
+    # Reload the group so that only the uuids of its samples are selected
+    result = SampleGroup.from_uuid_serializable(sample_group.uuid).serializable()
+    result['added_count'] = added
+    result['missing_uuids'] = missing_uuids
     return result, 200
 
 
+@sample_groups_blueprint.route('/sample_groups/<group_uuid>/samples/bulk', methods=['POST'])
+@authenticate()
+def add_bulk_samples_to_library(authn, group_uuid):
+    """Create many samples in a library at once.
+
+    The payload lists samples as `{"name": ..., "metadata": {...}}`. Samples
+    that already exist are left unchanged. Return the uuid of every listed
+    sample by name and the names of the samples created.
+    """
+    try:
+        library = SampleGroup.query.filter_by(uuid=UUID(group_uuid)).one()
+    except ValueError:
+        raise ParseError('Invalid Sample Group UUID.')
+    except NoResultFound:
+        raise NotFound('Sample Group does not exist')
+    if not has_role(library.organization_uuid, authn.sub, 'write', authn=authn):
+        raise PermissionDenied('You do not have permission to write to that organization.')
+    try:
+        samples = {
+            entry['name']: entry.get('metadata', {})
+            for entry in request.get_json()['samples']
+        }
+    except TypeError:
+        raise ParseError('Missing Sample creation payload.')
+    except (AttributeError, KeyError):
+        raise ParseError('Invalid Sample creation payload.')
+    if not all(isinstance(name, str) and isinstance(metadata, dict)
+               for name, metadata in samples.items()):
+        raise ParseError('Invalid Sample creation payload.')
+
+    try:
+        uuids, created = library.bulk_samples(samples)
+        db.session.commit()
+    except DataError as data_error:
+        db.session.rollback()
+        raise InvalidRequest(str(data_error.orig))
+    result = {
+        'sample_uuids': uuids,
+        'created': created,
+    }
+    return result, 201
+
+
+@sample_groups_blueprint.route('/sample_groups/<group_uuid>/module_coverage', methods=['GET'])
+def get_sample_group_module_coverage(group_uuid):
+    """Get the number of samples in the group with a result for each module.
+
+    `tools_present` lists the modules every sample has a result for.
+    """
+    try:
+        sample_group = SampleGroup.query.filter_by(uuid=UUID(group_uuid)).one()
+    except ValueError:
+        raise ParseError('Invalid Sample Group UUID.')
+    except NoResultFound:
+        raise NotFound('Sample Group does not exist')
+    sample_count, coverage = sample_group.module_coverage()
+    result = {
+        'sample_count': sample_count,
+        'module_coverage': coverage,
+        'tools_present': sorted(
+            module_name for module_name, count in coverage.items() if count == sample_count
+        ),
+    }
+    return result, 200
+
+
+MATRIX_URL = '/sample_groups/<group_uuid>/analysis_results/<module_name>/<field_name>/matrix'
+MATRIX_STREAM_SIZE = 64 * 1024  # bytes written at a time
+
+
+@sample_groups_blueprint.route(MATRIX_URL, methods=['GET'])
+def get_sample_group_field_matrix(group_uuid, module_name, field_name):
+    """Get a field of every sample in the group as a sparse samples by features matrix.
+
+    The field data of each sample, or the value at the dot separated `?path=`
+    in it, must map feature names to numbers. With `?format=npz` the matrix
+    is sent as a compressed NPZ file in the CSR layout of
+    `scipy.sparse.save_npz`, along with `samples` and `features` arrays.
+    Otherwise a JSON envelope holds `samples`, `features` and, for each
+    sample, the `indices` of its nonzero features and their `values`,
+    written one sample at a time. Groups holding more than
+    MAX_FIELD_MATRIX_VALUES values are refused.
+    """
+    try:
+        sample_group = SampleGroup.query.filter_by(uuid=UUID(group_uuid)).one()
+    except ValueError:
+        raise ParseError('Invalid Sample Group UUID.')
+    except NoResultFound:
+        raise NotFound('Sample Group does not exist')
+    path = tuple(step for step in request.args.get('path', '').split('.') if step)
+    max_values = current_app.config['MAX_FIELD_MATRIX_VALUES']
+    try:
+        sample_names, features, matrix = sample_group.field_matrix(
+            module_name, field_name, path, max_values=max_values,
+        )
+    except FieldMatrixTooLarge as too_large:
+        raise InvalidRequest(str(too_large))
+
+    if request.args.get('format') == 'npz':
+        npz_file = tempfile.TemporaryFile()
+        numpy.savez_compressed(
+            npz_file, samples=numpy.array(sample_names), features=numpy.array(features),
+            format=b'csr', shape=matrix.shape,
+            data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+        )
+        npz_file.seek(0)
+
+        def npz_chunks():
+            """Yield the NPZ file a block at a time, then remove it."""
+            with npz_file:
+                for chunk in iter(lambda: npz_file.read(MATRIX_STREAM_SIZE), b''):
+                    yield chunk
+
+        return current_app.response_class(npz_chunks(), status=200, mimetype='application/x-npz')
+
+    def rows():
+        """Yield the JSON array of sparse sample rows, one row at a time."""
+        yield b'['
+        for row in range(matrix.shape[0]):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            separator = b',' if row else b''
+            yield separator + json.dumps({
+                'indices': matrix.indices[start:end].tolist(),
+                'values': matrix.data[start:end].tolist(),
+            }).encode('utf-8')
+        yield b']'
+
+    body = stream_envelope({'samples': sample_names, 'features': features}, 'rows', rows())
+    return current_app.response_class(
+        stream_with_context(body),
+        status=200,
+        mimetype='application/json',
+    )
+
+
 @sample_groups_blueprint.route('/sample_groups/<uuid>/middleware', methods=['POST'])
 def run_sample_group_display_modules(uuid):    # pylint: disable=invalid-name
     """Run display modules for sample group."""
@@ -226,7 +477,8 @@ def run_sample_group_display_modules(uuid):    # pylint: disable=invalid-name
     return result, 202
 
 
-def get_metadata_from_request(request):
+def get_metadata_upload(request):
+    """Return the filename and binary stream of the metadata sheet attached to request."""
     try:
         metadata_file = request.files['metadata']
     except KeyError:
@@ -234,40 +486,98 @@ def get_metadata_from_request(request):
     if metadata_file.filename == '':
         raise ParseError('Missing metadata file attachment.')
     try:
-        extension = metadata_file.filename.split('.')[1]
-    except KeyError:
-        raise ParseError('Metadata file missing extension.')
-    stream = StringIO(metadata_file.stream.read().decode('UTF8'), newline=None)
-    if extension == 'csv':
-        metadata = DictReader(stream)
-    elif 'xls' in extension:
-        metadata = XLSDictReader(stream)
-    else:
-        raise ParseError('Missing valid metadata file attachment.')
-    return metadata
+        metadata_sheet_format(metadata_file.filename)
+    except ValueError as value_error:
+        raise ParseError(str(value_error))
+    return metadata_file.filename, metadata_file.stream
+
+
+def get_metadata_from_request(request):
+    try:
+        return read_metadata_sheet(*get_metadata_upload(request))
+    except METADATA_SHEET_ERRORS as parse_error:
+        raise ParseError(str(parse_error))
 
 
 @sample_groups_blueprint.route('/libraries/<library_uuid>/metadata', methods=['POST'])
 @authenticate()
-def upload_metadata(_, library_uuid):  # pylint: disable=too-many-branches,too-many-locals
-    """Upload metadata for a library."""
+def upload_metadata(_, library_uuid):
+    """Upload metadata for a library.
+
+    The first column of the sheet names the sample of each row. Missing
+    samples are created and every row is merged into its sample's metadata
+    in one transaction. The response reports how long parsing and storing
+    the sheet took, in seconds.
+
+    With `async=true` the sheet is stored and merged by a worker instead,
+    and the pending job is returned with status 202.
+    """
     try:
-        library = SampleGroup.query.filter_by(uuid=UUID(library_uuid)).first()
+        library = SampleGroup.query.filter_by(uuid=UUID(library_uuid)).one()
     except ValueError:
         raise ParseError('Invalid Library UUID.')
     except NoResultFound:
         raise NotFound('Library does not exist')
+    if request.args.get('async') == 'true':
+        filename, stream = get_metadata_upload(request)
+        job = MetadataUploadJob(library.uuid, filename, stream.read()).save()
+        try:
+            ingest_metadata.delay(str(job.uuid))
+        except Exception:  # pylint: disable=broad-except
+            current_app.logger.exception(f'Metadata upload {job.uuid} could not be queued.')
+            job.add_error(None, None, 'Metadata upload could not be queued.')
+            job.finish()
+            job.save()
+            raise InternalError('Metadata upload could not be queued.')
+        return job.serializable(), 202
+    started = time.monotonic()
     metadata = get_metadata_from_request(request)
-    sample_name_col = metadata.fieldnames[0]
-    updates, updated_uuids = {}, []
-    for row in metadata:
-        sample = library.sample(row[sample_name_col])
-        sample = sample.set_sample_metadata({
-            key: value for key, value in row.items() if key is not sample_name_col
-        })
-        updated_uuids.append(sample.uuid)
+    updates = {}
+    try:
+        if not metadata.fieldnames:
+            raise ValueError('Metadata sheet has no header row.')
+        sample_name_col = metadata.fieldnames[0]
+        for row_num, row in enumerate(metadata, start=2):
+            sample_name = metadata_sample_name(row.pop(sample_name_col))
+            if sample_name is None:
+                if any(value not in (None, '') for value in row.values()):
+                    raise ValueError(f'Row {row_num} of the metadata sheet has no sample name.')
+                continue
+            updates.setdefault(sample_name, {}).update(row)
+    except METADATA_SHEET_ERRORS as parse_error:
+        raise ParseError(str(parse_error))
+    parsed = time.monotonic()
 
-    return {'updated_uuids': updated_uuids}, 201
+    try:
+        uuids = library.merge_sample_metadata(updates)
+        db.session.commit()
+    except DataError as data_error:
+        db.session.rollback()
+        raise InvalidRequest(str(data_error.orig))
+    result = {
+        'updated_uuids': [uuids[sample_name] for sample_name in updates],
+        'timing': {
+            'parse': round(parsed - started, 3),
+            'store': round(time.monotonic() - parsed, 3),
+        },
+    }
+    return result, 201
+
+
+@sample_groups_blueprint.route('/libraries/<library_uuid>/metadata/jobs/<job_uuid>',
+                               methods=['GET'])
+def get_metadata_upload_job(library_uuid, job_uuid):
+    """Get the progress of an asynchronous metadata upload."""
+    try:
+        job = MetadataUploadJob.query.filter_by(
+            uuid=UUID(job_uuid),
+            library_uuid=UUID(library_uuid),
+        ).one()
+    except ValueError:
+        raise ParseError('Invalid UUID provided.')
+    except NoResultFound:
+        raise NotFound('Metadata upload job does not exist.')
+    return job.serializable(), 200
 
 
 @sample_groups_blueprint.route('/organizations/<organization_uuid>/sample_groups',
@@ -278,7 +588,8 @@ def get_organization_sample_groups(organization_uuid):
     limit = request.args.get('limit', PAGE_SIZE)
     sample_groups = SampleGroup.query \
         .filter_by(organization_uuid=organization_uuid) \
-        .order_by(asc(SampleGroup.created_at)) \
+        .options(*SampleGroup.serializable_options()) \
+        .order_by(asc(SampleGroup.created_at), asc(SampleGroup.uuid)) \
         .offset(offset) \
         .limit(limit) \
         .all()
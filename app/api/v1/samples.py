@@ -4,12 +4,17 @@ from uuid import UUID
 
 from flask import Blueprint, current_app, request
 from flask_api.exceptions import NotFound, ParseError
-from sqlalchemy import and_, or_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 
 from app.extensions import db
 from app.api.exceptions import InvalidRequest, InternalError
+from app.api.utils import (
+    get_sample_page,
+    metadata_criteria,
+    sample_ndjson_response,
+    visible_samples,
+)
 from app.db_models import Sample, SampleGroup
 from app.authentication.helpers import authenticate
 
@@ -36,27 +41,43 @@ def add_sample(_):
     return sample.serializable(), 201
 
 
+def get_metadata_filters():
+    """Return criteria for the `meta.<key>` and `meta.<key>__<op>` query arguments."""
+    return metadata_criteria(
+        (arg[len('meta.'):], value)
+        for arg, value in request.args.items(multi=True) if arg.startswith('meta.')
+    )
+
+
 @samples_blueprint.route('/samples', methods=['GET'])
 @authenticate()
-def get_all_samples(authn):  # pylint: disable=unused-argument
-    """Get all samples that the user is allowed to see."""
-    try:
-        org_uuids = {membership.uuid for membership in authn.memberships}
-        sample_groups = SampleGroup.query.filter(and_(
-            SampleGroup.is_library,
-            or_(
-                SampleGroup.is_public,
-                SampleGroup.organization_uuid in org_uuids
-            )
-        )).all()
-        samples = []
-        for sample_group in sample_groups:
-            for sample in sample_group.samples:
-                samples.append(sample.serializable())
-        result = {'samples': samples}
-        return result, 200
-    except NoResultFound:
-        raise NotFound('No accessible samples found.')
+def get_all_samples(authn):
+    """Get a page of the samples that the user is allowed to see.
+
+    Visibility is applied in Postgres and pages work like those of group
+    sample listings. With `format=ndjson` every visible sample, or the first
+    `limit`, is streamed one per line instead.
+    """
+    query = visible_samples(authn)
+    if request.args.get('format') == 'ndjson':
+        return sample_ndjson_response(query)
+    return get_sample_page(query), 200
+
+
+@samples_blueprint.route('/samples/query', methods=['GET'])
+@authenticate(required=False)
+def query_samples(authn):
+    """Get a page of the visible samples whose metadata match every `meta.` filter.
+
+    `meta.city=NYC` matches samples whose `city` is NYC, `meta.city__in=NYC,LA`
+    either of them and `meta.depth__gte=3` those at least 3 deep, with `gt`,
+    `lt` and `lte` alike. Filters run in Postgres and pages work like those
+    of group sample listings.
+    """
+    criteria = get_metadata_filters()
+    if not criteria:
+        raise ParseError('Provide at least one metadata filter.')
+    return get_sample_page(visible_samples(authn).filter(*criteria)), 200
 
 
 @samples_blueprint.route('/samples/<sample_uuid>', methods=['GET'])
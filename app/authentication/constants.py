@@ -0,0 +1,5 @@
+"""Constants for authentication."""
+
+ACTIVE_USER_CACHE_SIZE = 4096  # active statuses of users held per process
+ACTIVE_USER_CACHE_TTL = 30  # seconds
+MEMBERSHIP_ROLES = ('read', 'write', 'admin')  # least to most privileged
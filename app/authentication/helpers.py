@@ -6,11 +6,13 @@ import datetime
 import uuid
 import jwt
 
-from flask import request, current_app
+from flask import current_app, has_request_context, request
 from flask_api.exceptions import ParseError, NotFound, NotAuthenticated, AuthenticationFailed
 from sqlalchemy.orm.exc import NoResultFound
 
-from app.authentication import User
+from app.authentication import Organization, OrganizationMembership, User
+from app.authentication.user_cache import is_active_user
+from app.extensions import db
 
 
 def encode_auth_token(user):
@@ -20,11 +22,16 @@ def encode_auth_token(user):
     now = datetime.datetime.utcnow()
     expires = now + datetime.timedelta(days=days, seconds=seconds)
 
+    # One query for the names and roles, not one per organization
+    rows = db.session.query(
+        OrganizationMembership.organization_uuid, Organization.name, OrganizationMembership.role,
+    ).join(Organization, Organization.uuid == OrganizationMembership.organization_uuid) \
+        .filter(OrganizationMembership.user_uuid == user.uuid)
     memberships = [{
-        'uuid': membership.organization_uuid,
-        'name': membership.organization.name,
-        'roles': membership.role,
-    } for membership in user.memberships]
+        'uuid': str(organization_uuid),
+        'name': name,
+        'roles': role,
+    } for organization_uuid, name, role in rows]
 
     payload = {
         'exp': expires,
@@ -76,8 +83,7 @@ def authenticate(required=True):
                     raise NotAuthenticated('Provide a valid auth token.')
                 auth_token = auth_header.split(' ')[1]
                 authn = decode_auth_token(auth_token)
-                user = User.query.filter_by(uuid=authn.sub).first()
-                if not user or user.is_deleted:
+                if not is_active_user(authn.sub):
                     raise AuthenticationFailed('User is not active')
                 return f(authn, *args, **kwargs)
             except (NotAuthenticated, AuthenticationFailed):
@@ -88,6 +94,31 @@ def authenticate(required=True):
     return wrapper
 
 
+def has_role(organization_uuid, user_uuid, min_role, authn=None):
+    """Return True if the user belongs to the organization with at least min_role.
+
+    With TRUST_TOKEN_ROLES set, a role granted by the membership claims of
+    authn, the token of the same user, is accepted without a query. Results
+    are remembered for the rest of the request.
+    """
+    granting = OrganizationMembership.roles_granting(min_role)
+    if (current_app.config.get('TRUST_TOKEN_ROLES') and authn is not None
+            and authn.sub == user_uuid):
+        for membership in authn.memberships:
+            if membership['uuid'] == str(organization_uuid) and membership['roles'] in granting:
+                return True
+
+    if not has_request_context():
+        return OrganizationMembership.has_role(organization_uuid, user_uuid, min_role)
+    memo = getattr(request, 'role_checks', None)
+    if memo is None:
+        memo = request.role_checks = {}
+    key = (organization_uuid, user_uuid, min_role)
+    if key not in memo:
+        memo[key] = OrganizationMembership.has_role(organization_uuid, user_uuid, min_role)
+    return memo[key]
+
+
 def fetch_organization(organization_uuid):
     """Get organization from UUID string."""
     try:
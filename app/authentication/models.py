@@ -5,14 +5,17 @@
 import datetime
 import json
 
-from flask import current_app
 from sqlalchemy import UniqueConstraint, func
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.dialects.postgresql import UUID, ENUM
+from sqlalchemy.orm import selectinload
 
-from app.extensions import db, bcrypt
+from app.extensions import db
 from app.db_models import SampleGroup
 
+from .constants import MEMBERSHIP_ROLES
+from .passwords import hash_password
+
 
 class Organization(db.Model):
     """Represent an orgnization.
@@ -58,7 +61,7 @@ class Organization(db.Model):
                 'created_at': self.created_at,
                 'primary_admin_uuid': self.primary_admin_uuid,
                 'sample_group_uuids': [sg.uuid for sg in self.sample_groups],
-                'users': [user.uuid for user in self.users],
+                'users': [membership.user_uuid for membership in self.memberships],
             },
         }
         return out
@@ -126,6 +129,14 @@ class Organization(db.Model):
     def from_name(cls, name):
         return cls.query.filter_by(name=name).one()
 
+    @classmethod
+    def serializable_options(cls):
+        """Return loader options fetching what `serializable` needs for many organizations."""
+        return (
+            selectinload(cls.sample_groups).load_only('uuid'),
+            selectinload(cls.memberships),
+        )
+
 
 class User(db.Model):
     """Pangea User model.
@@ -176,12 +187,19 @@ class User(db.Model):
     def from_name(cls, name):
         return cls.query.filter_by(username=name).one()
 
+    @classmethod
+    def serializable_options(cls):
+        """Return loader options fetching what `serializable` needs for many users at once."""
+        return (selectinload(cls.memberships),)
+
     def serializable(self):
         out = {
             'user': {
                 'uuid': self.uuid,
                 'username': self.username,
-                'organizations': [org.uuid for org in self.organizations],
+                'organizations': [
+                    membership.organization_uuid for membership in self.memberships
+                ],
                 'email': self.email,
                 'is_deleted': self.is_deleted,
                 'created_at': self.created_at,
@@ -233,6 +251,24 @@ class OrganizationMembership(db.Model):
         db.session.commit()
         return self
 
+    @staticmethod
+    def roles_granting(min_role):
+        """Return the roles at least as privileged as min_role."""
+        return MEMBERSHIP_ROLES[MEMBERSHIP_ROLES.index(min_role):]
+
+    @classmethod
+    def has_role(cls, organization_uuid, user_uuid, min_role):
+        """Return True if the user belongs to the organization with at least min_role.
+
+        Runs one EXISTS query on the organization and user unique index.
+        """
+        memberships = cls.query.filter(
+            cls.organization_uuid == organization_uuid,
+            cls.user_uuid == user_uuid,
+            cls.role.in_(cls.roles_granting(min_role)),
+        )
+        return db.session.query(memberships.exists()).scalar()
+
 
 class PasswordAuthentication(db.Model):
     """Password Authentication model.
@@ -256,7 +292,5 @@ class PasswordAuthentication(db.Model):
         """Initialize MetaGenScope User model."""
         if user_uuid:
             self.user_uuid = user_uuid
-        self.password = bcrypt.generate_password_hash(
-            password, current_app.config.get('BCRYPT_LOG_ROUNDS')
-        ).decode()
+        self.password = hash_password(password)
         self.created_at = created_at
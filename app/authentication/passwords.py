@@ -0,0 +1,62 @@
+"""Password hashing and checking on a bounded pool of native threads.
+
+bcrypt holds the calling thread for the whole of a hash. Run inline under
+gevent it stalls every other greenlet of the worker, so hashes are run on a
+pool of BCRYPT_MAX_WORKERS threads instead. Requests beyond that wait for a
+free thread.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from flask import current_app
+
+from app.extensions import bcrypt
+
+
+_POOL_LOCK = Lock()
+_POOL = None
+
+
+def _executor_class():
+    """Return the executor running work on native threads in this process."""
+    try:
+        from gevent import monkey
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+    except ImportError:
+        return ThreadPoolExecutor
+    if monkey.is_module_patched('threading'):
+        return GeventThreadPoolExecutor
+    return ThreadPoolExecutor
+
+
+def password_pool():
+    """Return the pool running bcrypt, created on first use from the app config."""
+    global _POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _POOL is None:
+            max_workers = current_app.config.get('BCRYPT_MAX_WORKERS')
+            _POOL = _executor_class()(max_workers=max_workers)
+        return _POOL
+
+
+def reset_password_pool():
+    """Shut down the pool so the next hash creates one from the current config."""
+    global _POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown()
+        _POOL = None
+
+
+def hash_password(password):
+    """Return the bcrypt hash of password using BCRYPT_LOG_ROUNDS."""
+    rounds = current_app.config.get('BCRYPT_LOG_ROUNDS')
+    return password_pool().submit(bcrypt.generate_password_hash, password, rounds) \
+        .result().decode()
+
+
+def check_password(password_hash, password):
+    """Return True if password matches password_hash."""
+    return password_pool().submit(bcrypt.check_password_hash, password_hash, password) \
+        .result()
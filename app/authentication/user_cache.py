@@ -0,0 +1,38 @@
+"""Cache of whether users are active, checked on every authenticated request."""
+
+from sqlalchemy import event
+
+from app.extensions import db
+from app.utils import LRUCache
+
+from .constants import ACTIVE_USER_CACHE_SIZE, ACTIVE_USER_CACHE_TTL
+from .models import User
+
+
+ACTIVE_USER_CACHE = LRUCache(  # pylint: disable=invalid-name
+    maxsize=ACTIVE_USER_CACHE_SIZE,
+    ttl=ACTIVE_USER_CACHE_TTL,
+)
+
+
+def is_active_user(user_uuid):
+    """Return True if the user with user_uuid exists and is not deleted.
+
+    Changes made by this process are seen at once; those made by other
+    processes within ACTIVE_USER_CACHE_TTL seconds.
+    """
+    active = ACTIVE_USER_CACHE.get(user_uuid)
+    if active is None:
+        row = db.session.query(User.is_deleted).filter_by(uuid=user_uuid).first()
+        active = row is not None and not row.is_deleted
+        ACTIVE_USER_CACHE.set(user_uuid, active)
+    return active
+
+
+def _uncache_user(mapper, connection, target):  # pylint: disable=unused-argument
+    """Drop the cached status of target."""
+    ACTIVE_USER_CACHE.pop(target.uuid)
+
+
+for identifier in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(User, identifier, _uncache_user)
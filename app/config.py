@@ -12,10 +12,33 @@ class Config():
     SECRET_KEY = os.environ.get('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     BCRYPT_LOG_ROUNDS = 13
+    BCRYPT_MAX_WORKERS = int(os.environ.get('BCRYPT_MAX_WORKERS', 4))  # concurrent hashes per process
     TOKEN_EXPIRATION_DAYS = 30
     TOKEN_EXPIRATION_SECONDS = 0
+    # Accept the organization roles in auth tokens without checking the database.
+    # Roles revoked since a token was issued stay in effect until it expires.
+    TRUST_TOKEN_ROLES = False
     MAX_CONTENT_LENGTH = 100 * 1000 * 1000
 
+    # Analysis result fields encoding to more than this many characters are chunked
+    MAX_INLINE_FIELD_LENGTH = 16 * 1000 * 1000
+    # Optionally gzip and chunk fields encoding to at least this many characters
+    COMPRESS_FIELD_DATA = False
+    MIN_COMPRESSED_FIELD_LENGTH = 64 * 1000
+    # Decoded fields encoding to more than this many bytes are not memoized
+    MAX_MEMOIZED_FIELD_LENGTH = 8 * 1000 * 1000
+    # Nonzero values allowed in a sample group's samples by features field matrix
+    MAX_FIELD_MATRIX_VALUES = 20 * 1000 * 1000
+    # Records upserted per statement by the bulk analysis result endpoint
+    BULK_INGEST_BATCH_SIZE = 1000
+    # Metadata rows merged per transaction by asynchronous metadata uploads
+    METADATA_JOB_BATCH_SIZE = 1000
+
+    CELERY_CONFIG = {
+        'broker_url': os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'),
+        'task_ignore_result': True,
+    }
+
     # Flask-API renderer
     DEFAULT_RENDERERS = [
         'app.api.renderers.EnvelopeJSONRenderer',
@@ -44,6 +67,16 @@ class TestingConfig(Config):
     BCRYPT_LOG_ROUNDS = 4
     TOKEN_EXPIRATION_DAYS = 0
     TOKEN_EXPIRATION_SECONDS = 3
+    MAX_INLINE_FIELD_LENGTH = 10 * 1000
+    MAX_MEMOIZED_FIELD_LENGTH = 20 * 1000
+    MAX_FIELD_MATRIX_VALUES = 4
+    BULK_INGEST_BATCH_SIZE = 2
+    METADATA_JOB_BATCH_SIZE = 2
+    CELERY_CONFIG = {
+        'broker_url': 'memory://',
+        'task_always_eager': True,
+        'task_ignore_result': True,
+    }
 
 
 class StagingConfig(Config):
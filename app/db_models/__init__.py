@@ -1,9 +1,11 @@
 
 from .analysis_result_models import (
+    AnalysisResult,
     SampleAnalysisResult,
     SampleAnalysisResultField,
     SampleGroupAnalysisResult,
     SampleGroupAnalysisResultField,
 )
+from .job_models import MetadataUploadJob
 from .sample_group_models import SampleGroup
 from .sample_models import Sample
@@ -1,14 +1,117 @@
 """Analysis Results model definitions."""
 
 import datetime
+import gzip
 import json
-
-from sqlalchemy import UniqueConstraint
-from sqlalchemy.dialects.postgresql import UUID, ENUM
+import re
+import zlib
+
+from flask import current_app
+from sqlalchemy import (
+    Text, UniqueConstraint, and_, bindparam, case, cast, func, inspect, literal, select,
+)
+from sqlalchemy.dialects.postgresql import UUID, ENUM, JSONB, insert
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import undefer
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app.extensions import db
+from app.utils import LRUCache
+
+from .constants import (
+    FIELD_CHUNK_SIZE,
+    FIELD_DATA_CACHE_SIZE,
+    FIELD_DATA_CACHE_WEIGHT,
+    FIELD_STREAM_BATCH_SIZE,
+    MIN_MEMOIZED_FIELD_SIZE,
+    RESULT_KIND_CACHE_SIZE,
+    ANALYSIS_RESULT_STATUSES,
+)
+from .name_cache import cached_uuid, watch_names
+
+
+# Decoded field payloads keyed by (uuid, version), weighed by their serialized
+# length. Cached values are shared between readers and must not be mutated.
+FIELD_DATA_CACHE = LRUCache(maxsize=FIELD_DATA_CACHE_SIZE, maxweight=FIELD_DATA_CACHE_WEIGHT)
+RESULT_KIND_CACHE = LRUCache(maxsize=RESULT_KIND_CACHE_SIZE)  # pylint: disable=invalid-name
+_MISSING = object()
+# A \u0000 escape, not preceded by an escaped backslash, in serialized JSON
+_ESCAPED_NUL = re.compile(r'(?<!\\)(?:\\\\)*\\u0000')
+# A single row holding the uuid to look up in both kinds of result tables
+_UUID_PROBE = select([  # pylint: disable=invalid-name
+    bindparam('probe_uuid', type_=UUID(as_uuid=True)).label('uuid'),
+]).alias('probe')
+
+
+def _slice_data(data, path=(), keys=()):
+    """Slice decoded data the same way Postgres slices inline JSONB payloads."""
+    for step in path:
+        try:
+            data = data[int(step)] if isinstance(data, list) else data[step]
+        except (KeyError, IndexError, TypeError, ValueError):
+            return None
+    if keys:
+        return {key: data.get(key) if isinstance(data, dict) else None for key in keys}
+    return data
+
+
+def _memoize_data(key, data, length):
+    """Cache decoded data unless its serialized length is above the configured limit."""
+    if length <= current_app.config['MAX_MEMOIZED_FIELD_LENGTH']:
+        FIELD_DATA_CACHE.set(key, data, weight=length)
+
+
+def _probe_kinds(uuid, targets, options=()):
+    """Return the first entity of targets found for uuid, in one query.
+
+    Each of `targets` is an AR type, an entity to load and the criterion
+    joining that entity to the probed uuid. The AR type found is cached.
+    """
+    query = db.session.query(*[entity for _, entity, _ in targets]) \
+        .select_from(_UUID_PROBE) \
+        .options(*options)
+    for _, entity, criterion in targets:
+        query = query.outerjoin(entity, criterion)
+    for (result_type, _, _), found in zip(targets, query.params(probe_uuid=uuid).one()):
+        if found is not None:
+            RESULT_KIND_CACHE.set(uuid, result_type)
+            return found
+    return None
+
+
+class AnalysisResultFieldChunk(db.Model):
+    """Represent one fixed-size slice of a field payload too large to store inline."""
+    __abstract__ = True
+
+    chunk_index = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    stored_data = db.Column(db.LargeBinary, nullable=False)
+
+    def __init__(self, chunk_index, stored_data):
+        """Initialize Analysis Result Field Chunk model."""
+        self.chunk_index = chunk_index
+        self.stored_data = stored_data
+
+
+class SampleAnalysisResultFieldChunk(AnalysisResultFieldChunk):
+
+    __tablename__ = 'sample_analysis_result_field_chunks'
+
+    field_uuid = db.Column(
+        db.ForeignKey('sample_analysis_result_fields.uuid'),
+        primary_key=True,
+        index=True
+    )
+
+
+class SampleGroupAnalysisResultFieldChunk(AnalysisResultFieldChunk):
 
-from .constants import MAX_DATA_FIELD_LENGTH, ANALYSIS_RESULT_STATUSES
+    __tablename__ = 'sample_group_analysis_result_field_chunks'
+
+    field_uuid = db.Column(
+        db.ForeignKey('sample_group_analysis_result_fields.uuid'),
+        primary_key=True,
+        index=True
+    )
 
 
 class AnalysisResultField(db.Model):
@@ -23,7 +126,14 @@ class AnalysisResultField(db.Model):
     )
     created_at = db.Column(db.DateTime, nullable=False)
     field_name = db.Column(db.String(256), index=True, nullable=False)
-    stored_data = db.Column(db.String(MAX_DATA_FIELD_LENGTH), index=False, nullable=False)
+    is_chunked = db.Column(db.Boolean, default=False, nullable=False)
+    content_encoding = db.Column(db.String(16), default='identity', nullable=False)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+    @declared_attr
+    def stored_data(cls):  # pylint: disable=no-self-argument
+        """Hold inline payloads, deferred so rows load without their data."""
+        return db.deferred(db.Column(JSONB(none_as_null=True), nullable=True))
 
     def __init__(  # pylint: disable=too-many-arguments
             self, analysis_result_uuid, field_name,
@@ -32,26 +142,213 @@ class AnalysisResultField(db.Model):
         """Initialize Analysis Result model."""
         self.parent_uuid = analysis_result_uuid
         self.field_name = field_name
-        self.stored_data = json.dumps(data)
+        self._store(data)
         self.created_at = created_at
 
+    @classmethod
+    def _storage(cls, data):
+        """Return the stored_data, is_chunked, content_encoding and chunks for data.
+
+        Payloads too large to fit inline are split into chunks, gzip compressed
+        first when compression is enabled and they are large enough to be
+        worth it. Raise ValueError for data holding NaN, infinities or NUL
+        characters, which JSONB cannot store, whatever the payload size.
+        """
+        try:
+            serialized = json.dumps(data, allow_nan=False)
+        except ValueError:
+            raise ValueError('Field data must not hold NaN or infinite numbers.')
+        if _ESCAPED_NUL.search(serialized):
+            raise ValueError('Field data must not hold NUL characters.')
+        config = current_app.config
+        compress = config['COMPRESS_FIELD_DATA'] and \
+            len(serialized) >= config['MIN_COMPRESSED_FIELD_LENGTH']
+        if len(serialized) <= config['MAX_INLINE_FIELD_LENGTH'] and not compress:
+            return data, False, 'identity', []
+        serialized = serialized.encode('utf-8')
+        content_encoding = 'identity'
+        if compress:
+            serialized = gzip.compress(serialized, compresslevel=6)
+            content_encoding = 'gzip'
+        chunks = [
+            serialized[start:start + FIELD_CHUNK_SIZE]
+            for start in range(0, len(serialized), FIELD_CHUNK_SIZE)
+        ]
+        return None, True, content_encoding, chunks
+
+    def _store(self, data):
+        """Serialize data inline, or split it into chunks if it is too large to fit."""
+        self.stored_data, self.is_chunked, self.content_encoding, chunks = self._storage(data)
+        chunk_type = type(self)._chunk_type()
+        for chunk_index, chunk in enumerate(chunks):
+            self.chunks.append(chunk_type(chunk_index, chunk))
+
     @property
     def data(self):
-        """Return the deserialized data for this field."""
-        return json.loads(self.stored_data)
+        """Return the deserialized data for this field.
+
+        Decoded payloads are memoized by uuid and version, so repeated reads
+        of an unchanged field neither load nor parse it again. Payloads
+        encoding to more than MAX_MEMOIZED_FIELD_LENGTH bytes are not memoized.
+        """
+        key = (self.uuid, self.version)
+        data = FIELD_DATA_CACHE.get(key, _MISSING)
+        if data is _MISSING:
+            if self.is_chunked:
+                serialized = b''.join(self.stream_data())
+                data, length = json.loads(serialized), len(serialized)
+            elif self.uuid is not None and 'stored_data' in inspect(self).unloaded:
+                cls = type(self)
+                data, length = db.session.query(cls.stored_data, cls.stored_length()) \
+                    .filter(cls.uuid == self.uuid) \
+                    .one()
+                set_committed_value(self, 'stored_data', data)
+            else:
+                data = self.stored_data
+                length = len(json.dumps(data))
+            if self.uuid is not None:
+                _memoize_data(key, data, length or 0)
+        return data
+
+    @classmethod
+    def stored_length(cls):
+        """Return an expression for the serialized length of inline payloads in bytes."""
+        return func.octet_length(cast(cls.stored_data, Text))
+
+    def stream_data(self, decompress=True):
+        """Yield the serialized data for this field as utf-8 encoded bytes.
+
+        Chunks are read one at a time from a server side cursor so that
+        large payloads are never held in memory as a whole. Compressed
+        payloads are decompressed on the fly, or passed through in their
+        stored `content_encoding` if `decompress` is False.
+        """
+        if not self.is_chunked:
+            yield json.dumps(self.stored_data).encode('utf-8')
+            return
+        chunk_type = type(self)._chunk_type()
+        chunks = db.session.query(chunk_type.stored_data) \
+            .filter_by(field_uuid=self.uuid) \
+            .order_by(chunk_type.chunk_index) \
+            .execution_options(stream_results=True) \
+            .yield_per(1)
+        if self.content_encoding == 'identity' or not decompress:
+            for chunk, in chunks:
+                yield chunk
+            return
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for chunk, in chunks:
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+    @classmethod
+    def sliced_data(cls, criterion, path=(), keys=(), key=None):
+        """Return a map of field name to data for the fields matching criterion.
+
+        `path` descends into each payload and `keys` then picks members of the
+        value found there. Inline payloads are sliced by Postgres so only the
+        requested values are transferred; chunked payloads are sliced here.
+        Results are keyed by the `key` column instead if it is given.
+        """
+        key = cls.field_name if key is None else key
+        if not path and not keys:
+            return cls._memoized_data(criterion, key)
+        target = cls.stored_data
+        if path:
+            target = target[tuple(path)]
+        columns = [target[member] for member in keys] if keys else [target]
+        rows = db.session.query(cls.uuid, key, cls.is_chunked, *columns) \
+            .filter(criterion)
+        result = {}
+        for uuid, name, is_chunked, *values in rows:
+            if is_chunked:
+                result[name] = _slice_data(cls.query.get(uuid).data, path, keys)
+            elif keys:
+                result[name] = dict(zip(keys, values))
+            else:
+                result[name] = values[0]
+        return result
+
+    @classmethod
+    def iter_sliced_data(cls, criterion, key, path=()):
+        """Yield the key and data, or the value at `path` in it, of each field matching criterion.
+
+        Fields are read in key order from a server side cursor, so only a few
+        payloads are held in memory at a time.
+        """
+        target = cls.stored_data[tuple(path)] if path else cls.stored_data
+        rows = db.session.query(key, cls.uuid, cls.is_chunked, target) \
+            .filter(criterion) \
+            .order_by(key) \
+            .execution_options(stream_results=True) \
+            .yield_per(FIELD_STREAM_BATCH_SIZE)
+        for name, uuid, is_chunked, value in rows:
+            if is_chunked:
+                value = _slice_data(cls.query.get(uuid).data, path)
+            yield name, value
+
+    @classmethod
+    def _memoized_data(cls, criterion, key):
+        """Return a map of key to data, loading only payloads not already cached.
+
+        Small inline payloads are read along with their fields, so results
+        made of small fields are loaded with a single query. Payloads are
+        small if they serialize to fewer than MIN_MEMOIZED_FIELD_SIZE bytes;
+        the cheaper stored size, which may be compressed, rules out the
+        rest first.
+        """
+        is_small = case(
+            [(func.pg_column_size(cls.stored_data) >= MIN_MEMOIZED_FIELD_SIZE, False)],
+            else_=cls.stored_length() < MIN_MEMOIZED_FIELD_SIZE,
+        )
+        small_data = case([(is_small, cls.stored_data)])
+        rows = db.session.query(
+            cls.uuid, cls.version, key, cls.is_chunked, is_small, small_data
+        ).filter(criterion).all()
+        result, inline_misses = {}, {}
+        for uuid, version, name, is_chunked, small, small_value in rows:
+            if not is_chunked and small is not False:  # small is None for null payloads
+                result[name] = small_value
+                continue
+            data = FIELD_DATA_CACHE.get((uuid, version), _MISSING)
+            if data is not _MISSING:
+                result[name] = data
+            elif is_chunked:
+                result[name] = cls.query.get(uuid).data
+            else:
+                inline_misses[uuid] = (version, name)
+        if inline_misses:
+            loaded = db.session.query(cls.uuid, cls.stored_data, cls.stored_length()) \
+                .filter(cls.uuid.in_(inline_misses))
+            for uuid, data, length in loaded:
+                version, name = inline_misses[uuid]
+                _memoize_data((uuid, version), data, length or 0)
+                result[name] = data
+        return result
 
     def set_data(self, data):
-        self.stored_data = json.dumps(data)
+        if self.uuid is not None:
+            FIELD_DATA_CACHE.pop((self.uuid, self.version))
+            # Bump in SQL so concurrent writers never share a version
+            self.version = type(self).version + 1
+        if self.is_chunked:
+            chunk_type = type(self)._chunk_type()
+            chunk_type.query.filter_by(field_uuid=self.uuid).delete()
+        self._store(data)
         return self.save()
 
+    def serializable_field(self):
+        """Return a serializable description of this field, without its data."""
+        return {
+            'uuid': self.uuid,
+            'parent_uuid': self.uuid,
+            'field_name': self.field_name,
+            'created_at': self.created_at,
+        }
+
     def serializable(self):
         return {
-            'analysis_result_field': {
-                'uuid': self.uuid,
-                'parent_uuid': self.uuid,
-                'field_name': self.field_name,
-                'created_at': self.created_at,
-            },
+            'analysis_result_field': self.serializable_field(),
             'data': self.data,
         }
 
@@ -67,12 +364,22 @@ class AnalysisResultField(db.Model):
 class SampleAnalysisResultField(AnalysisResultField):
 
     __tablename__ = 'sample_analysis_result_fields'
+    __table_args__ = (
+        UniqueConstraint("sample_analysis_result_uuid", "field_name"),
+    )
     kind = 'sample'
+    _parent_key = 'sample_analysis_result_uuid'
 
     sample_analysis_result_uuid = db.Column(
         db.ForeignKey('sample_analysis_results.uuid'),
         nullable=False
     )
+    chunks = db.relationship(
+        'SampleAnalysisResultFieldChunk',
+        order_by='SampleAnalysisResultFieldChunk.chunk_index',
+        cascade='all, delete-orphan',
+        lazy='dynamic',
+    )
 
     @property
     def parent_uuid(self):
@@ -84,16 +391,30 @@ class SampleAnalysisResultField(AnalysisResultField):
         """Set the value of parent uuid."""
         self.sample_analysis_result_uuid = value
 
+    @classmethod
+    def _chunk_type(cls):
+        return SampleAnalysisResultFieldChunk
+
 
 class SampleGroupAnalysisResultField(AnalysisResultField):
 
     __tablename__ = 'sample_group_analysis_result_fields'
+    __table_args__ = (
+        UniqueConstraint("sample_group_analysis_result_uuid", "field_name"),
+    )
     kind = 'sample_group'
+    _parent_key = 'sample_group_analysis_result_uuid'
 
     sample_group_analysis_result_uuid = db.Column(
         db.ForeignKey('sample_group_analysis_results.uuid'),
         nullable=False
     )
+    chunks = db.relationship(
+        'SampleGroupAnalysisResultFieldChunk',
+        order_by='SampleGroupAnalysisResultFieldChunk.chunk_index',
+        cascade='all, delete-orphan',
+        lazy='dynamic',
+    )
 
     @property
     def parent_uuid(self):
@@ -105,6 +426,10 @@ class SampleGroupAnalysisResultField(AnalysisResultField):
         """Set the value of parent uuid."""
         self.sample_group_analysis_result_uuid = value
 
+    @classmethod
+    def _chunk_type(cls):
+        return SampleGroupAnalysisResultFieldChunk
+
 
 class AnalysisResult(db.Model):
     """Represent a single field of a single result in the database.
@@ -159,6 +484,155 @@ class AnalysisResult(db.Model):
             return ar_fs[0]
         return type(self)._field_type()(self.uuid, field_name).save()
 
+    def field_data(self, field_name=None, path=(), keys=()):
+        """Return a map of field name to data for the fields of this AR.
+
+        Restrict to a single field if `field_name` is given. See
+        `AnalysisResultField.sliced_data` for `path` and `keys`.
+        """
+        return type(self).field_data_from_uuid(self.uuid, field_name, path=path, keys=keys)
+
+    @classmethod
+    def field_data_from_uuid(cls, uuid, field_name=None, path=(), keys=()):
+        """Return the field data of the AR with this uuid without loading the AR."""
+        field_type = cls._field_type()
+        criterion = getattr(field_type, field_type._parent_key) == uuid
+        if field_name is not None:
+            criterion = and_(criterion, field_type.field_name == field_name)
+        return field_type.sliced_data(criterion, path=path, keys=keys)
+
+    @classmethod
+    def upsert_fields(cls, fields_by_result):
+        """Store the fields of many ARs of this kind with one statement per table.
+
+        `fields_by_result` maps (parent_uuid, module_name) pairs to a map of
+        field name to data. Missing ARs are created and existing fields are
+        overwritten. Return a map of the same keys to the AR uuid and a map
+        of field name to field uuid. The caller must commit the session.
+        """
+        if not fields_by_result:
+            return {}
+        now = datetime.datetime.utcnow()
+        table = cls.__table__
+        stmt = insert(table).values([
+            {cls._parent_key: parent_uuid, 'module_name': module_name,
+             'status': 'PENDING', 'created_at': now}
+            for parent_uuid, module_name in fields_by_result
+        ])
+        # A no-op update so that existing ARs are returned as well
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[cls._parent_key, 'module_name'],
+            set_={'module_name': stmt.excluded.module_name},
+        ).returning(table.c.uuid, table.c[cls._parent_key], table.c.module_name)
+        ar_uuids = {
+            (parent_uuid, module_name): uuid
+            for uuid, parent_uuid, module_name in db.session.execute(stmt)
+        }
+        result = {key: (ar_uuid, {}) for key, ar_uuid in ar_uuids.items()}
+
+        field_type = cls._field_type()
+        field_table = field_type.__table__
+        rows, chunks = [], {}
+        for key, fields in fields_by_result.items():
+            for field_name, data in fields.items():
+                stored_data, is_chunked, content_encoding, field_chunks = field_type._storage(data)
+                rows.append({
+                    field_type._parent_key: ar_uuids[key], 'field_name': field_name,
+                    'stored_data': stored_data, 'is_chunked': is_chunked,
+                    'content_encoding': content_encoding, 'version': 0, 'created_at': now,
+                })
+                chunks[(ar_uuids[key], field_name)] = field_chunks
+        if not rows:
+            return result
+        stmt = insert(field_table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[field_type._parent_key, 'field_name'],
+            set_={
+                'stored_data': stmt.excluded.stored_data,
+                'is_chunked': stmt.excluded.is_chunked,
+                'content_encoding': stmt.excluded.content_encoding,
+                'version': field_table.c.version + 1,
+            },
+        ).returning(field_table.c.uuid, field_table.c[field_type._parent_key], field_table.c.field_name)
+        ar_keys = {ar_uuid: key for key, ar_uuid in ar_uuids.items()}
+        chunk_rows = []
+        for uuid, ar_uuid, field_name in db.session.execute(stmt):
+            result[ar_keys[ar_uuid]][1][field_name] = uuid
+            chunk_rows += [
+                {'field_uuid': uuid, 'chunk_index': chunk_index, 'stored_data': chunk}
+                for chunk_index, chunk in enumerate(chunks[(ar_uuid, field_name)])
+            ]
+
+        chunk_type = field_type._chunk_type()
+        field_uuids = [uuid for _, field_uuids in result.values() for uuid in field_uuids.values()]
+        db.session.query(chunk_type) \
+            .filter(chunk_type.field_uuid.in_(field_uuids)) \
+            .delete(synchronize_session=False)
+        if chunk_rows:
+            db.session.execute(chunk_type.__table__.insert(), chunk_rows)
+        return result
+
+    @staticmethod
+    def from_any_uuid(uuid):
+        """Return the sample or sample group AR with uuid, or None, in one query.
+
+        The kind of each AR found is cached so later reads query only its table.
+        """
+        result_type = RESULT_KIND_CACHE.get(uuid)
+        if result_type is not None:
+            return result_type.query.filter_by(uuid=uuid).first()
+        return _probe_kinds(uuid, [
+            (result_type, result_type, result_type.uuid == _UUID_PROBE.c.uuid)
+            for result_type in (SampleAnalysisResult, SampleGroupAnalysisResult)
+        ])
+
+    @staticmethod
+    def field_from_any_uuid(uuid, field_name):
+        """Return the named field of the AR with uuid, or None, in one query.
+
+        Inline field data is loaded along with the field.
+        """
+        result_type = RESULT_KIND_CACHE.get(uuid)
+        if result_type is not None:
+            field_type = result_type._field_type()
+            return field_type.query \
+                .options(undefer(field_type.stored_data)) \
+                .filter(getattr(field_type, field_type._parent_key) == uuid) \
+                .filter(field_type.field_name == field_name) \
+                .first()
+        targets = []
+        for result_type in (SampleAnalysisResult, SampleGroupAnalysisResult):
+            field_type = result_type._field_type()
+            criterion = and_(
+                getattr(field_type, field_type._parent_key) == _UUID_PROBE.c.uuid,
+                field_type.field_name == field_name,
+            )
+            targets.append((result_type, field_type, criterion))
+        options = [undefer(field_type.stored_data) for _, field_type, _ in targets]
+        return _probe_kinds(uuid, targets, options)
+
+    @classmethod
+    def summary_select(cls, module_name=None, status=None):
+        """Return a select of the ARs of this kind, without their fields.
+
+        Rows have the uuid, kind, parent_uuid, module_name, status and
+        created_at of each AR, so the selects of each kind can be unioned.
+        """
+        table = cls.__table__
+        stmt = select([
+            table.c.uuid,
+            literal(cls.kind).label('kind'),
+            table.c[cls._parent_key].label('parent_uuid'),
+            table.c.module_name,
+            table.c.status,
+            table.c.created_at,
+        ])
+        if module_name is not None:
+            stmt = stmt.where(table.c.module_name == module_name)
+        if status is not None:
+            stmt = stmt.where(table.c.status == status)
+        return stmt
+
     def set_status(self, status):
         """Set status and save. Return self."""
         assert status in ANALYSIS_RESULT_STATUSES
@@ -179,9 +653,8 @@ class AnalysisResult(db.Model):
             'data': {},
         }
         for field in self.module_fields:
-            myfield = field.serializable()
-            out['data'][field.field_name] = myfield['data']
-            out['analysis_result']['fields'][field.field_name] = myfield['analysis_result_field']
+            out['analysis_result']['fields'][field.field_name] = field.serializable_field()
+        out['data'] = self.field_data()
         return out
 
     def serialize(self):
@@ -198,6 +671,8 @@ class SampleAnalysisResult(AnalysisResult):
     __tablename__ = 'sample_analysis_results'
     __table_args__ = (
         UniqueConstraint("sample_uuid", "module_name"),
+        # Serves keyset pagination of all ARs by (created_at, uuid)
+        db.Index('_sample_analysis_results_keyset_idx', 'created_at', 'uuid'),
     )
 
     sample_uuid = db.Column(
@@ -208,6 +683,8 @@ class SampleAnalysisResult(AnalysisResult):
         'SampleAnalysisResultField', backref='analysis_result', lazy=True
     )
     kind = 'sample'
+    _parent_key = 'sample_uuid'
+    _name_keys = ('sample_uuid', 'module_name')
 
     @property
     def parent_uuid(self):
@@ -227,12 +704,19 @@ class SampleAnalysisResult(AnalysisResult):
     def from_name_sample(cls, module_name, sample_uuid):
         return cls.query.filter_by(sample_uuid=sample_uuid, module_name=module_name).one()
 
+    @classmethod
+    def uuid_from_name_sample(cls, module_name, sample_uuid):
+        """Return the uuid of the sample's AR for the module, cached for a few minutes."""
+        return cached_uuid(cls, sample_uuid=sample_uuid, module_name=module_name)
+
 
 class SampleGroupAnalysisResult(AnalysisResult):
 
     __tablename__ = 'sample_group_analysis_results'
     __table_args__ = (
         UniqueConstraint("sample_group_uuid", "module_name"),
+        # Serves keyset pagination of all ARs by (created_at, uuid)
+        db.Index('_sample_group_analysis_results_keyset_idx', 'created_at', 'uuid'),
     )
 
     sample_group_uuid = db.Column(
@@ -243,6 +727,8 @@ class SampleGroupAnalysisResult(AnalysisResult):
         'SampleGroupAnalysisResultField', backref='analysis_result', lazy=True
     )
     kind = 'sample_group'
+    _parent_key = 'sample_group_uuid'
+    _name_keys = ('sample_group_uuid', 'module_name')
 
     @property
     def parent_uuid(self):
@@ -261,3 +747,12 @@ class SampleGroupAnalysisResult(AnalysisResult):
     @classmethod
     def from_name_group(cls, module_name, group_uuid):
         return cls.query.filter_by(sample_group_uuid=group_uuid, module_name=module_name).one()
+
+    @classmethod
+    def uuid_from_name_group(cls, module_name, group_uuid):
+        """Return the uuid of the group's AR for the module, cached for a few minutes."""
+        return cached_uuid(cls, sample_group_uuid=group_uuid, module_name=module_name)
+
+
+watch_names(SampleAnalysisResult)
+watch_names(SampleGroupAnalysisResult)
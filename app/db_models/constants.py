@@ -19,7 +19,15 @@ ALL_MODULE_NAMES = [
     SAMPLE_SIMILARITY_NAME,
     TOP_TAXA_NAME,
 ]
-MAX_DATA_FIELD_LENGTH = 10 * 1000  # 10 kilobytes
+FIELD_CHUNK_SIZE = 256 * 1000  # 256 kilobytes
+FIELD_DATA_CACHE_SIZE = 64  # decoded payloads held per process
+FIELD_DATA_CACHE_WEIGHT = 64 * 1000 * 1000  # serialized bytes of decoded payloads held per process
+RESULT_KIND_CACHE_SIZE = 100 * 1000  # kinds of analysis result uuids held per process
+FIELD_STREAM_BATCH_SIZE = 100  # field rows fetched at a time by streamed reads
+MIN_MEMOIZED_FIELD_SIZE = 64 * 1000  # smaller inline payloads are read with their field
+NAME_CACHE_SIZE = 4096  # uuids of groups, samples and results held per process
+NAME_CACHE_TTL = 5 * 60  # seconds
+SAMPLE_INSERT_CHUNK_SIZE = 1000  # rows per multi-row sample INSERT
 ANALYSIS_RESULT_STATUSES = (
     'ERROR',
     'PENDING',
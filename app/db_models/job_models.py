@@ -0,0 +1,83 @@
+"""Background job model definitions."""
+
+import datetime
+
+from sqlalchemy.dialects.postgresql import UUID, ENUM, JSONB
+
+from app.extensions import db
+
+from .constants import ANALYSIS_RESULT_STATUSES
+
+
+class MetadataUploadJob(db.Model):
+    """Represent the asynchronous ingestion of a library metadata upload.
+
+    The uploaded sheet is stored with the job until a worker has merged it
+    into the library. Progress and the errors of failed batches of rows are
+    recorded as the worker goes.
+    """
+
+    __tablename__ = 'metadata_upload_jobs'
+
+    uuid = db.Column(
+        UUID(as_uuid=True),
+        primary_key=True,
+        server_default=db.text('uuid_generate_v4()')
+    )
+    library_uuid = db.Column(db.ForeignKey('sample_groups.uuid'), nullable=False)
+    filename = db.Column(db.String(256), nullable=False)
+    upload = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    status = db.Column(
+        ENUM(*ANALYSIS_RESULT_STATUSES, name='status'),
+        nullable=False
+    )
+    rows_processed = db.Column(db.Integer, nullable=False)
+    errors = db.Column(JSONB, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, library_uuid, filename, upload, created_at=None):
+        """Initialize a pending metadata upload job."""
+        self.library_uuid = library_uuid
+        self.filename = filename
+        self.upload = upload
+        self.status = 'PENDING'
+        self.rows_processed = 0
+        self.errors = []
+        self.created_at = created_at or datetime.datetime.utcnow()
+
+    def serializable(self):
+        out = {
+            'metadata_upload_job': {
+                'uuid': self.uuid,
+                'library_uuid': self.library_uuid,
+                'filename': self.filename,
+                'status': self.status,
+                'rows_processed': self.rows_processed,
+                'errors': self.errors,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+            },
+        }
+        return out
+
+    def add_error(self, first_row, last_row, message):
+        """Record that rows first_row to last_row of the sheet could not be stored."""
+        self.errors = self.errors + [
+            {'first_row': first_row, 'last_row': last_row, 'message': message},
+        ]
+
+    def finish(self):
+        """Mark the job done, dropping the stored upload."""
+        self.status = 'ERROR' if self.errors else 'SUCCESS'
+        self.upload = None
+        self.finished_at = datetime.datetime.utcnow()
+
+    def save(self):
+        db.session.add(self)
+        db.session.commit()
+        return self
+
+    @classmethod
+    def from_uuid(cls, uuid):
+        return cls.query.filter_by(uuid=uuid).one()
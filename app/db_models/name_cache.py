@@ -0,0 +1,45 @@
+"""Cache of the uuids of sample groups, samples and analysis results by name."""
+
+from sqlalchemy import event, inspect
+
+from app.extensions import db
+from app.utils import LRUCache
+
+from .constants import NAME_CACHE_SIZE, NAME_CACHE_TTL
+
+
+NAME_CACHE = LRUCache(maxsize=NAME_CACHE_SIZE, ttl=NAME_CACHE_TTL)  # pylint: disable=invalid-name
+
+
+def _cache_key(model, names):
+    return (model.__tablename__,) + tuple(names[column] for column in model._name_keys)
+
+
+def cached_uuid(model, **names):
+    """Return the uuid of the `model` row identified by names.
+
+    Only uuids that exist are cached so rows created since are still found.
+    Raise NoResultFound if there is no such row.
+    """
+    key = _cache_key(model, names)
+    uuid = NAME_CACHE.get(key)
+    if uuid is None:
+        uuid = db.session.query(model.uuid).filter_by(**names).one()[0]
+        NAME_CACHE.set(key, uuid)
+    return uuid
+
+
+def _uncache_names(mapper, connection, target):  # pylint: disable=unused-argument
+    """Drop the cached uuid of target under its current and previous names."""
+    state = inspect(target)
+    names = {column: getattr(target, column) for column in target._name_keys}
+    NAME_CACHE.pop(_cache_key(type(target), names))
+    for column in target._name_keys:
+        for previous in state.attrs[column].history.deleted:
+            NAME_CACHE.pop(_cache_key(type(target), {**names, column: previous}))
+
+
+def watch_names(model):
+    """Invalidate cached uuids of model when its rows are created, renamed or deleted."""
+    for identifier in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, identifier, _uncache_names)
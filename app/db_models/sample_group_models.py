@@ -2,13 +2,51 @@
 
 import datetime
 import json
-from sqlalchemy import func
-from sqlalchemy.dialects.postgresql import UUID
+from array import array
+
+import numpy
+from flask_api.exceptions import ParseError
+from scipy import sparse
+from sqlalchemy import String, and_, bindparam, cast, event, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID, insert
+from sqlalchemy.orm import selectinload
 
 from app.extensions import db
 
+from .constants import SAMPLE_INSERT_CHUNK_SIZE
+from .name_cache import cached_uuid, watch_names
 from .sample_models import Sample
-from .analysis_result_models import SampleGroupAnalysisResult
+from .analysis_result_models import (
+    SampleAnalysisResult,
+    SampleAnalysisResultField,
+    SampleGroupAnalysisResult,
+)
+
+
+class FieldMatrixTooLarge(Exception):
+    """Raised when a field matrix would hold more values than allowed."""
+
+    def __init__(self, max_values):
+        super().__init__(f'Field matrix has more than {max_values} values.')
+        self.max_values = max_values
+
+
+sample_group_samples = db.Table(  # pylint: disable=invalid-name
+    'sample_group_samples',
+    db.Column(
+        'sample_group_uuid',
+        UUID(as_uuid=True),
+        db.ForeignKey('sample_groups.uuid', ondelete='CASCADE'),
+        primary_key=True,
+    ),
+    db.Column(
+        'sample_uuid',
+        UUID(as_uuid=True),
+        db.ForeignKey('samples.uuid', ondelete='CASCADE'),
+        primary_key=True,
+        index=True,
+    ),
+)
 
 
 class SampleGroup(db.Model):  # pylint: disable=too-many-instance-attributes
@@ -25,8 +63,9 @@ class SampleGroup(db.Model):  # pylint: disable=too-many-instance-attributes
     is_library = db.Column(db.Boolean, default=False, nullable=False)
     is_public = db.Column(db.Boolean, default=True, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
-    samples = db.relationship('Sample', lazy=True)
+    samples = db.relationship('Sample', secondary=sample_group_samples, lazy=True)
     analysis_results = db.relationship('SampleGroupAnalysisResult', backref='parent', lazy=True)
+    _name_keys = ('name',)
 
     # Duplicate owner properties/indices because we don't know how we will be looking it up
     __table_args__ = (
@@ -51,11 +90,125 @@ class SampleGroup(db.Model):  # pylint: disable=too-many-instance-attributes
 
         Create and save the sample if it does not already exist.
         """
-        samps = [samp for samp in self.samples if samp.name == sample_name]
-        if samps and not force_new:
-            return samps[0]
+        if not force_new:
+            sample = Sample.query.filter_by(library_uuid=self.uuid, name=sample_name).first()
+            if sample is not None:
+                return sample
         return Sample(sample_name, self.uuid, metadata=metadata).save()
 
+    def _insert_samples(self, samples, merge_metadata=False):
+        """Insert samples bound to this library, SAMPLE_INSERT_CHUNK_SIZE rows at a time.
+
+        Samples that already exist are skipped, or have the new metadata
+        merged into theirs if merge_metadata is set. Return the uuids of the
+        inserted or updated samples by name.
+        """
+        table = Sample.__table__
+        conflict_columns = [table.c.library_uuid, table.c.name]
+        created_at = datetime.datetime.utcnow()
+        names = list(samples)
+        uuids = {}
+        for start in range(0, len(names), SAMPLE_INSERT_CHUNK_SIZE):
+            rows = [{
+                'library_uuid': self.uuid,
+                'name': name,
+                'created_at': created_at,
+                '_sample_metadata': {**samples[name], 'name': name},
+            } for name in names[start:start + SAMPLE_INSERT_CHUNK_SIZE]]
+            stmt = insert(table).values(rows)
+            if merge_metadata:
+                merged = func.coalesce(table.c._sample_metadata, literal({}, JSONB)).op('||')(
+                    stmt.excluded._sample_metadata
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=conflict_columns,
+                    set_={'_sample_metadata': merged},
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+            written = db.session.execute(stmt.returning(table.c.name, table.c.uuid)).fetchall()
+            if written:
+                db.session.execute(
+                    insert(sample_group_samples)
+                    .values([
+                        {'sample_group_uuid': self.uuid, 'sample_uuid': sample_uuid}
+                        for _, sample_uuid in written
+                    ])
+                    .on_conflict_do_nothing()
+                )
+            uuids.update(written)
+        return uuids
+
+    def bulk_samples(self, samples):
+        """Create the samples bound to this library that do not already exist.
+
+        `samples` maps sample names to their metadata. Rows are written with
+        `INSERT ... ON CONFLICT DO NOTHING`, leaving existing samples as they
+        are. Return the uuids of all named samples by name and the names of
+        the samples created. The caller commits.
+        """
+        names = list(samples)
+        uuids = self._insert_samples(samples)
+        created = list(uuids)
+        existing = [name for name in names if name not in uuids]
+        if existing:
+            uuids.update(
+                db.session.query(Sample.name, Sample.uuid)
+                .filter(Sample.library_uuid == self.uuid, Sample.name.in_(existing))
+            )
+        return uuids, created
+
+    def merge_sample_metadata(self, metadata):
+        """Merge metadata into the samples of this library, creating missing samples.
+
+        `metadata` maps sample names to the metadata to merge. Every sample
+        is written by the same batched `INSERT ... ON CONFLICT DO UPDATE`.
+        Return the uuids of the samples by name. The caller commits.
+        """
+        return self._insert_samples(metadata, merge_metadata=True)
+
+    def add_selected_samples(self, sample_uuids):
+        """Add the samples whose uuids sample_uuids, a one column select, selects.
+
+        Memberships are written by one `INSERT ... SELECT`, so the samples
+        never leave the database. Return the number of samples added, not
+        counting existing members. The caller commits.
+        """
+        selected = sample_uuids.alias('selected')
+        return db.session.execute(
+            insert(sample_group_samples)
+            .from_select(
+                ['sample_group_uuid', 'sample_uuid'],
+                select([literal(self.uuid, UUID(as_uuid=True)), list(selected.c)[0]]),
+            )
+            .on_conflict_do_nothing()
+        ).rowcount
+
+    def add_samples(self, sample_uuids):
+        """Add the samples with these uuids to this group.
+
+        Memberships are written by one `INSERT ... SELECT` from the samples
+        matching the uuids, passed as a single array, so no sample is loaded.
+        Return the number of samples added, not counting existing members,
+        and the uuids that match no sample. The caller commits.
+        """
+        requested = select([
+            func.unnest(cast(
+                bindparam('sample_uuids', [str(uuid) for uuid in sample_uuids], type_=ARRAY(String)),
+                ARRAY(UUID(as_uuid=True)),
+            )).label('uuid'),
+        ]).alias('requested')
+        added = self.add_selected_samples(
+            select([Sample.uuid])
+            .select_from(requested.join(Sample.__table__, Sample.uuid == requested.c.uuid))
+        )
+        missing = db.session.execute(
+            select([requested.c.uuid])
+            .select_from(requested.outerjoin(Sample.__table__, Sample.uuid == requested.c.uuid))
+            .where(Sample.uuid.is_(None))
+        ).fetchall()
+        return added, [uuid for uuid, in missing]
+
     def analysis_result(self, module_name):
         """Return an AR for the module bound to this sample.
 
@@ -72,22 +225,96 @@ class SampleGroup(db.Model):  # pylint: disable=too-many-instance-attributes
     def sample_uuids(self):
         return [sample.uuid for sample in self.samples]
 
+    def sample_uuids_query(self):
+        """Return a query of the uuids of the samples in this group."""
+        return db.session.query(Sample.uuid).with_parent(self, 'samples')
+
+    def field_matrix(self, module_name, field_name, path=(), max_values=None):
+        """Return a field of every sample in the group as a sparse samples by features matrix.
+
+        The field data, or the value found at `path` in it, of each sample
+        must map feature names to numbers. Fields are read one at a time, in
+        sample name order, and only their values are kept. Return the sample
+        names, the sorted feature names and a CSR matrix where features
+        missing from a sample are 0. Raise ParseError if the field data of a
+        sample is not such a map, and FieldMatrixTooLarge if the field data
+        hold more than `max_values` values.
+        """
+        field_type = SampleAnalysisResultField
+        criterion = and_(
+            Sample.uuid.in_(self.sample_uuids_query().subquery()),
+            SampleAnalysisResult.sample_uuid == Sample.uuid,
+            SampleAnalysisResult.module_name == module_name,
+            field_type.sample_analysis_result_uuid == SampleAnalysisResult.uuid,
+            field_type.field_name == field_name,
+        )
+        sample_names, columns = [], {}
+        row_indices, column_indices, values = array('q'), array('q'), array('d')
+        for sample_name, profile in field_type.iter_sliced_data(criterion, Sample.name, path):
+            if not isinstance(profile, dict) or \
+                    not all(isinstance(value, (int, float)) for value in profile.values()):
+                raise ParseError(
+                    f'Field data of sample {sample_name} is not a map of feature names to numbers.'
+                )
+            for feature, value in profile.items():
+                column = columns.setdefault(feature, len(columns))
+                if value:
+                    row_indices.append(len(sample_names))
+                    column_indices.append(column)
+                    values.append(value)
+            sample_names.append(sample_name)
+            if max_values is not None and len(values) > max_values:
+                raise FieldMatrixTooLarge(max_values)
+        features = sorted(columns)
+        # Renumber columns so that they follow the sorted feature names
+        ranks = numpy.empty(len(features), dtype=numpy.int64)
+        order = numpy.array([columns[feature] for feature in features], dtype=numpy.int64)
+        ranks[order] = numpy.arange(len(features))
+        matrix = sparse.coo_matrix(
+            (
+                numpy.array(values, dtype=numpy.float64),
+                (
+                    numpy.array(row_indices, dtype=numpy.int64),
+                    ranks[numpy.array(column_indices, dtype=numpy.int64)],
+                ),
+            ),
+            shape=(len(sample_names), len(features)),
+        ).tocsr()
+        matrix.sort_indices()
+        return sample_names, features, matrix
+
+    def _sample_count_subquery(self):
+        return db.session.query(func.count(Sample.uuid)) \
+            .with_parent(self, 'samples') \
+            .as_scalar()
+
+    def module_coverage(self):
+        """Return the number of samples in the group and of those with an AR for each module.
+
+        Counted by Postgres in one query.
+        """
+        sample_count = self._sample_count_subquery()
+        rows = db.session.query(
+            SampleAnalysisResult.module_name, func.count(SampleAnalysisResult.uuid), sample_count,
+        ).filter(SampleAnalysisResult.sample_uuid.in_(self.sample_uuids_query().subquery())) \
+            .group_by(SampleAnalysisResult.module_name) \
+            .all()
+        if not rows:
+            return db.session.query(sample_count).scalar(), {}
+        return rows[0][2], {module_name: count for module_name, count, _ in rows}
+
     @property
     def tools_present(self):
-        """Return list of names for Tool Results present across all Samples in this group."""
-        # Cache samples
-        samples = self.samples
-
-        tools_present_in_all = set([])
-        for i, sample in enumerate(samples):
-            tool_results = set(sample.tool_result_names)
-            if i == 0:
-                tools_present_in_all |= tool_results
-            else:
-                tools_present_in_all &= tool_results
-        return list(tools_present_in_all)
+        """Return the names of modules with an AR for every sample in this group."""
+        sample_count = self._sample_count_subquery()
+        rows = db.session.query(SampleAnalysisResult.module_name) \
+            .filter(SampleAnalysisResult.sample_uuid.in_(self.sample_uuids_query().subquery())) \
+            .group_by(SampleAnalysisResult.module_name) \
+            .having(func.count(SampleAnalysisResult.uuid) == sample_count)
+        return [module_name for module_name, in rows]
 
-    def serializable(self):
+    def serializable(self, list_samples=True):
+        """Return the group as a dict, listing its sample uuids unless list_samples is False."""
         out = {
             'sample_group': {
                 'uuid': self.uuid,
@@ -97,10 +324,11 @@ class SampleGroup(db.Model):  # pylint: disable=too-many-instance-attributes
                 'is_library': self.is_library,
                 'is_public': self.is_public,
                 'created_at': self.created_at,
-                'sample_uuids': [sample.uuid for sample in self.samples],
                 'analysis_result_uuids': [ar.uuid for ar in self.analysis_results],
             },
         }
+        if list_samples:
+            out['sample_group']['sample_uuids'] = [sample.uuid for sample in self.samples]
         return out
 
     def serialize(self):
@@ -115,6 +343,40 @@ class SampleGroup(db.Model):  # pylint: disable=too-many-instance-attributes
     def from_uuid(cls, uuid):
         return cls.query.filter_by(uuid=uuid).one()
 
+    @classmethod
+    def serializable_options(cls):
+        """Return loader options fetching what `serializable` needs for many groups at once."""
+        return (
+            selectinload(cls.samples).load_only('uuid'),
+            selectinload(cls.analysis_results).load_only('uuid'),
+        )
+
+    @classmethod
+    def from_uuid_serializable(cls, uuid):
+        """Return the group with uuid, loading only what `serializable` needs."""
+        return cls.query \
+            .options(*cls.serializable_options()) \
+            .populate_existing() \
+            .filter_by(uuid=uuid) \
+            .one()
+
     @classmethod
     def from_name(cls, name):
         return cls.query.filter_by(name=name).one()
+
+    @classmethod
+    def uuid_from_name(cls, name):
+        """Return the uuid of the group with this name, cached for a few minutes."""
+        return cached_uuid(cls, name=name)
+
+
+def _add_sample_to_library(mapper, connection, target):  # pylint: disable=unused-argument
+    """Make a new sample a member of its library."""
+    connection.execute(sample_group_samples.insert().values(
+        sample_group_uuid=target.library_uuid,
+        sample_uuid=target.uuid,
+    ))
+
+
+watch_names(SampleGroup)
+event.listen(Sample, 'after_insert', _add_sample_to_library)
@@ -1,13 +1,49 @@
 """Sample model definitions."""
 
 import json
+import math
+import operator
+import re
 from datetime import datetime
-from sqlalchemy import UniqueConstraint
-from sqlalchemy.dialects.postgresql import UUID
+from decimal import Decimal
+
+from sqlalchemy import Numeric, UniqueConstraint, case, cast, or_
+from sqlalchemy.dialects.postgresql import JSONB, UUID
+from sqlalchemy.orm import selectinload
 
 from app.extensions import db
 
 from .analysis_result_models import SampleAnalysisResult
+from .name_cache import cached_uuid, watch_names
+
+
+METADATA_NUMBER_PATTERN = r'^-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?$'
+METADATA_COMPARISONS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+METADATA_OPERATORS = ('eq', 'in') + tuple(METADATA_COMPARISONS)
+
+
+def _metadata_candidates(value):
+    """Return the JSON values a metadata query string may stand for.
+
+    Spreadsheet uploads store numbers and booleans as such while csv uploads
+    store strings, so `3` matches both "3" and 3. NaN and infinities, which
+    JSON cannot hold, only match as strings.
+    """
+    candidates = [value]
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return candidates
+    if isinstance(parsed, float) and not math.isfinite(parsed):
+        return candidates
+    if isinstance(parsed, (bool, int, float)):
+        candidates.append(parsed)
+    return candidates
 
 
 class Sample(db.Model):
@@ -16,6 +52,7 @@ class Sample(db.Model):
     __tablename__ = 'samples'
     __table_args__ = (
         UniqueConstraint("library_uuid", "name"),
+        db.Index('_sample_metadata_gin_idx', '_sample_metadata', postgresql_using='gin'),
     )
 
     uuid = db.Column(
@@ -30,11 +67,15 @@ class Sample(db.Model):
         nullable=False
     )
     name = db.Column(db.String(256), index=True, nullable=False)
-    _sample_metadata = db.Column(db.String(10 * 1000), nullable=True)
+    _sample_metadata = db.Column(JSONB, nullable=True)
     analysis_results = db.relationship(
         'SampleAnalysisResult', backref='parent', lazy=True
     )
     theme = db.Column(db.String(256), default='')
+    _name_keys = ('library_uuid', 'name')
+    serializable_fields = (
+        'uuid', 'name', 'library_uuid', 'created_at', 'analysis_result_uuids', 'sample_metadata',
+    )
 
     def __init__(  # pylint: disable=too-many-arguments
             self, name, library_uuid,
@@ -42,8 +83,7 @@ class Sample(db.Model):
             created_at=datetime.utcnow()):
         self.library_uuid = library_uuid
         self.name = name
-        metadata['name'] = name
-        self._sample_metadata = json.dumps(metadata)
+        self._sample_metadata = {**metadata, 'name': name}
         self.created_at = created_at
 
     def serializable(self):
@@ -75,14 +115,12 @@ class Sample(db.Model):
         return result
 
     def set_sample_metadata(self, data):
-        metadata = self.sample_metadata
-        metadata.update(data)
-        self._sample_metadata = json.dumps(metadata)
+        self._sample_metadata = {**self.sample_metadata, **data}
         return self.save()
 
     @property
     def sample_metadata(self):
-        return json.loads(self._sample_metadata)
+        return dict(self._sample_metadata or {})
 
     def save(self):
         db.session.add(self)
@@ -93,6 +131,83 @@ class Sample(db.Model):
     def from_uuid(cls, uuid):
         return cls.query.filter_by(uuid=uuid).one()
 
+    @classmethod
+    def serializable_options(cls):
+        """Return loader options fetching what `serializable` needs for many samples at once."""
+        return (selectinload(cls.analysis_results).load_only('uuid'),)
+
+    @classmethod
+    def serializable_columns(cls, fields):
+        """Return the columns to select to serialize fields of many samples.
+
+        The keyset columns, `created_at` and `uuid`, are always selected.
+        """
+        columns = [cls.created_at, cls.uuid]
+        columns += [getattr(cls, field) for field in ('name', 'library_uuid') if field in fields]
+        if 'sample_metadata' in fields:
+            columns.append(cls._sample_metadata)
+        return columns
+
+    @classmethod
+    def serializable_rows(cls, rows, fields):
+        """Serialize rows selected with `serializable_columns` like `serializable` does.
+
+        Only fields are included. Analysis result uuids are loaded with one
+        query for all rows, and only if asked for.
+        """
+        if 'analysis_result_uuids' in fields:
+            result_uuids = {row.uuid: [] for row in rows}
+            if result_uuids:
+                results = db.session.query(
+                    SampleAnalysisResult.sample_uuid, SampleAnalysisResult.uuid
+                ).filter(SampleAnalysisResult.sample_uuid.in_(result_uuids))
+                for sample_uuid, result_uuid in results:
+                    result_uuids[sample_uuid].append(result_uuid)
+        out = []
+        for row in rows:
+            sample = {
+                field: getattr(row, field)
+                for field in ('uuid', 'name', 'library_uuid', 'created_at') if field in fields
+            }
+            if 'analysis_result_uuids' in fields:
+                sample['analysis_result_uuids'] = result_uuids[row.uuid]
+            serialized = {'sample': sample}
+            if 'sample_metadata' in fields:
+                serialized['sample_metadata'] = row._sample_metadata or {}
+            out.append(serialized)
+        return out
+
+    @classmethod
+    def metadata_criterion(cls, key, op, value):
+        """Return a criterion comparing the metadata value under key to value.
+
+        `op` is one of METADATA_OPERATORS. `eq` and `in`, which takes comma
+        separated values, are containment tests served by the GIN index.
+        Comparisons are numeric when value is a number, and otherwise
+        between strings, which suits ISO dates.
+        """
+        column = cls._sample_metadata
+        if op in ('eq', 'in'):
+            values = value.split(',') if op == 'in' else [value]
+            return or_(*[
+                column.contains({key: candidate})
+                for each in values for candidate in _metadata_candidates(each)
+            ])
+        compare = METADATA_COMPARISONS[op]
+        field = column[key].astext
+        if not re.match(METADATA_NUMBER_PATTERN, value):
+            return compare(field, value)
+        number = case([(field.op('~')(METADATA_NUMBER_PATTERN), cast(field, Numeric))])
+        return compare(number, Decimal(value))
+
     @classmethod
     def from_name_library(cls, module_name, library_uuid):
         return cls.query.filter_by(library_uuid=library_uuid, name=module_name).one()
+
+    @classmethod
+    def uuid_from_name_library(cls, name, library_uuid):
+        """Return the uuid of the named sample in the library, cached for a few minutes."""
+        return cached_uuid(cls, library_uuid=library_uuid, name=name)
+
+
+watch_names(Sample)
@@ -0,0 +1,65 @@
+"""Celery tasks run by the worker."""
+
+from io import BytesIO
+
+from flask import current_app
+from sqlalchemy.exc import DataError
+
+from app.db_models import MetadataUploadJob, SampleGroup
+from app.extensions import db, celery, celery_logger
+from app.utils import METADATA_SHEET_ERRORS, metadata_sample_name, read_metadata_sheet
+
+
+@celery.task()
+def ingest_metadata(job_uuid):
+    """Merge the sheet stored with a metadata upload job into its library.
+
+    Rows are merged and committed METADATA_JOB_BATCH_SIZE sample names at a
+    time so the job reports its progress. A batch that cannot be stored is
+    recorded as an error on the job and skipped. Any other failure is
+    recorded as well, and the job always finishes.
+    """
+    job = MetadataUploadJob.from_uuid(job_uuid)
+    job.status = 'WORKING'
+    job.save()
+    batch_size = current_app.config['METADATA_JOB_BATCH_SIZE']
+
+    def store(library, updates, first_row, last_row):
+        """Merge one batch of metadata, recording progress or the error."""
+        try:
+            library.merge_sample_metadata(updates)
+            job.rows_processed += last_row - first_row + 1
+        except DataError as data_error:
+            db.session.rollback()
+            job.add_error(first_row, last_row, str(data_error.orig))
+        job.save()
+
+    try:
+        library = SampleGroup.from_uuid(job.library_uuid)
+        metadata = read_metadata_sheet(job.filename, BytesIO(job.upload))
+        if not metadata.fieldnames:
+            raise ValueError('Metadata sheet has no header row.')
+        sample_name_col = metadata.fieldnames[0]
+        updates, first_row = {}, 2  # Row 1 of the sheet is its header
+        for row_num, row in enumerate(metadata, start=2):
+            sample_name = metadata_sample_name(row.pop(sample_name_col))
+            if sample_name is None:
+                if any(value not in (None, '') for value in row.values()):
+                    job.add_error(row_num, row_num, 'Row has no sample name.')
+                continue
+            updates.setdefault(sample_name, {}).update(row)
+            if len(updates) >= batch_size:
+                store(library, updates, first_row, row_num)
+                updates, first_row = {}, row_num + 1
+        if updates:
+            store(library, updates, first_row, row_num)
+    except METADATA_SHEET_ERRORS as parse_error:
+        celery_logger.exception(f'Metadata upload {job_uuid} could not be read.')
+        job.add_error(None, None, str(parse_error))
+    except Exception as error:  # pylint: disable=broad-except
+        db.session.rollback()
+        celery_logger.exception(f'Metadata upload {job_uuid} failed.')
+        job.add_error(None, None, str(error))
+    finally:
+        job.finish()
+        job.save()
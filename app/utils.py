@@ -1,9 +1,18 @@
 """Utilities for the entire app."""
 
+import codecs
+import zipfile
+
 from collections import OrderedDict
+from csv import DictReader, Error as CSVError
+from datetime import date, time
 from functools import wraps
+from threading import Lock
+from time import monotonic
 
+import openpyxl
 import xlrd
+from openpyxl.utils.exceptions import InvalidFileException
 
 
 def lock_function(lock):
@@ -22,36 +31,240 @@ def lock_function(lock):
     return decorator
 
 
-class XLSDictReader:  # pylint: disable=too-few-public-methods
+class LRUCache:
+    """A bounded, thread safe mapping that evicts its least recently used entries."""
+
+    def __init__(self, maxsize=128, ttl=None, maxweight=None):
+        """Create an empty LRUCache holding at most maxsize entries.
+
+        Entries expire ttl seconds after they are set, if ttl is given. If
+        maxweight is given, the weights the entries are set with add up to at
+        most maxweight.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        """Return the number of cached entries."""
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the value cached for key, or default."""
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            expires_at, _, value = self._entries[key]
+            if expires_at is not None and expires_at <= monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value, weight=1):
+        """Cache value for key, evicting the oldest entries if full.
+
+        Values weighing more than maxweight are not cached.
+        """
+        expires_at = None if self.ttl is None else monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.maxweight is not None and weight > self.maxweight:
+                return
+            self._entries[key] = (expires_at, weight, value)
+            self.weight += weight
+            while len(self._entries) > self.maxsize or \
+                    (self.maxweight is not None and self.weight > self.maxweight):
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key, default=None):
+        """Remove and return the value cached for key, or default."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            return self._remove(key)
+
+    def _remove(self, key):
+        """Remove and return the value cached for key. The caller holds the lock."""
+        _, weight, value = self._entries.pop(key)
+        self.weight -= weight
+        return value
+
+    def clear(self):
+        """Remove every entry and reset the hit and miss counts."""
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Return the hit and miss counts, size and bounds of the cache."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'weight': self.weight,
+                'maxweight': self.maxweight,
+                'ttl': self.ttl,
+            }
+
+
+def _cell_value(value):
+    """Return a spreadsheet cell value as JSON friendly data.
+
+    Dates and times become ISO 8601 strings and whole numbers become ints.
     """
-    A csv.DictReader-like class from xls(x) files.
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
 
-    Based on: https://stackoverflow.com/a/25914394
+
+def _xlsx_rows(stream):
+    """Yield the cell values of each row of the first sheet of an xlsx workbook.
+
+    The workbook is opened read-only, so rows are parsed as they are read.
     """
+    try:
+        workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except (InvalidFileException, KeyError, zipfile.BadZipFile) as invalid_file:
+        raise ValueError(f'Invalid xlsx metadata sheet: {invalid_file}')
+    try:
+        for row in workbook.worksheets[0].iter_rows():
+            yield [_cell_value(cell.value) for cell in row]
+    finally:
+        workbook.close()
 
-    def __init__(self, workbook_file, sheet_index=0):
-        """Create XLSDictReader from file."""
-        book = xlrd.open_workbook(workbook_file)
-        sheet = book.sheet_by_index(sheet_index)
 
-        def item(i, j):
-            """Return header and contents for a given cell location."""
-            return (sheet.cell_value(0, j), sheet.cell_value(i, j))
+def _xls_rows(stream):
+    """Yield the cell values of each row of the first sheet of an xls workbook.
+
+    The legacy format has no streaming reader, but only the first sheet is
+    loaded and rows are converted one at a time.
+    """
+    try:
+        book = xlrd.open_workbook(file_contents=stream.read(), on_demand=True)
+    except xlrd.XLRDError as invalid_file:
+        raise ValueError(f'Invalid xls metadata sheet: {invalid_file}')
+    try:
+        sheet = book.sheet_by_index(0)
+        for row_num in range(sheet.nrows):
+            values = []
+            for cell in sheet.row(row_num):
+                if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+                    value = None
+                elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                    value = bool(cell.value)
+                elif cell.ctype == xlrd.XL_CELL_DATE:
+                    value = xlrd.xldate.xldate_as_datetime(cell.value, book.datemode)
+                else:
+                    value = cell.value
+                values.append(_cell_value(value))
+            yield values
+    finally:
+        book.release_resources()
 
-        self.rows = (OrderedDict(item(i, j) for j in range(sheet.ncols))
-                     for i in range(1, sheet.nrows))
-        self.fieldnames = [sheet.cell_value(0, i) for i in range(sheet.ncols)]
-        self.row_num = 0
+
+def _check_fieldnames(fieldnames):
+    """Raise ValueError if a metadata sheet field name is blank or repeated."""
+    seen = set()
+    for name in fieldnames:
+        if name is None or not name.strip():
+            raise ValueError('Metadata sheet has an empty column header.')
+        if name in seen:
+            raise ValueError(f'Metadata sheet has a duplicate column header: {name}')
+        seen.add(name)
+
+
+class WorkbookDictReader:  # pylint: disable=too-few-public-methods
+    """A csv.DictReader-like reader over the first sheet of an xlsx or xls workbook.
+
+    The first row holds the field names, which must be distinct and not
+    blank. Rows are yielded one at a time as OrderedDicts, skipping empty
+    rows. Missing cells are None.
+    """
+
+    def __init__(self, stream, sheet_format='xlsx'):
+        """Create WorkbookDictReader from a binary file object.
+
+        Raise ValueError if a field name is blank or repeated.
+        """
+        self._rows = _xlsx_rows(stream) if sheet_format == 'xlsx' else _xls_rows(stream)
+        header = next(self._rows, [])
+        while header and header[-1] is None:
+            header.pop()
+        self.fieldnames = [None if name is None else str(name) for name in header]
+        _check_fieldnames(self.fieldnames)
 
     def __iter__(self):
         """Return iterator."""
         return self
 
     def __next__(self):
-        """Get next item of iterator."""
-        if self.row_num >= len(self.rows):
-            raise StopIteration()
+        """Get next non-empty row of the sheet."""
+        while True:
+            values = next(self._rows)
+            if any(value not in (None, '') for value in values):
+                values += [None] * (len(self.fieldnames) - len(values))
+                return OrderedDict(zip(self.fieldnames, values))
+
+
+# Raised while reading malformed metadata sheets
+METADATA_SHEET_ERRORS = (ValueError, CSVError)
+METADATA_SHEET_FORMATS = {
+    'csv': 'csv',
+    'tsv': 'tsv',
+    'xls': 'xls',
+    'xlsx': 'xlsx',
+    'xlsm': 'xlsx',
+}
 
-        row = self.rows[self.row_num]
-        self.row_num += 1
-        return row
+
+def metadata_sheet_format(filename):
+    """Return the format of a metadata sheet, `csv`, `tsv`, `xls` or `xlsx`, from its filename."""
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    try:
+        return METADATA_SHEET_FORMATS[extension]
+    except KeyError:
+        raise ValueError('Missing valid metadata file attachment.')
+
+
+def metadata_sample_name(value):
+    """Return the sample name held in a metadata sheet cell, or None if the cell is blank.
+
+    Whole numbers read as floats name samples without a fractional part.
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if value is None or not str(value).strip():
+        return None
+    return str(value)
+
+
+def read_metadata_sheet(filename, stream):
+    """Return a DictReader-like over the rows of the metadata sheet in a binary file object.
+
+    Rows are parsed as they are iterated over. Raise ValueError if a field
+    name is blank or repeated.
+    """
+    sheet_format = metadata_sheet_format(filename)
+    if sheet_format in ('csv', 'tsv'):
+        lines = codecs.iterdecode(stream, 'utf-8-sig')
+        reader = DictReader(lines, delimiter=',' if sheet_format == 'csv' else '\t')
+        _check_fieldnames(reader.fieldnames or [])
+        return reader
+    return WorkbookDictReader(stream, sheet_format=sheet_format)
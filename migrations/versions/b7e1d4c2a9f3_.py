@@ -0,0 +1,32 @@
+"""Keyset indexes on analysis results
+
+Revision ID: b7e1d4c2a9f3
+Revises: 9ac024109a64
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1d4c2a9f3'
+down_revision = '9ac024109a64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS, as these tables may have been created from the models
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS _sample_analysis_results_keyset_idx '
+        'ON sample_analysis_results (created_at, uuid)'
+    )
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS _sample_group_analysis_results_keyset_idx '
+        'ON sample_group_analysis_results (created_at, uuid)'
+    )
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS _sample_group_analysis_results_keyset_idx')
+    op.execute('DROP INDEX IF EXISTS _sample_analysis_results_keyset_idx')
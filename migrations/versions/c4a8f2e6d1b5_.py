@@ -0,0 +1,41 @@
+"""Sample group membership association table
+
+Revision ID: c4a8f2e6d1b5
+Revises: b7e1d4c2a9f3
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8f2e6d1b5'
+down_revision = 'b7e1d4c2a9f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sample_group_samples',
+        sa.Column('sample_group_uuid', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('sample_uuid', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.ForeignKeyConstraint(['sample_group_uuid'], ['sample_groups.uuid'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['sample_uuid'], ['samples.uuid'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('sample_group_uuid', 'sample_uuid')
+    )
+    op.create_index(
+        op.f('ix_sample_group_samples_sample_uuid'), 'sample_group_samples', ['sample_uuid'],
+        unique=False,
+    )
+    # Samples used to belong to their library alone, through samples.library_uuid
+    op.execute(
+        'INSERT INTO sample_group_samples (sample_group_uuid, sample_uuid) '
+        'SELECT library_uuid, uuid FROM samples'
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_sample_group_samples_sample_uuid'), table_name='sample_group_samples')
+    op.drop_table('sample_group_samples')
@@ -7,9 +7,11 @@ from app.db_models import (
     SampleAnalysisResult,
     SampleGroupAnalysisResult,
 )
+from app.db_models.analysis_result_models import FIELD_DATA_CACHE
+from app.extensions import db
 from tests.base import BaseTestCase
 
-from ..utils import add_sample_group
+from ..utils import add_sample_group, count_queries
 
 
 class TestAnalysisResultModel(BaseTestCase):
@@ -67,3 +69,115 @@ class TestAnalysisResultModel(BaseTestCase):
         dup = SampleGroupAnalysisResult('module_1 HHJH', g2.uuid).save()
         self.assertEqual(orig.module_name, dup.module_name)
         self.assertNotEqual(orig.parent_uuid, dup.parent_uuid)
+
+    def test_large_field_is_chunked(self):
+        """Ensure payloads too large to store inline are chunked and read back intact."""
+        library = add_sample_group('LBRY_01 KJHGF', is_library=True)
+        sample = library.sample('SMPL_01 KJHGF')
+        ar = sample.analysis_result('module_1 KJHGF')
+        data = {f'taxon_{i}': i / 7 for i in range(40 * 1000)}
+        field = ar.field('field_1').set_data(data)
+        self.assertTrue(field.is_chunked)
+        self.assertIsNone(field.stored_data)
+        self.assertGreater(field.chunks.count(), 1)
+        self.assertEqual(field.data, data)
+
+    def test_chunked_field_can_shrink(self):
+        """Ensure a chunked field stored again with a small payload drops its chunks."""
+        library = add_sample_group('LBRY_01 MNBVC', is_library=True)
+        sample = library.sample('SMPL_01 MNBVC')
+        ar = sample.analysis_result('module_1 MNBVC')
+        field = ar.field('field_1').set_data(['x' * 100] * 1000)
+        field = field.set_data('small')
+        self.assertFalse(field.is_chunked)
+        self.assertEqual(field.chunks.count(), 0)
+        self.assertEqual(field.data, 'small')
+
+    def test_large_field_is_compressed(self):
+        """Ensure large payloads are gzipped when compression is enabled."""
+        self.app.config['COMPRESS_FIELD_DATA'] = True
+        library = add_sample_group('LBRY_01 POIUY', is_library=True)
+        sample = library.sample('SMPL_01 POIUY')
+        ar = sample.analysis_result('module_1 POIUY')
+        data = {f'taxon_{i}': i for i in range(40 * 1000)}
+        field = ar.field('field_1').set_data(data)
+        self.assertTrue(field.is_chunked)
+        self.assertEqual(field.content_encoding, 'gzip')
+        self.assertEqual(field.data, data)
+
+    def test_field_data_is_memoized(self):
+        """Ensure decoded field data is cached by uuid and version."""
+        library = add_sample_group('LBRY_01 WSXED', is_library=True)
+        sample = library.sample('SMPL_01 WSXED')
+        ar = sample.analysis_result('module_1 WSXED')
+        field = ar.field('field_1').set_data({'a': 1})
+        self.assertEqual(field.data, {'a': 1})
+        self.assertEqual(FIELD_DATA_CACHE.get((field.uuid, field.version)), {'a': 1})
+
+    def test_large_field_data_is_not_memoized(self):  # pylint: disable=invalid-name
+        """Ensure decoded field data above the configured length is not cached."""
+        library = add_sample_group('LBRY_01 EDCRF', is_library=True)
+        sample = library.sample('SMPL_01 EDCRF')
+        ar = sample.analysis_result('module_1 EDCRF')
+        data = {f'taxon_{i}': i for i in range(2000)}
+        field = ar.field('field_1').set_data(data)
+        self.assertTrue(field.is_chunked)
+        self.assertEqual(field.data, data)
+        self.assertIsNone(FIELD_DATA_CACHE.get((field.uuid, field.version)))
+        self.assertEqual(ar.field_data(), {'field_1': data})
+        self.assertIsNone(FIELD_DATA_CACHE.get((field.uuid, field.version)))
+
+    def test_compressible_field_data_is_not_small(self):  # pylint: disable=invalid-name
+        """Ensure inline payloads are sized by their serialized length, not their stored size."""
+        library = add_sample_group('LBRY_01 YHNUJ', is_library=True)
+        small_ar = library.sample('SMPL_01 YHNUJ').analysis_result('module_1 YHNUJ')
+        small_ar.field('field_1').set_data({'taxa': 'a'})
+        large_ar = library.sample('SMPL_02 YHNUJ').analysis_result('module_1 YHNUJ')
+        large_field = large_ar.field('field_1').set_data({'taxa': 'a'})
+        # Compresses to far less than MIN_MEMOIZED_FIELD_SIZE when stored
+        large_field.stored_data = {'taxa': 'a' * 100 * 1000}
+        db.session.commit()
+        with count_queries() as small_statements:
+            self.assertEqual({'field_1': {'taxa': 'a'}}, small_ar.field_data())
+        with count_queries() as large_statements:
+            self.assertEqual({'field_1': {'taxa': 'a' * 100 * 1000}}, large_ar.field_data())
+        # The large payload is left out of the first query and loaded on its own
+        self.assertEqual(len(small_statements) + 1, len(large_statements))
+
+    def test_set_data_invalidates_memoized_data(self):  # pylint: disable=invalid-name
+        """Ensure storing new data bumps the version so stale data is not served."""
+        library = add_sample_group('LBRY_01 RFVTG', is_library=True)
+        sample = library.sample('SMPL_01 RFVTG')
+        ar = sample.analysis_result('module_1 RFVTG')
+        field = ar.field('field_1').set_data({'a': 1})
+        self.assertEqual(ar.field_data(), {'field_1': {'a': 1}})
+        version = field.version
+        field = field.set_data({'a': 2})
+        self.assertEqual(field.version, version + 1)
+        self.assertIsNone(FIELD_DATA_CACHE.get((field.uuid, version)))
+        self.assertEqual(field.data, {'a': 2})
+        self.assertEqual(ar.field_data(), {'field_1': {'a': 2}})
+
+    def test_upsert_fields(self):
+        """Ensure upserting creates the AR and overwrites existing fields."""
+        library = add_sample_group('LBRY_01 TGBYH', is_library=True)
+        sample = library.sample('SMPL_01 TGBYH')
+        ar = sample.analysis_result('module_1 TGBYH')
+        old_field = ar.field('field_1').set_data({'a': 1})
+        large_payload = {f'taxon_{i}': i for i in range(40 * 1000)}
+        key = (sample.uuid, 'module_1 TGBYH')
+        ar_uuid, field_uuids = SampleAnalysisResult.upsert_fields({
+            key: {'field_1': {'a': 2}, 'field_2': large_payload},
+        })[key]
+        db.session.commit()
+        self.assertEqual(ar_uuid, ar.uuid)
+        self.assertEqual(field_uuids['field_1'], old_field.uuid)
+        self.assertEqual(ar.field_data(), {'field_1': {'a': 2}, 'field_2': large_payload})
+        self.assertTrue(ar.field('field_2').is_chunked)
+
+        key = (sample.uuid, 'module_2 TGBYH')
+        ar_uuid, _ = SampleAnalysisResult.upsert_fields({key: {'field_1': 'data_1'}})[key]
+        db.session.commit()
+        ar = SampleAnalysisResult.query.get(ar_uuid)
+        self.assertEqual(ar.module_name, 'module_2 TGBYH')
+        self.assertEqual(ar.field_data(), {'field_1': 'data_1'})
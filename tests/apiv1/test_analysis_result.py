@@ -1,17 +1,22 @@
 """Test suite for AnalysisResults module."""
 
+import gzip
 import json
 
+from uuid import uuid4
+
 from app.db_models import (
     Sample,
+    SampleGroup,
     SampleAnalysisResult,
     SampleGroupAnalysisResult,
     SampleAnalysisResultField,
     SampleGroupAnalysisResultField,
 )
+from app.extensions import db
 from tests.base import BaseTestCase
 
-from ..utils import add_sample_group
+from ..utils import add_sample_group, count_queries
 
 
 class TestAnalysisResultModule(BaseTestCase):
@@ -40,6 +45,60 @@ class TestAnalysisResultModule(BaseTestCase):
             self.assertIn('field_2', data['data'])
             self.assertEqual('data_2', data['data']['field_2'])
 
+    def test_get_sample_result_from_names_query_count(self):  # pylint: disable=invalid-name
+        """Benchmark the queries needed to get all fields of a result by name."""
+        lib_name, sample_name, module_name = 'LBRY_01 IKMJU', 'SMPL_01 IKMJU', 'module_1 IKMJU'
+        library = add_sample_group(lib_name, is_library=True)
+        sample = library.sample(sample_name)
+        analysis_result = sample.analysis_result(module_name)
+        for i in range(5):
+            analysis_result.field(f'field_{i}').set_data({'value': i})
+        db.session.expunge_all()
+        with count_queries() as walked:
+            library = SampleGroup.from_name(lib_name)
+            sample = Sample.from_name_library(sample_name, library.uuid)
+            analysis_result = SampleAnalysisResult.from_name_sample(module_name, sample.uuid)
+            expected = {field.field_name: field.stored_data for field in analysis_result.module_fields}
+        db.session.expunge_all()
+        BY_NAME_URL = f'/api/v1/analysis_results/byname/{lib_name}/{sample_name}/{module_name}'
+        with self.client, count_queries() as joined:
+            response = self.client.get(BY_NAME_URL, content_type='application/json')
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(expected, data['data'])
+        self.assertEqual(9, len(walked))
+        self.assertEqual(1, len(joined))
+
+    def test_get_missing_sample_result_from_names(self):  # pylint: disable=invalid-name
+        """Ensure results without fields are told apart from missing results."""
+        lib_name, sample_name = 'LBRY_01 YHNUJ', 'SMPL_01 YHNUJ'
+        library = add_sample_group(lib_name, is_library=True)
+        library.sample(sample_name).analysis_result('module_1')
+        BY_NAME_URL = f'/api/v1/analysis_results/byname/{lib_name}/{sample_name}'
+        with self.client:
+            response = self.client.get(BY_NAME_URL + '/module_1')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual({}, json.loads(response.data.decode())['data'])
+            response = self.client.get(BY_NAME_URL + '/module_2')
+            self.assertEqual(response.status_code, 404)
+
+    def test_get_sample_result_slice_from_names(self):
+        """Ensure path and keys arguments return only a slice of each field."""
+        lib_name, sample_name, module_name = 'LBRY_01 PLMKO', 'SMPL_01 PLMKO', 'module_1 PLMKO'
+        library = add_sample_group(lib_name, is_library=True)
+        sample = library.sample(sample_name)
+        analysis_result = sample.analysis_result(module_name)
+        analysis_result.field('field_1').set_data({'taxa': {'a': 1, 'b': 2, 'c': 3}})
+        BY_NAME_URL = f'/api/v1/analysis_results/byname/{lib_name}/{sample_name}/{module_name}'
+        with self.client:
+            response = self.client.get(
+                BY_NAME_URL + '?path=taxa&keys=a,c',
+                content_type='application/json',
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual({'a': 1, 'c': 3}, data['data']['field_1'])
+
     def test_create_sample_result_ar_from_names(self):
         """Ensure creating an analysis result field behaves correctly."""
         lib_name, sample_name, module_name = 'LBRY_01 YTHEH', 'SMPL_01 YTHEH', 'module_1 YTHEH'
@@ -65,6 +124,110 @@ class TestAnalysisResultModule(BaseTestCase):
             self.assertEqual(field.field_name, 'field_2')
             self.assertEqual(field.parent_uuid, analysis_result.uuid)
 
+    def test_create_sample_result_with_invalid_numbers(self):  # pylint: disable=invalid-name
+        """Ensure NaN, infinities and NUL characters are refused whatever the payload size."""
+        lib_name, sample_name, module_name = 'LBRY_01 OKMNJ', 'SMPL_01 OKMNJ', 'module_1 OKMNJ'
+        library = add_sample_group(lib_name, is_library=True)
+        sample = library.sample(sample_name)
+        BY_NAME_URL = f'/api/v1/analysis_results/byname/{lib_name}/{sample_name}/{module_name}'
+        payloads = [
+            '{"field_1": {"depth": NaN}}',
+            '{"field_1": [' + ', '.join(['1.5'] * 5000 + ['Infinity']) + ']}',
+            json.dumps({'field_1': 'a\u0000b'}),
+        ]
+        with self.client:
+            for payload in payloads:
+                response = self.client.post(
+                    BY_NAME_URL + '/field_1',
+                    content_type='application/json',
+                    data=payload,
+                )
+                self.assertEqual(response.status_code, 400)
+                response = self.client.post(
+                    BY_NAME_URL,
+                    content_type='application/json',
+                    data=payload,
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual({}, sample.analysis_result(module_name).field_data())
+
+    def test_upsert_sample_result_fields_from_names(self):  # pylint: disable=invalid-name
+        """Ensure every field of an analysis result can be stored at once."""
+        lib_name, sample_name, module_name = 'LBRY_01 UJMIK', 'SMPL_01 UJMIK', 'module_1 UJMIK'
+        library = add_sample_group(lib_name, is_library=True)
+        sample = library.sample(sample_name)
+        sample.analysis_result(module_name).field('field_1').set_data('stale')
+        BY_NAME_URL = f'/api/v1/analysis_results/byname/{lib_name}/{sample_name}/{module_name}'
+        with self.client:
+            response = self.client.post(
+                BY_NAME_URL,
+                content_type='application/json',
+                data=json.dumps({'field_1': 'data_1', 'field_2': {'value': 2}}),
+            )
+            self.assertEqual(response.status_code, 201)
+            data = json.loads(response.data.decode())
+            self.assertEqual({'field_1', 'field_2'}, set(data['data']['analysis_result']['fields']))
+            analysis_result = SampleAnalysisResult.query.filter_by(
+                uuid=data['data']['analysis_result']['uuid']
+            ).first()
+            self.assertEqual(module_name, analysis_result.module_name)
+            self.assertEqual(sample.uuid, analysis_result.sample_uuid)
+            self.assertEqual(
+                {'field_1': 'data_1', 'field_2': {'value': 2}},
+                analysis_result.field_data(),
+            )
+
+    def test_bulk_upsert_sample_results_from_ndjson(self):  # pylint: disable=invalid-name
+        """Ensure NDJSON records are stored and bad records reported by line."""
+        lib_name = 'LBRY_01 WSXED'
+        library = add_sample_group(lib_name, is_library=True)
+        sample_1, sample_2 = library.sample('SMPL_01 WSXED'), library.sample('SMPL_02 WSXED')
+        records = [
+            {'sample': sample_1.name, 'module': 'module_1', 'field': 'field_1', 'data': 1},
+            {'sample': sample_1.name, 'module': 'module_1', 'field': 'field_2', 'data': 2},
+            {'sample': 'SMPL_03 WSXED', 'module': 'module_1', 'field': 'field_1', 'data': 3},
+            {'sample': sample_2.name, 'module': 'module_1', 'field': 'field_1', 'data': float('nan')},
+            {'sample': sample_2.name, 'module': 'module_2', 'field': 'field_1', 'data': [4]},
+        ]
+        body = '\n'.join([json.dumps(record) for record in records] + ['{"sample": '])
+        with self.client:
+            response = self.client.post(
+                f'/api/v1/analysis_results/byname/{lib_name}/bulk',
+                content_type='application/x-ndjson',
+                data=body,
+            )
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode())
+            self.assertEqual(3, data['data']['stored'])
+            self.assertEqual([3, 4, 6], [error['line'] for error in data['data']['errors']])
+            self.assertEqual(
+                {'field_1': 1, 'field_2': 2},
+                sample_1.analysis_result('module_1').field_data(),
+            )
+            self.assertEqual({'field_1': [4]}, sample_2.analysis_result('module_2').field_data())
+
+    def test_bulk_upsert_reports_only_bad_records(self):  # pylint: disable=invalid-name
+        """Ensure a bad record does not fail the good records of the same analysis result."""
+        lib_name = 'LBRY_01 QAZPL'
+        library = add_sample_group(lib_name, is_library=True)
+        sample = library.sample('SMPL_01 QAZPL')
+        records = [
+            {'sample': sample.name, 'module': 'module_1', 'field': 'field_1', 'data': float('nan')},
+            {'sample': sample.name, 'module': 'module_1', 'field': 'field_2', 'data': 2},
+        ]
+        body = '\n'.join(json.dumps(record) for record in records)
+        with self.client:
+            response = self.client.post(
+                f'/api/v1/analysis_results/byname/{lib_name}/bulk',
+                content_type='application/x-ndjson',
+                data=body,
+            )
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode())
+            self.assertEqual(1, data['data']['stored'])
+            self.assertEqual([1], [error['line'] for error in data['data']['errors']])
+            self.assertEqual({'field_2': 2}, sample.analysis_result('module_1').field_data())
+
     def test_get_s3uri_sample_result_ar_from_names(self):
         """Ensure get single analysis result behaves correctly."""
         lib_name, sample_name = 'LBRY_01 HRAVWQ', 'SMPL_01 HRAVWQ'
@@ -130,6 +293,26 @@ class TestAnalysisResultModule(BaseTestCase):
             self.assertEqual(field.field_name, 'field_2')
             self.assertEqual(field.parent_uuid, analysis_result.uuid)
 
+    def test_upsert_group_result_fields_from_names(self):  # pylint: disable=invalid-name
+        """Ensure every field of a group analysis result can be stored at once."""
+        lib_name, module_name = 'LBRY_01 OLPYG', 'module_1 OLPYG'
+        library = add_sample_group(lib_name, is_library=True)
+        BY_NAME_URL = f'/api/v1/analysis_results/byname/group/{lib_name}/{module_name}'
+        with self.client:
+            response = self.client.post(
+                BY_NAME_URL,
+                content_type='application/json',
+                data=json.dumps({'field_1': 'data_1', 'field_2': 'data_2'}),
+            )
+            self.assertEqual(response.status_code, 201)
+            data = json.loads(response.data.decode())
+            analysis_result = library.analysis_result(module_name)
+            self.assertEqual(str(analysis_result.uuid), data['data']['analysis_result']['uuid'])
+            self.assertEqual(
+                {'field_1': 'data_1', 'field_2': 'data_2'},
+                analysis_result.field_data(),
+            )
+
     def test_get_s3uri_group_result_ar_from_names(self):
         """Ensure get single analysis result behaves correctly."""
         lib_name, module_name, field_name = 'LBRY_01 POIU', 'module_1 POIU', 'field_1 POIU'
@@ -164,6 +347,84 @@ class TestAnalysisResultModule(BaseTestCase):
             self.assertIn('uuid', data['data']['analysis_result'])
             self.assertIn('module_name', data['data']['analysis_result'])
 
+    def test_get_single_sample_result_field_streams_chunks(self):  # pylint: disable=invalid-name
+        """Ensure a chunked field is streamed back inside the usual envelope."""
+        library = add_sample_group('LBRY_01 ZXCVB', is_library=True)
+        sample = library.sample('SMPL_01 ZXCVB')
+        analysis_result = sample.analysis_result('module_1')
+        payload = {f'taxon_{i}': i for i in range(40 * 1000)}
+        analysis_result.field('field_1').set_data(payload)
+        with self.client:
+            response = self.client.get(
+                f'/api/v1/analysis_results/{str(analysis_result.uuid)}/field_1',
+                content_type='application/json',
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('success', data['status'])
+            self.assertEqual('field_1', data['data']['analysis_result_field']['field_name'])
+            self.assertEqual(payload, data['data']['data'])
+
+    def test_get_single_result_field_passes_through_gzip(self):  # pylint: disable=invalid-name
+        """Ensure compressed fields are sent as stored to clients accepting gzip."""
+        self.app.config['COMPRESS_FIELD_DATA'] = True
+        library = add_sample_group('LBRY_01 EDCRF', is_library=True)
+        sample = library.sample('SMPL_01 EDCRF')
+        analysis_result = sample.analysis_result('module_1')
+        payload = {f'taxon_{i}': i for i in range(40 * 1000)}
+        analysis_result.field('field_1').set_data(payload)
+        endpoint = f'/api/v1/analysis_results/{str(analysis_result.uuid)}/field_1'
+        with self.client:
+            response = self.client.get(endpoint, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual('gzip', response.headers['Content-Encoding'])
+            data = json.loads(gzip.decompress(response.data).decode())
+            self.assertEqual(payload, data['data']['data'])
+
+            response = self.client.get(endpoint)
+            self.assertNotIn('Content-Encoding', response.headers)
+            data = json.loads(response.data.decode())
+            self.assertEqual(payload, data['data']['data'])
+
+    def test_get_single_result_field_slice(self):
+        """Ensure a path into a chunked field is sliced like an inline one."""
+        library = add_sample_group('LBRY_01 QAZWS', is_library=True)
+        sample = library.sample('SMPL_01 QAZWS')
+        analysis_result = sample.analysis_result('module_1')
+        payload = {'taxa': {f'taxon_{i}': i for i in range(40 * 1000)}}
+        analysis_result.field('field_1').set_data(payload)
+        with self.client:
+            response = self.client.get(
+                f'/api/v1/analysis_results/{str(analysis_result.uuid)}/field_1?path=taxa.taxon_7',
+                content_type='application/json',
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(7, data['data']['data'])
+
+    def test_get_single_group_result_field_query_count(self):  # pylint: disable=invalid-name
+        """Ensure a group result field is read by uuid with a single query."""
+        library = add_sample_group('LBRY_01 TGBNH', is_library=True)
+        analysis_result = library.analysis_result('module_1')
+        analysis_result.field('field_1').set_data({'a': 1})
+        endpoint = f'/api/v1/analysis_results/{str(analysis_result.uuid)}/field_1'
+        for _ in range(2):  # Before and after the kind of the result is cached
+            db.session.expunge_all()
+            with self.client, count_queries() as statements:
+                response = self.client.get(endpoint, content_type='application/json')
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual({'a': 1}, data['data']['data'])
+            self.assertEqual(1, len(statements))
+
+    def test_get_missing_result(self):
+        """Ensure getting an analysis result that does not exist fails."""
+        with self.client:
+            response = self.client.get(f'/api/v1/analysis_results/{str(uuid4())}')
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get(f'/api/v1/analysis_results/{str(uuid4())}/field_1')
+            self.assertEqual(response.status_code, 404)
+
     def test_get_single_group_result(self):
         """Ensure get single analysis result behaves correctly."""
         library = add_sample_group('LBRY_01', is_library=True)
@@ -178,3 +439,53 @@ class TestAnalysisResultModule(BaseTestCase):
             self.assertIn('success', data['status'])
             self.assertIn('uuid', data['data']['analysis_result'])
             self.assertIn('module_name', data['data']['analysis_result'])
+
+    def test_get_all_results_paginated(self):
+        """Ensure all analysis results are listed a page at a time."""
+        library = add_sample_group('LBRY_01 PLOKI', is_library=True)
+        sample = library.sample('SMPL_01 PLOKI')
+        sample_results = {sample.analysis_result(f'module_{i}').uuid for i in range(3)}
+        group_result = library.analysis_result('module_1')
+        group_result.set_status('SUCCESS')
+        with self.client:
+            listed, cursor = [], None
+            while True:
+                query = '?limit=2' + (f'&cursor={cursor}' if cursor else '')
+                response = self.client.get(f'/api/v1/analysis_results{query}')
+                self.assertEqual(response.status_code, 200)
+                data = json.loads(response.data.decode())['data']
+                self.assertLessEqual(len(data['analysis_results']), 2)
+                listed += data['analysis_results']
+                cursor = data['next_cursor']
+                if not cursor:
+                    break
+            self.assertEqual(4, len(listed))
+            self.assertEqual(
+                {str(uuid) for uuid in sample_results} | {str(group_result.uuid)},
+                {result['uuid'] for result in listed},
+            )
+
+            response = self.client.get('/api/v1/analysis_results?kind=sample_group&status=SUCCESS')
+            data = json.loads(response.data.decode())['data']
+            self.assertEqual([str(group_result.uuid)], [r['uuid'] for r in data['analysis_results']])
+            self.assertEqual(str(library.uuid), data['analysis_results'][0]['parent_uuid'])
+
+            response = self.client.get('/api/v1/analysis_results?kind=sample&module_name=module_2')
+            data = json.loads(response.data.decode())['data']
+            self.assertEqual(1, len(data['analysis_results']))
+            self.assertEqual('module_2', data['analysis_results'][0]['module_name'])
+
+            response = self.client.get('/api/v1/analysis_results?cursor=foo')
+            self.assertEqual(response.status_code, 400)
+
+    def test_get_all_results_as_ndjson(self):
+        """Ensure all analysis results can be streamed one per line."""
+        library = add_sample_group('LBRY_01 UJNHY', is_library=True)
+        sample = library.sample('SMPL_01 UJNHY')
+        uuids = {str(sample.analysis_result(f'module_{i}').uuid) for i in range(3)}
+        with self.client:
+            response = self.client.get('/api/v1/analysis_results?format=ndjson')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual('application/x-ndjson', response.mimetype)
+            lines = response.data.decode().splitlines()
+            self.assertEqual(uuids, {json.loads(line)['uuid'] for line in lines})
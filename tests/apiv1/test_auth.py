@@ -5,9 +5,13 @@
 import json
 import time
 
+import jwt
+
+from app.authentication import Organization
+from app.authentication.user_cache import ACTIVE_USER_CACHE
 from app.extensions import db
 from ..base import BaseTestCase
-from ..utils import add_user, with_user
+from ..utils import add_user, assert_max_queries, with_user
 
 
 class TestAuthBlueprint(BaseTestCase):
@@ -141,6 +145,27 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 200)
 
+    def test_member_login_queries(self):
+        """Ensure logging in loads the organizations of every membership in one query."""
+        user = add_user('test', 'test+member@test.com', 'test')
+        org_names = ['Login Org 1', 'Login Org 2', 'Login Org 3']
+        for org_name in org_names:
+            Organization.from_user(user, org_name)
+        with self.client, assert_max_queries(4):
+            response = self.client.post(
+                '/api/v1/auth/login',
+                data=json.dumps(dict(
+                    email='test+member@test.com',
+                    password='test'
+                )),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        auth_token = json.loads(response.data.decode())['data']['auth_token']
+        payload = jwt.decode(auth_token, verify=False)
+        self.assertEqual(org_names, sorted(org['name'] for org in payload['membership']))
+        self.assertEqual({'admin'}, {org['roles'] for org in payload['membership']})
+
     def test_not_registered_user_login(self):
         """Ensure login fails without a registered user."""
         with self.client:
@@ -260,3 +285,19 @@ class TestAuthBlueprint(BaseTestCase):
             self.assertTrue(data['status'] == 'error')
             self.assertTrue(data['message'] == 'User is not active')
             self.assertEqual(response.status_code, 401)
+
+    @with_user
+    def test_active_user_cached(self, auth_headers, login_user):
+        """Ensure user activity is cached across requests until the user changes."""
+        with self.client:
+            for _ in range(3):
+                response = self.client.get('/api/v1/auth/logout', headers=auth_headers)
+                self.assertEqual(response.status_code, 200)
+            info = ACTIVE_USER_CACHE.info()
+            self.assertEqual(1, info['misses'])
+            self.assertEqual(2, info['hits'])
+
+            login_user.is_deleted = True
+            db.session.commit()
+            response = self.client.get('/api/v1/auth/logout', headers=auth_headers)
+            self.assertEqual(response.status_code, 401)
@@ -1,12 +1,18 @@
 """Test suite for Library module."""
 
+import datetime
 import json
 from io import BytesIO
+from unittest import mock
 
+import openpyxl
+from sqlalchemy.exc import IntegrityError
+
+from app.db_models import MetadataUploadJob, Sample, SampleGroup
 from app.extensions import db
 
 from ..base import BaseTestCase
-from ..utils import add_sample, add_sample_group, with_user
+from ..utils import add_sample, add_sample_group, assert_max_queries, with_user
 
 
 class TestLibraryModule(BaseTestCase):
@@ -32,3 +38,229 @@ class TestLibraryModule(BaseTestCase):
             self.assertEqual(response.status_code, 201)
             self.assertIn('success', data['status'])
             self.assertEqual(len(data['data']['updated_uuids']), 2)
+
+    @with_user
+    def test_upload_metadata_merges(self, auth_headers, *_):
+        """Ensure uploaded metadata is merged into samples in a fixed number of queries."""
+        library = add_sample_group(name='Library01')
+        library.sample('sample_00', metadata={'site': 'north', 'time': 'noon'})
+        rows = b''.join(f'sample_{i:02},morning,bench\n'.encode() for i in range(10))
+        metadata = b'sample_name,time,location\n' + rows
+        url = f'/api/v1/libraries/{library.uuid}/metadata'
+        with self.client, assert_max_queries(8):
+            response = self.client.post(
+                url,
+                headers=auth_headers,
+                data=dict(metadata=(BytesIO(metadata), 'metadata.csv')),
+                content_type='multipart/form-data'
+            )
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(data['data']['updated_uuids']), 10)
+        self.assertIn('store', data['data']['timing'])
+        samples = {sample.name: sample for sample in Sample.query.filter_by(library_uuid=library.uuid)}
+        self.assertEqual(10, len(samples))
+        self.assertEqual(
+            {'name': 'sample_00', 'site': 'north', 'time': 'morning', 'location': 'bench'},
+            samples['sample_00'].sample_metadata,
+        )
+        self.assertEqual(str(samples['sample_09'].uuid), data['data']['updated_uuids'][9])
+
+    @with_user
+    def test_upload_metadata_without_sample_names(self, auth_headers, *_):  # pylint: disable=invalid-name
+        """Ensure blank rows are skipped and rows without a sample name are refused."""
+        library = add_sample_group(name='Library07')
+        url = f'/api/v1/libraries/{library.uuid}/metadata'
+        with self.client:
+            response = self.client.post(
+                url,
+                headers=auth_headers,
+                data=dict(metadata=(BytesIO(b'sample_name,time\nsample_00,morning\n,\n'), 'metadata.csv')),
+                content_type='multipart/form-data'
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(1, len(json.loads(response.data.decode())['data']['updated_uuids']))
+
+            response = self.client.post(
+                url,
+                headers=auth_headers,
+                data=dict(metadata=(BytesIO(b'sample_name,time\n,evening\n'), 'metadata.csv')),
+                content_type='multipart/form-data'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Row 2', json.loads(response.data.decode())['message'])
+        self.assertEqual(
+            ['sample_00'],
+            [sample.name for sample in Sample.query.filter_by(library_uuid=library.uuid)],
+        )
+
+    @with_user
+    def test_upload_metadata_async(self, auth_headers, *_):
+        """Ensure metadata may be uploaded as a job whose progress can be polled."""
+        library = add_sample_group(name='Library02')
+        metadata = (b'sample_name,time,location\n'
+                    b'sample_00,morning,turnstile\n'
+                    b'sample_01,evening,bench\n') + b'x' * 300 + b',night,bench\n'
+        with self.client:
+            response = self.client.post(
+                f'/api/v1/libraries/{library.uuid}/metadata?async=true',
+                headers=auth_headers,
+                data=dict(metadata=(BytesIO(metadata), 'metadata.csv')),
+                content_type='multipart/form-data'
+            )
+            self.assertEqual(response.status_code, 202)
+            job = json.loads(response.data.decode())['data']['metadata_upload_job']
+
+            response = self.client.get(
+                f'/api/v1/libraries/{library.uuid}/metadata/jobs/{job["uuid"]}',
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 200)
+            job = json.loads(response.data.decode())['data']['metadata_upload_job']
+        self.assertEqual('ERROR', job['status'])
+        self.assertEqual(2, job['rows_processed'])
+        self.assertEqual(1, len(job['errors']))
+        self.assertEqual(4, job['errors'][0]['first_row'])
+        self.assertEqual(
+            ['sample_00', 'sample_01'],
+            sorted(sample.name for sample in Sample.query.filter_by(library_uuid=library.uuid)),
+        )
+
+    @with_user
+    def test_upload_metadata_async_failure(self, auth_headers, *_):  # pylint: disable=invalid-name
+        """Ensure a metadata upload job failing unexpectedly is finished with the error."""
+        library = add_sample_group(name='Library05')
+        metadata = b'sample_name,time\nsample_00,morning\n'
+        integrity_error = IntegrityError('INSERT', {}, Exception('duplicate key'))
+        with self.client, mock.patch.object(
+                SampleGroup, 'merge_sample_metadata', side_effect=integrity_error):
+            response = self.client.post(
+                f'/api/v1/libraries/{library.uuid}/metadata?async=true',
+                headers=auth_headers,
+                data=dict(metadata=(BytesIO(metadata), 'metadata.csv')),
+                content_type='multipart/form-data'
+            )
+            self.assertEqual(response.status_code, 202)
+            job_uuid = json.loads(response.data.decode())['data']['metadata_upload_job']['uuid']
+        job = MetadataUploadJob.from_uuid(job_uuid)
+        self.assertEqual('ERROR', job.status)
+        self.assertEqual(0, job.rows_processed)
+        self.assertIsNone(job.errors[0]['first_row'])
+        self.assertIn('duplicate key', job.errors[0]['message'])
+        self.assertIsNone(job.upload)
+        self.assertIsNotNone(job.finished_at)
+
+    @with_user
+    def test_upload_metadata_async_not_queued(self, auth_headers, *_):  # pylint: disable=invalid-name
+        """Ensure a metadata upload job that cannot be queued is not left pending."""
+        library = add_sample_group(name='Library06')
+        metadata = b'sample_name,time\nsample_00,morning\n'
+        with self.client, mock.patch(
+                'app.api.v1.sample_groups.ingest_metadata.delay', side_effect=OSError('no broker')):
+            response = self.client.post(
+                f'/api/v1/libraries/{library.uuid}/metadata?async=true',
+                headers=auth_headers,
+                data=dict(metadata=(BytesIO(metadata), 'metadata.csv')),
+                content_type='multipart/form-data'
+            )
+            self.assertEqual(response.status_code, 500)
+        job = MetadataUploadJob.query.filter_by(library_uuid=library.uuid).one()
+        self.assertEqual('ERROR', job.status)
+        self.assertIsNone(job.upload)
+
+    @with_user
+    def test_upload_metadata_xlsx(self, auth_headers, *_):
+        """Ensure xlsx metadata is read with typed cells."""
+        library = add_sample_group(name='Library03')
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(['sample_name', 'depth', 'collected', 'indoors', 'notes'])
+        sheet.append([101, 3.0, datetime.datetime(2018, 6, 1, 9, 30), True])
+        sheet.append([])
+        sheet.append(['sample_02', 2.5, None, False, 'wet'])
+        upload = BytesIO()
+        workbook.save(upload)
+        upload.seek(0)
+        with self.client:
+            response = self.client.post(
+                f'/api/v1/libraries/{library.uuid}/metadata',
+                headers=auth_headers,
+                data=dict(metadata=(upload, 'metadata.xlsx')),
+                content_type='multipart/form-data'
+            )
+            self.assertEqual(response.status_code, 201)
+        samples = {sample.name: sample for sample in Sample.query.filter_by(library_uuid=library.uuid)}
+        self.assertEqual(
+            {'name': '101', 'depth': 3, 'collected': '2018-06-01T09:30:00', 'indoors': True, 'notes': None},
+            samples['101'].sample_metadata,
+        )
+        self.assertEqual(2.5, samples['sample_02'].sample_metadata['depth'])
+
+    @with_user
+    def test_upload_metadata_xlsx_bad_headers(self, auth_headers, *_):  # pylint: disable=invalid-name
+        """Ensure xlsx metadata with empty or repeated column headers is refused."""
+        library = add_sample_group(name='Library08')
+        headers = {
+            'empty column header': ['sample_name', None, 'notes'],
+            'duplicate column header: notes': ['sample_name', 'notes', 'notes'],
+        }
+        for message, header in headers.items():
+            workbook = openpyxl.Workbook()
+            sheet = workbook.active
+            sheet.append(header)
+            sheet.append(['sample_01', 'dry', 'cold'])
+            upload = BytesIO()
+            workbook.save(upload)
+            upload.seek(0)
+            with self.client:
+                response = self.client.post(
+                    f'/api/v1/libraries/{library.uuid}/metadata',
+                    headers=auth_headers,
+                    data=dict(metadata=(upload, 'metadata.xlsx')),
+                    content_type='multipart/form-data'
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(message, json.loads(response.data.decode())['message'])
+
+    @with_user
+    def test_upload_metadata_csv_bad_headers(self, auth_headers, *_):  # pylint: disable=invalid-name
+        """Ensure csv metadata with empty or repeated column headers is refused."""
+        library = add_sample_group(name='Library09')
+        sheets = {
+            'empty column header': b'sample_name,,notes\nsample_01,dry,cold\n',
+            'duplicate column header: notes': b'sample_name,notes,notes\nsample_01,dry,cold\n',
+        }
+        with self.client:
+            for message, metadata in sheets.items():
+                response = self.client.post(
+                    f'/api/v1/libraries/{library.uuid}/metadata',
+                    headers=auth_headers,
+                    data=dict(metadata=(BytesIO(metadata), 'metadata.csv')),
+                    content_type='multipart/form-data'
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(message, json.loads(response.data.decode())['message'])
+
+    @with_user
+    def test_upload_metadata_tsv(self, auth_headers, *_):
+        """Ensure tab separated metadata may be uploaded."""
+        library = add_sample_group(name='Library04')
+        metadata = '\ufeffsample_name\ttime\nsample_00\tmorning\n'.encode('utf-8')
+        with self.client:
+            response = self.client.post(
+                f'/api/v1/libraries/{library.uuid}/metadata',
+                headers=auth_headers,
+                data=dict(metadata=(BytesIO(metadata), 'metadata.tsv')),
+                content_type='multipart/form-data'
+            )
+            self.assertEqual(response.status_code, 201)
+
+            response = self.client.post(
+                f'/api/v1/libraries/{library.uuid}/metadata',
+                headers=auth_headers,
+                data=dict(metadata=(BytesIO(b'not a workbook'), 'metadata.xlsx')),
+                content_type='multipart/form-data'
+            )
+            self.assertEqual(response.status_code, 400)
+        sample = Sample.query.filter_by(library_uuid=library.uuid).one()
+        self.assertEqual('morning', sample.sample_metadata['time'])
@@ -11,7 +11,7 @@ from app.authentication.models import User, Organization
 from app.db_models import SampleGroup
 
 from ..base import BaseTestCase
-from ..utils import add_user, add_sample_group, with_user
+from ..utils import add_user, add_sample_group, with_user, assert_max_queries
 
 
 class TestOrganizationModule(BaseTestCase):
@@ -181,6 +181,42 @@ class TestOrganizationModule(BaseTestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(len(data['data']['organizations']), 2)
 
+    def test_all_organizations_query_count(self):
+        """Ensure listing organizations runs a fixed number of queries."""
+        user = add_user('new_user QWCNT', 'new_user_QWCNT@test.com', 'somepassword')
+        for i in range(5):
+            org = Organization.from_user(user, f'Test Org {i} QWCNT')
+            add_sample_group(org=org)
+        with self.client, assert_max_queries(3):
+            response = self.client.get(
+                f'/api/v1/organizations',
+                content_type='application/json',
+            )
+        data = json.loads(response.data.decode())
+        self.assertEqual(len(data['data']['organizations']), 5)
+        for org in data['data']['organizations']:
+            self.assertEqual(len(org['organization']['users']), 1)
+            self.assertEqual(len(org['organization']['sample_group_uuids']), 1)
+
+    def test_organization_sample_groups_query_count(self):  # pylint: disable=invalid-name
+        """Ensure listing an organization's sample groups runs a fixed number of queries."""
+        user = add_user('new_user ZXCNT', 'new_user_ZXCNT@test.com', 'somepassword')
+        org = Organization.from_user(user, 'Test Org ZXCNT')
+        for _ in range(5):
+            group = add_sample_group(org=org)
+            group.sample('SMPL_01')
+            group.sample('SMPL_02')
+        url = f'/api/v1/organizations/{org.uuid}/sample_groups'
+        with self.client, assert_max_queries(3):
+            response = self.client.get(
+                url,
+                content_type='application/json',
+            )
+        data = json.loads(response.data.decode())
+        self.assertEqual(len(data['data']['sample_groups']), 5)
+        for group in data['data']['sample_groups']:
+            self.assertEqual(len(group['sample_group']['sample_uuids']), 2)
+
     @with_user
     def test_authorized_private_organization(self, auth_headers, login_user):
         """Ensure private organizatons show up in authorized user's list."""
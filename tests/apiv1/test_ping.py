@@ -4,6 +4,8 @@ import json
 
 from tests.base import BaseTestCase
 
+from ..utils import with_user
+
 
 class TestPingService(BaseTestCase):
     """Tests for the Users Service."""
@@ -15,3 +17,17 @@ class TestPingService(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('pong!', data['message'])
         self.assertIn('success', data['status'])
+
+    @with_user
+    def test_ping_reports_cache_counts(self, auth_headers, *_):
+        """Ensure /ping reports the hits and misses of the active user cache."""
+        with self.client:
+            for _ in range(3):
+                self.client.get('/api/v1/auth/logout', headers=auth_headers)
+            response = self.client.get('/api/v1/ping')
+        data = json.loads(response.data.decode())
+        self.assertEqual(response.status_code, 200)
+        active_users = data['caches']['active_users']
+        self.assertEqual(1, active_users['misses'])
+        self.assertEqual(2, active_users['hits'])
+        self.assertIn('weight', data['caches']['field_data'])
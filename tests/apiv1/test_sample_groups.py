@@ -1,17 +1,28 @@
 """Test suite for Sample Group module."""
 
 import json
+from io import BytesIO
 from unittest import mock
 from uuid import UUID, uuid4
 
+import numpy
+from scipy import sparse
 from sqlalchemy.orm.exc import NoResultFound
 
 from app import db
-from app.authentication import Organization
+from app.authentication import Organization, OrganizationMembership
 from app.db_models import Sample, SampleGroup
 
 from ..base import BaseTestCase
-from ..utils import add_sample, add_sample_group, with_user, add_user
+from ..utils import (
+    add_sample,
+    add_sample_group,
+    add_user,
+    assert_max_queries,
+    get_test_user,
+    login,
+    with_user,
+)
 
 from .utils import middleware_tester, get_analysis_result_with_data
 
@@ -44,6 +55,25 @@ class TestSampleGroupModule(BaseTestCase):
             sample_group = SampleGroup.query.filter_by(uuid=sample_group_id).one()
             self.assertTrue(sample_group.analysis_result)
 
+    def test_add_sample_group_trusted_token_roles(self):  # pylint: disable=invalid-name
+        """Ensure organization roles in auth tokens are trusted only when configured."""
+        admin = add_user('admin', 'admin@test.com', 'test')
+        org = Organization.from_user(admin, 'Test Org')
+        auth_headers, login_user = get_test_user(self.client)
+        org.add_user(login_user, role_in_org='write')
+        auth_headers = login(self.client, 'test@test.com', 'test')
+        OrganizationMembership.query.filter_by(user_uuid=login_user.uuid).delete()
+        db.session.commit()
+
+        response = self.create_group_for_organization(auth_headers, org.name)
+        self.assertEqual(response.status_code, 403)
+        self.app.config['TRUST_TOKEN_ROLES'] = True
+        try:
+            response = self.create_group_for_organization(auth_headers, org.name)
+        finally:
+            self.app.config['TRUST_TOKEN_ROLES'] = False
+        self.assertEqual(response.status_code, 201)
+
     def create_group_for_organization(self, auth_headers, organization_name):
         """Create sample group for organization."""
         group_name = 'The Most Sampled of Groups'
@@ -136,20 +166,161 @@ class TestSampleGroupModule(BaseTestCase):
         library = SampleGroup(name='mylibrary123123', organization_uuid=org.uuid, is_library=True).save()
         sample = library.sample('SMPL_01')
         sample_group = SampleGroup(name='mygrp123123', organization_uuid=org.uuid).save()
+        missing_uuid = uuid4()
         endpoint = f'/api/v1/sample_groups/{str(sample_group.uuid)}/samples'
         with self.client:
             response = self.client.post(
                 endpoint,
                 headers=auth_headers,
                 data=json.dumps(dict(
-                    sample_uuids=[str(sample.uuid)],
+                    sample_uuids=[str(sample.uuid), str(missing_uuid)],
+                )),
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 400)
+            data = json.loads(response.data.decode())
+            self.assertIn(str(missing_uuid), data['message'])
+            self.assertNotIn(sample.uuid, [samp.uuid for samp in sample_group.samples])
+
+            response = self.client.post(
+                endpoint,
+                headers=auth_headers,
+                data=json.dumps(dict(
+                    sample_uuids=[str(sample.uuid), str(missing_uuid)],
+                    allow_partial=True,
                 )),
                 content_type='application/json',
             )
             self.assertEqual(response.status_code, 200)
             data = json.loads(response.data.decode())
             self.assertIn('success', data['status'])
+            self.assertEqual(1, data['data']['added_count'])
+            self.assertEqual([str(missing_uuid)], data['data']['missing_uuids'])
+            self.assertEqual([str(sample.uuid)], data['data']['sample_group']['sample_uuids'])
             self.assertIn(sample.uuid, [samp.uuid for samp in sample_group.samples])
+            self.assertIn(sample.uuid, [samp.uuid for samp in library.samples])
+
+    @with_user
+    def test_add_samples_to_group_invalid_uuid(self, auth_headers, login_user):
+        """Ensure adding samples rejects uuids that are not strings."""
+        org = Organization.from_user(login_user, 'My Org 123INVU')
+        sample_group = SampleGroup(name='mygrpinvalid', organization_uuid=org.uuid).save()
+        with self.client:
+            response = self.client.post(
+                f'/api/v1/sample_groups/{str(sample_group.uuid)}/samples',
+                headers=auth_headers,
+                data=json.dumps(dict(sample_uuids=[12345])),
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 400)
+            data = json.loads(response.data.decode())
+            self.assertIn('Invalid Sample UUID.', data['message'])
+
+    @with_user
+    def test_add_derived_sample_group(self, auth_headers, login_user):
+        """Ensure a sample group can be derived from set operations on groups and metadata."""
+        org = Organization.from_user(login_user, 'My Org 123DERIV')
+        library = SampleGroup(name='mylibraryderiv', organization_uuid=org.uuid, is_library=True).save()
+        first = library.sample('SMPL_01', metadata={'site': 'gut', 'depth': 5})
+        second = library.sample('SMPL_02', metadata={'site': 'gut', 'depth': 20})
+        library.sample('SMPL_03', metadata={'site': 'skin', 'depth': 20})
+        expected_uuids = [str(first.uuid), str(second.uuid)]
+        library_uuid = str(library.uuid)
+        with self.client:
+            response = self.client.post(
+                '/api/v1/sample_groups/derived',
+                headers=auth_headers,
+                data=json.dumps(dict(
+                    name='myderivedgrp',
+                    organization_name='My Org 123DERIV',
+                    samples={'difference': [
+                        {'sample_group': library_uuid},
+                        {'metadata': {'site': 'skin'}},
+                        {'intersection': [
+                            {'metadata': {'depth__gt': 10}},
+                            {'metadata': {'site': 'skin'}},
+                        ]},
+                    ]},
+                )),
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 201)
+            data = json.loads(response.data.decode())['data']['sample_group']
+            self.assertEqual('myderivedgrp', data['name'])
+            self.assertEqual(2, data['sample_count'])
+            self.assertNotIn('sample_uuids', data)
+            derived = SampleGroup.query.filter_by(uuid=UUID(data['uuid'])).one()
+            self.assertEqual(sorted(expected_uuids), sorted(str(uuid) for uuid in derived.sample_uuids))
+
+            response = self.client.post(
+                '/api/v1/sample_groups/derived',
+                headers=auth_headers,
+                data=json.dumps(dict(
+                    name='myderivedgrp2',
+                    organization_name='My Org 123DERIV',
+                    samples={'union': [{'sample_group': str(uuid4())}]},
+                )),
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 404)
+
+            response = self.client.post(
+                '/api/v1/sample_groups/derived',
+                headers=auth_headers,
+                data=json.dumps(dict(
+                    name='myderivedgrp2',
+                    organization_name='My Org 123DERIV',
+                    samples={'sample_group': library_uuid, 'metadata': {}},
+                )),
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 400)
+
+    @with_user
+    def test_add_bulk_samples_to_library(self, auth_headers, login_user):
+        """Ensure many samples are created at once, leaving existing samples alone."""
+        org = Organization.from_user(login_user, 'My Org 123BULK')
+        library = SampleGroup(name='mylibrarybulk', organization_uuid=org.uuid, is_library=True).save()
+        existing = library.sample('SMPL_01', metadata={'site': 'old'})
+        existing_uuid = existing.uuid
+        endpoint = f'/api/v1/sample_groups/{str(library.uuid)}/samples/bulk'
+        with self.client:
+            response = self.client.post(
+                endpoint,
+                headers=auth_headers,
+                data=json.dumps(dict(samples=[
+                    {'name': 'SMPL_01', 'metadata': {'site': 'new'}},
+                    {'name': 'SMPL_02', 'metadata': {'site': 'new'}},
+                    {'name': 'SMPL_03'},
+                ])),
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 201)
+            data = json.loads(response.data.decode())['data']
+        self.assertEqual(['SMPL_02', 'SMPL_03'], sorted(data['created']))
+        self.assertEqual(str(existing_uuid), data['sample_uuids']['SMPL_01'])
+        samples = {sample.name: sample for sample in Sample.query.filter_by(library_uuid=library.uuid)}
+        self.assertEqual(3, len(samples))
+        self.assertEqual(str(samples['SMPL_02'].uuid), data['sample_uuids']['SMPL_02'])
+        self.assertEqual('old', samples['SMPL_01'].sample_metadata['site'])
+        self.assertEqual({'site': 'new', 'name': 'SMPL_02'}, samples['SMPL_02'].sample_metadata)
+
+    @with_user
+    def test_add_bulk_samples_invalid(self, auth_headers, login_user):
+        """Ensure malformed bulk sample payloads are rejected."""
+        org = Organization.from_user(login_user, 'My Org 123BULKX')
+        library = SampleGroup(name='mylibrarybulkx', organization_uuid=org.uuid, is_library=True).save()
+        endpoint = f'/api/v1/sample_groups/{str(library.uuid)}/samples/bulk'
+        with self.client:
+            for payload in ({}, {'samples': [{'metadata': {}}]}, {'samples': [{'name': 'A', 'metadata': 1}]}):
+                response = self.client.post(
+                    endpoint,
+                    headers=auth_headers,
+                    data=json.dumps(payload),
+                    content_type='application/json',
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(0, Sample.query.filter_by(library_uuid=library.uuid).count())
 
     @with_user
     def test_add_duplicate_sample_group(self, auth_headers, login_user):
@@ -203,6 +374,83 @@ class TestSampleGroupModule(BaseTestCase):
             self.assertIn('samples', data['data'])
             self.assertEqual(len(data['data']['samples']), 2)
 
+    def test_get_sample_group_samples_query_count(self):  # pylint: disable=invalid-name
+        """Ensure listing a group's samples runs a fixed number of queries."""
+        group = add_sample_group(name='Sample Group One')
+        for i in range(5):
+            group.sample(f'SMPL_{i:02}').analysis_result('module_1')
+        url = f'/api/v1/sample_groups/{str(group.uuid)}/samples'
+
+        with self.client, assert_max_queries(3):
+            response = self.client.get(
+                url,
+                content_type='application/json',
+            )
+        data = json.loads(response.data.decode())
+        self.assertEqual(len(data['data']['samples']), 5)
+        for sample in data['data']['samples']:
+            self.assertEqual(len(sample['sample']['analysis_result_uuids']), 1)
+
+    def test_get_sample_group_samples_pages(self):  # pylint: disable=invalid-name
+        """Ensure a group's samples are listed a page at a time."""
+        group = add_sample_group(name='Sample Group One')
+        names = [group.sample(f'SMPL_{i:02}').name for i in range(5)]
+        url = f'/api/v1/sample_groups/{str(group.uuid)}/samples'
+
+        listed, cursor = [], None
+        with self.client:
+            for _ in range(3):
+                query = f'?limit=2&cursor={cursor}' if cursor else '?limit=2'
+                response = self.client.get(url + query, content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                data = json.loads(response.data.decode())['data']
+                listed += [sample['sample']['name'] for sample in data['samples']]
+                cursor = data['next_cursor']
+        self.assertEqual(sorted(names), sorted(listed))
+        self.assertIsNone(cursor)
+
+    def test_get_sample_group_samples_fields(self):  # pylint: disable=invalid-name
+        """Ensure only the requested sample fields are listed."""
+        group = add_sample_group(name='Sample Group One')
+        sample = group.sample('SMPL_00')
+        sample.analysis_result('module_1')
+
+        with self.client:
+            response = self.client.get(
+                f'/api/v1/sample_groups/byname/{group.name}/samples?fields=uuid,name',
+                content_type='application/json',
+            )
+            data = json.loads(response.data.decode())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [{'sample': {'uuid': str(sample.uuid), 'name': 'SMPL_00'}}],
+                data['data']['samples'],
+            )
+
+            response = self.client.get(
+                f'/api/v1/sample_groups/{str(group.uuid)}/samples'
+                '?fields=analysis_result_uuids,sample_metadata',
+                content_type='application/json',
+            )
+            listed = json.loads(response.data.decode())['data']['samples'][0]
+            self.assertEqual(1, len(listed['sample']['analysis_result_uuids']))
+            self.assertEqual('SMPL_00', listed['sample_metadata']['name'])
+
+            sample._sample_metadata = None  # pylint: disable=protected-access
+            db.session.commit()
+            response = self.client.get(
+                f'/api/v1/sample_groups/{str(group.uuid)}/samples?fields=sample_metadata',
+                content_type='application/json',
+            )
+            listed = json.loads(response.data.decode())['data']['samples'][0]
+            self.assertEqual({}, listed['sample_metadata'])
+
+            response = self.client.get(
+                f'/api/v1/sample_groups/{str(group.uuid)}/samples?fields=uuid,secrets',
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 400)
+
     def _test_get_group_uuid_from_name(self):
         """Ensure get sample uuid behaves correctly."""
         user = add_user('new_user RRR', 'new_user_RRR@test.com', 'somepassword')
@@ -225,3 +473,69 @@ class TestSampleGroupModule(BaseTestCase):
             self.assertIn('success', data['status'])
             self.assertEqual(sample_group_uuid, data['data']['sample_group']['uuid'])
             self.assertEqual(sample_group_name, data['data']['sample_group']['name'])
+
+    def test_get_sample_group_field_matrix(self):
+        """Ensure a field of every sample is returned as one samples by taxa matrix."""
+        library = add_sample_group('LBRY_01 ZAQXS', is_library=True)
+        profiles = {'SMPL_01': {'taxon_a': 1, 'taxon_b': 2}, 'SMPL_02': {'taxon_b': 3}}
+        for sample_name, profile in profiles.items():
+            analysis_result = library.sample(sample_name).analysis_result('krakenhll')
+            analysis_result.field('report').set_data({'taxa': profile})
+        library.sample('SMPL_03').analysis_result('metaphlan2')
+        endpoint = f'/api/v1/sample_groups/{library.uuid}/analysis_results/krakenhll/report/matrix'
+        with self.client:
+            response = self.client.get(endpoint + '?path=taxa')
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode())['data']
+            self.assertEqual(['SMPL_01', 'SMPL_02'], data['samples'])
+            self.assertEqual(['taxon_a', 'taxon_b'], data['features'])
+            self.assertEqual(
+                [{'indices': [0, 1], 'values': [1, 2]}, {'indices': [1], 'values': [3]}],
+                data['rows'],
+            )
+
+            response = self.client.get(endpoint + '?path=taxa&format=npz')
+            self.assertEqual(response.status_code, 200)
+            npz_file = numpy.load(BytesIO(response.data))
+            self.assertEqual(['SMPL_01', 'SMPL_02'], npz_file['samples'].tolist())
+            self.assertEqual(['taxon_a', 'taxon_b'], npz_file['features'].tolist())
+            matrix = sparse.load_npz(BytesIO(response.data))
+            self.assertEqual([[1, 2], [0, 3]], matrix.toarray().tolist())
+
+            response = self.client.get(endpoint)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(
+                'Field data of sample SMPL_01 is not a map of feature names to numbers.',
+                json.loads(response.data.decode())['message'],
+            )
+
+    def test_get_sample_group_field_matrix_too_large(self):  # pylint: disable=invalid-name
+        """Ensure field matrices holding more than the allowed values are refused."""
+        library = add_sample_group('LBRY_01 MKOLP', is_library=True)
+        profiles = {
+            'SMPL_01': {'taxon_a': 1, 'taxon_b': 2, 'taxon_c': 3},
+            'SMPL_02': {'taxon_a': 4, 'taxon_b': 5},
+        }
+        for sample_name, profile in profiles.items():
+            analysis_result = library.sample(sample_name).analysis_result('krakenhll')
+            analysis_result.field('report').set_data(profile)
+        endpoint = f'/api/v1/sample_groups/{library.uuid}/analysis_results/krakenhll/report/matrix'
+        with self.client:
+            response = self.client.get(endpoint)
+            self.assertEqual(response.status_code, 400)
+            data = json.loads(response.data.decode())
+            self.assertIn('more than 4 values', data['message'])
+
+    def test_get_sample_group_module_coverage(self):  # pylint: disable=invalid-name
+        """Ensure per module coverage of a group's samples is returned."""
+        library = add_sample_group('LBRY_01 VFRCD', is_library=True)
+        library.sample('SMPL_01').analysis_result('m1')
+        library.sample('SMPL_02').analysis_result('m2')
+        library.sample('SMPL_02').analysis_result('m1')
+        with self.client:
+            response = self.client.get(f'/api/v1/sample_groups/{library.uuid}/module_coverage')
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode())['data']
+            self.assertEqual(2, data['sample_count'])
+            self.assertEqual({'m1': 2, 'm2': 1}, data['module_coverage'])
+            self.assertEqual(['m1'], data['tools_present'])
@@ -11,6 +11,7 @@ from ..base import BaseTestCase
 from ..utils import (
     add_sample,
     add_sample_group,
+    assert_max_queries,
     with_user,
 )
 
@@ -96,6 +97,83 @@ class TestSampleModule(BaseTestCase):
             self.assertIn('success', data['status'])
             self.assertEqual(len(data['data']['samples']), len(samples))
 
+    @with_user
+    def test_get_all_samples_visibility(self, auth_headers, login_user):  # pylint: disable=invalid-name
+        """Ensure only public samples and those of the user's organizations are listed."""
+        own = add_sample_group(owner=login_user, is_library=True)
+        own.is_public = False
+        own.save()
+        own.sample('SMPL_01 own')
+        hidden = add_sample_group(is_library=True)
+        hidden.is_public = False
+        hidden.save()
+        hidden.sample('SMPL_02 hidden')
+        add_sample_group(is_library=True).sample('SMPL_03 public')
+        with self.client, assert_max_queries(4):
+            response = self.client.get(
+                '/api/v1/samples',
+                headers=auth_headers,
+                content_type='application/json',
+            )
+        names = [sample['sample']['name'] for sample in json.loads(response.data.decode())['data']['samples']]
+        self.assertEqual(['SMPL_01 own', 'SMPL_03 public'], sorted(names))
+
+    @with_user
+    def test_get_all_samples_ndjson(self, auth_headers, login_user):
+        """Ensure visible samples may be streamed as NDJSON."""
+        library = add_sample_group(owner=login_user, is_library=True)
+        names = [library.sample(f'SMPL_{i:02}').name for i in range(5)]
+        with self.client:
+            response = self.client.get(
+                '/api/v1/samples?format=ndjson&fields=name',
+                headers=auth_headers,
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual('application/x-ndjson', response.mimetype)
+            lines = response.data.decode().splitlines()
+        self.assertEqual(sorted(names), sorted(json.loads(line)['sample']['name'] for line in lines))
+
+    def test_query_samples_by_metadata(self):
+        """Ensure samples are filtered by metadata in the database."""
+        library = add_sample_group(is_library=True)
+        library.sample('SMPL_01', metadata={'city': 'NYC', 'depth': 3, 'date': '2018-05-01'})
+        library.sample('SMPL_02', metadata={'city': 'LA', 'depth': '10.5', 'date': '2018-07-01'})
+        library.sample('SMPL_03', metadata={'city': 'Oslo', 'depth': 'unknown'})
+
+        def query(args):
+            with self.client:
+                response = self.client.get(f'/api/v1/samples/query?{args}')
+                self.assertEqual(response.status_code, 200)
+                samples = json.loads(response.data.decode())['data']['samples']
+                return sorted(sample['sample']['name'] for sample in samples)
+
+        self.assertEqual(['SMPL_01'], query('meta.city=NYC'))
+        self.assertEqual(['SMPL_01', 'SMPL_02'], query('meta.city__in=NYC,LA'))
+        self.assertEqual(['SMPL_01'], query('meta.depth=3'))
+        self.assertEqual(['SMPL_02'], query('meta.depth__gt=3'))
+        self.assertEqual(['SMPL_01', 'SMPL_02'], query('meta.depth__gte=3&meta.depth__lte=11'))
+        self.assertEqual(['SMPL_02'], query('meta.date__gte=2018-06-01'))
+        self.assertEqual([], query('meta.city=NYC&meta.depth__lt=2'))
+        for value in ('NaN', 'Infinity', '-Infinity', '1e999'):
+            self.assertEqual([], query(f'meta.depth={value}'))
+
+    @with_user
+    def test_query_samples_visibility(self, auth_headers, login_user):
+        """Ensure samples of private libraries are only found by members."""
+        library = add_sample_group(is_library=True)
+        library.sample('SMPL_01', metadata={'city': 'NYC'})
+        private = add_sample_group(is_library=True, owner=login_user)
+        private.is_public = False
+        private.save()
+        private.sample('SMPL_02', metadata={'city': 'NYC'})
+        with self.client:
+            response = self.client.get('/api/v1/samples/query?meta.city=NYC')
+            self.assertEqual(1, len(json.loads(response.data.decode())['data']['samples']))
+            response = self.client.get('/api/v1/samples/query?meta.city=NYC', headers=auth_headers)
+            self.assertEqual(2, len(json.loads(response.data.decode())['data']['samples']))
+            response = self.client.get('/api/v1/samples/query')
+            self.assertEqual(400, response.status_code)
+
     def test_get_single_sample_metadata(self):
         """Ensure get metadata for a single sample behaves correctly."""
         metadata = {'foo': 'bar'}
@@ -112,4 +190,4 @@ class TestSampleModule(BaseTestCase):
             sample = data['data']['sample']
             self.assertIn('uuid', sample)
             self.assertIn('name', sample)
-            self.assertEqual(sample['metadata'], metadata)
+            self.assertEqual(sample['metadata'], {**metadata, 'name': 'SMPL_01 HHHGJGH'})
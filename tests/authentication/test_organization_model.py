@@ -3,7 +3,7 @@
 from sqlalchemy.exc import IntegrityError
 
 from app import db
-from app.authentication import User, Organization
+from app.authentication import User, Organization, OrganizationMembership
 from ..base import BaseTestCase
 from ..utils import add_user
 
@@ -27,3 +27,16 @@ class TestOrganizationModel(BaseTestCase):
         user = add_user('justatest', 'test@test.com', 'test')
         Organization.from_user(user, 'Test Organization')
         self.assertRaises(IntegrityError, lambda: Organization.from_user(user, 'Test Organization'))
+
+    def test_has_role(self):
+        """Ensure membership roles grant themselves and every lesser role."""
+        admin = add_user('justatest', 'test@test.com', 'test')
+        writer = add_user('justatest2', 'test2@test.com', 'test')
+        outsider = add_user('justatest3', 'test3@test.com', 'test')
+        org = Organization.from_user(admin, 'Test Organization').add_user(writer, role_in_org='write')
+
+        self.assertTrue(OrganizationMembership.has_role(org.uuid, admin.uuid, 'admin'))
+        self.assertTrue(OrganizationMembership.has_role(org.uuid, writer.uuid, 'write'))
+        self.assertTrue(OrganizationMembership.has_role(org.uuid, writer.uuid, 'read'))
+        self.assertFalse(OrganizationMembership.has_role(org.uuid, writer.uuid, 'admin'))
+        self.assertFalse(OrganizationMembership.has_role(org.uuid, outsider.uuid, 'read'))
@@ -1,10 +1,16 @@
 """Test suite for User model."""
 
+import time
+
+from threading import Lock, Thread
+from unittest import mock
+
 from sqlalchemy.exc import IntegrityError
 
 from app import db
 from app.authentication.helpers import encode_auth_token, decode_auth_token
 from app.authentication import User
+from app.authentication.passwords import check_password, hash_password, reset_password_pool
 from ..base import BaseTestCase
 from ..utils import add_user
 
@@ -63,3 +69,38 @@ class TestUserModel(BaseTestCase):
         self.assertTrue(isinstance(auth_token, bytes))
         authn = decode_auth_token(auth_token)
         self.assertEqual(authn.sub, user.uuid)
+
+    def test_check_password(self):
+        """Ensure passwords are checked against their hashes."""
+        password_hash = hash_password('test')
+        self.assertTrue(check_password(password_hash, 'test'))
+        self.assertFalse(check_password(password_hash, 'wrong'))
+
+    def test_password_concurrency_bounded(self):
+        """Ensure no more than BCRYPT_MAX_WORKERS hashes run at once."""
+        self.app.config['BCRYPT_MAX_WORKERS'] = 2
+        reset_password_pool()
+        lock = Lock()
+        running = [0]
+        most_running = [0]
+
+        def slow_check(password_hash, password):  # pylint: disable=unused-argument
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return True
+
+        try:
+            with mock.patch('app.authentication.passwords.bcrypt.check_password_hash', slow_check):
+                check_password('hash', 'test')
+                threads = [Thread(target=check_password, args=('hash', 'test')) for _ in range(6)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            reset_password_pool()
+        self.assertEqual(2, most_running[0])
@@ -7,7 +7,10 @@ from flask_testing import TestCase
 from testing.postgresql import PostgresqlFactory
 
 from app import create_app, db
+from app.extensions import celery
 from app.config import app_config
+from app.authentication.user_cache import ACTIVE_USER_CACHE
+from app.db_models.name_cache import NAME_CACHE
 
 
 app = create_app()
@@ -34,6 +37,7 @@ class BaseTestCase(TestCase):
         """Create app configured for testing."""
         config_cls = app_config['testing']
         app.config.from_object(config_cls)
+        celery.update_from_app(app)
         return app
 
     def setUp(self):
@@ -42,6 +46,8 @@ class BaseTestCase(TestCase):
         app.config['SQLALCHEMY_DATABASE_URI'] = self.postgresql.url()
         db.create_all()
         db.session.commit()
+        NAME_CACHE.clear()
+        ACTIVE_USER_CACHE.clear()
 
         # Disable logging
         logging.disable(logging.CRITICAL)
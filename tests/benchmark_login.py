@@ -0,0 +1,123 @@
+"""Benchmark login throughput under concurrency.
+
+Run from the repository root against a scratch Postgres database:
+
+    DATABASE_TEST_URL=postgresql://... python -m tests.benchmark_login --gevent
+
+Logs in concurrently and pings the server alongside, reporting logins per
+second and ping latency. Pass --inline to check passwords on the calling
+greenlet or thread instead of the password pool, for comparison.
+"""
+
+import argparse
+import sys
+
+
+def parse_args():
+    """Return the benchmark options."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=32, help='logins to run')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--rounds', type=int, default=12, help='BCRYPT_LOG_ROUNDS')
+    parser.add_argument('--max-workers', type=int, default=4, help='BCRYPT_MAX_WORKERS')
+    parser.add_argument('--gevent', action='store_true', help='monkey patch with gevent first')
+    parser.add_argument('--inline', action='store_true', help='check passwords without the pool')
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+if ARGS.gevent:
+    from gevent import monkey
+    monkey.patch_all()
+
+# pylint: disable=wrong-import-position
+import json
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from app import create_app, db
+from app.api.v1 import auth
+from app.extensions import bcrypt
+from tests.utils import add_user
+# pylint: enable=wrong-import-position
+
+
+def login(app):
+    """Log in as the benchmark user."""
+    response = app.test_client().post(
+        '/api/v1/auth/login',
+        data=json.dumps(dict(email='bench@test.com', password='bench')),
+        content_type='application/json',
+    )
+    assert response.status_code == 200, response.data
+
+
+def ping(app, interval=0.01):
+    """Wait interval seconds, then ping the server.
+
+    Return the seconds taken beyond interval, including any time this client
+    could not run.
+    """
+    start = time.perf_counter()
+    time.sleep(interval)
+    app.test_client().get('/api/v1/ping')
+    return time.perf_counter() - start - interval
+
+
+def main():
+    """Run the benchmark and print its results."""
+    app = create_app('testing')
+    app.config['BCRYPT_LOG_ROUNDS'] = ARGS.rounds
+    app.config['BCRYPT_MAX_WORKERS'] = ARGS.max_workers
+    with app.app_context():
+        db.create_all()
+        add_user('bench', 'bench@test.com', 'bench')
+        db.session.remove()
+
+    def run():
+        """Return the elapsed seconds and ping latencies of the logins."""
+        latencies = []
+        finished = []
+
+        def pinger():
+            """Ping the server until the logins are done."""
+            while not finished:
+                latencies.append(ping(app))
+
+        with ThreadPoolExecutor(max_workers=1) as pings, \
+                ThreadPoolExecutor(max_workers=ARGS.concurrency) as clients:
+            pinging = pings.submit(pinger)
+            start = time.perf_counter()
+            logins = [clients.submit(login, app) for _ in range(ARGS.logins)]
+            for future in logins:
+                future.result()
+            elapsed = time.perf_counter() - start
+            finished.append(True)
+            pinging.result()
+        return elapsed, sorted(latencies)
+
+    try:
+        if ARGS.inline:
+            with mock.patch.object(auth, 'check_password', bcrypt.check_password_hash):
+                elapsed, latencies = run()
+        else:
+            elapsed, latencies = run()
+    finally:
+        with app.app_context():
+            db.drop_all()
+
+    mode = 'inline' if ARGS.inline else f'pool of {ARGS.max_workers}'
+    print(f'{ARGS.logins} logins, {ARGS.concurrency} clients, '
+          f'{ARGS.rounds} rounds, {"gevent" if ARGS.gevent else "threads"}, {mode}')
+    print(f'  {ARGS.logins / elapsed:.1f} logins/s')
+    if latencies:
+        worst = latencies[-1] * 1000
+        median = latencies[len(latencies) // 2] * 1000
+        print(f'  ping median {median:.1f} ms, worst {worst:.1f} ms over {len(latencies)} pings')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -29,11 +29,12 @@ class TestSampleGroupModel(BaseTestCase):
     def test_add_samples(self):
         """Ensure that samples can be added to SampleGroup."""
         sample_group = add_sample_group('Sample Group One')
+        library = add_sample_group('Library One', is_library=True)
         sample_one = Sample(name='SMPL_01',
-                            library_uuid=uuid4(),
+                            library_uuid=library.uuid,
                             metadata={'subject_group': 1})
         sample_two = Sample(name='SMPL_02',
-                            library_uuid=uuid4(),
+                            library_uuid=library.uuid,
                             metadata={'subject_group': 4})
         sample_group.samples = [sample_one, sample_two]
         db.session.commit()
@@ -46,3 +47,34 @@ class TestSampleGroupModel(BaseTestCase):
         self.assertEqual(len(samples), 2)
         self.assertIn(sample_one, samples)
         self.assertIn(sample_two, samples)
+        self.assertEqual(set(sample_uuids), set(library.sample_uuids))
+
+    def test_add_samples_by_uuid(self):
+        """Ensure samples are added by uuid, reporting uuids matching no sample."""
+        library = add_sample_group('Library One', is_library=True)
+        samples = [library.sample(f'SMPL_{i:02}') for i in range(3)]
+        sample_group = add_sample_group('Sample Group One')
+        missing_uuid = uuid4()
+
+        added, missing = sample_group.add_samples([samples[0].uuid, samples[1].uuid, missing_uuid])
+        db.session.commit()
+        self.assertEqual(2, added)
+        self.assertEqual([missing_uuid], missing)
+
+        added, missing = sample_group.add_samples([sample.uuid for sample in samples])
+        db.session.commit()
+        self.assertEqual(1, added)
+        self.assertEqual([], missing)
+        self.assertEqual({sample.uuid for sample in samples}, set(sample_group.sample_uuids))
+        self.assertEqual(3, len(library.sample_uuids))
+
+    def test_tools_present(self):
+        """Ensure tools present are the modules with a result for every sample."""
+        library = add_sample_group('LBRY_01 CDEWS', is_library=True)
+        for sample_name, module_names in [('SMPL_01', ['m1', 'm2']), ('SMPL_02', ['m1'])]:
+            sample = library.sample(sample_name)
+            for module_name in module_names:
+                sample.analysis_result(module_name)
+        self.assertEqual(['m1'], library.tools_present)
+        self.assertEqual((2, {'m1': 2, 'm2': 1}), library.module_coverage())
+        self.assertEqual((0, {}), add_sample_group('Sample Group Two').module_coverage())
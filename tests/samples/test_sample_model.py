@@ -1,8 +1,11 @@
 """Test suite for Sample model."""
 
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import NoResultFound
 
 from app.db_models import Sample
+from app.db_models.name_cache import NAME_CACHE
+from app.extensions import db
 from tests.base import BaseTestCase
 
 from ..utils import add_sample_group
@@ -41,3 +44,21 @@ class TestSampleModel(BaseTestCase):
         duplicate = Sample(name='SMPL_01 UIY', library_uuid=library2.uuid).save()
         self.assertEqual(original.name, duplicate.name)
         self.assertNotEqual(original.library_uuid, duplicate.library_uuid)
+
+    def test_uuid_from_name_is_cached(self):
+        """Ensure sample uuids are cached by name until the sample changes."""
+        library = add_sample_group('LBRY_01 MNBVC', is_library=True)
+        self.assertRaises(NoResultFound, Sample.uuid_from_name_library, 'SMPL_01 MNBVC', library.uuid)
+        sample = library.sample('SMPL_01 MNBVC')
+        self.assertEqual(sample.uuid, Sample.uuid_from_name_library(sample.name, library.uuid))
+        self.assertEqual(1, len(NAME_CACHE))
+
+        sample.name = 'SMPL_02 MNBVC'
+        sample.save()
+        self.assertEqual(0, len(NAME_CACHE))
+        self.assertRaises(NoResultFound, Sample.uuid_from_name_library, 'SMPL_01 MNBVC', library.uuid)
+        self.assertEqual(sample.uuid, Sample.uuid_from_name_library(sample.name, library.uuid))
+
+        db.session.delete(sample)
+        db.session.commit()
+        self.assertEqual(0, len(NAME_CACHE))
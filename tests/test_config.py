@@ -52,6 +52,7 @@ class TestTestingConfig(TestCase):
         self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 4)
         self.assertTrue(app.config['TOKEN_EXPIRATION_DAYS'] == 0)
         self.assertTrue(app.config['TOKEN_EXPIRATION_SECONDS'] == 3)
+        self.assertTrue(app.config['MAX_INLINE_FIELD_LENGTH'] == 10 * 1000)
         self.assertTrue(
             app.config['SECRET_KEY'] ==
             os.environ.get('SECRET_KEY')
@@ -4,8 +4,11 @@ import datetime
 import json
 from uuid import uuid4
 
+from contextlib import contextmanager
 from functools import wraps
 
+from sqlalchemy import event
+
 from app import db
 from app.authentication import User, PasswordAuthentication, Organization
 from app.db_models import Sample, SampleGroup
@@ -15,7 +18,7 @@ ALPHABET = 'abcdefghijklmnopqrstuvwxyz'
 
 
 def rand_string(n=10):
-    return ''.join(choices(ALPHABET, k=1))
+    return ''.join(choices(ALPHABET, k=n))
 
 
 def add_user(username, email, password, created_at=datetime.datetime.utcnow()):
@@ -64,24 +67,54 @@ def add_sample_group(name=None, owner=None, org_name=None, is_library=False, org
     return group
 
 
-def get_test_user(client):
-    """Return auth headers and a test user."""
-    login_user = add_user('test', 'test@test.com', 'test')
+@contextmanager
+def count_queries():
+    """Collect the SQL statements executed within the block in the yielded list."""
+    statements = []
+
+    def record(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+        """Record the statement about to be executed."""
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """Fail if the block executes more than max_queries SQL statements."""
+    with count_queries() as statements:
+        yield statements
+    assert len(statements) <= max_queries, \
+        f'{len(statements)} queries executed, expected at most {max_queries}:\n' + \
+        '\n'.join(statements)
+
+
+def login(client, email, password):
+    """Return auth headers for the user with email."""
     with client:
         resp_login = client.post(
             '/api/v1/auth/login',
             data=json.dumps(dict(
-                email='test@test.com',
-                password='test'
+                email=email,
+                password=password
             )),
             content_type='application/json'
         )
-        auth_headers = dict(
+        return dict(
             Authorization='Bearer ' + json.loads(
                 resp_login.data.decode()
             )['data']['auth_token']
         )
 
+
+def get_test_user(client):
+    """Return auth headers and a test user."""
+    login_user = add_user('test', 'test@test.com', 'test')
+    auth_headers = login(client, 'test@test.com', 'test')
     return auth_headers, login_user
 
 